@@ -1,17 +1,37 @@
 import psycopg2
+import psycopg2.extras
+import psycopg2.pool
 from psycopg2.extras import RealDictCursor
-from flask import Flask, request, jsonify, send_from_directory, render_template, redirect, session, g, Response
+from flask import Flask, request, jsonify, send_from_directory, render_template, redirect, session, g, Response, stream_with_context, has_request_context
+from flask.cli import AppGroup
 from flask_cors import CORS
+import click
 import os
 import datetime
 import io
 import csv
+import base64
+import json
+import queue
+import select
+import zlib
 import re
 import traceback
 import logging
+import logging.handlers
+import random
 import hashlib
-from functools import wraps
-from collections import defaultdict
+import threading
+import time
+from functools import wraps, lru_cache
+from collections import defaultdict, OrderedDict, Counter
+
+import sqlite_backend
+
+try:
+    import numpy as np
+except ImportError:  # нужен только симулятору выплат (requirements-sim.txt)
+    np = None
 
 # --- CONFIGURATION ---
 logging.basicConfig(level=logging.INFO)
@@ -27,24 +47,598 @@ app.config['AVATAR_UPLOAD_FOLDER'] = AVATAR_UPLOAD_FOLDER
 
 
 # --- DATABASE MANAGEMENT ---
+# Пул соединений создается лениво в каждом воркере (gunicorn форкает процесс после импорта),
+# поэтому соединения никогда не разделяются между процессами.
+DB_POOL_MIN_SIZE = int(os.environ.get('DB_POOL_MIN_SIZE', 1))
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', 10))
+DB_POOL_MAX_USES = int(os.environ.get('DB_POOL_MAX_USES', 1000))  # 0 - не пересоздавать соединения
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))  # сек. ожидания свободного соединения
+DB_POOL_PING_INTERVAL = float(os.environ.get('DB_POOL_PING_INTERVAL', 30))  # SELECT 1 после простоя, сек.
+
+# 'postgres' (переменные DB_*) или 'sqlite' - встроенная база в файле SQLITE_PATH для одного узла.
+# SQLite рассчитан на один процесс с потоками (gunicorn --workers 1 --threads N): события SSE
+# доставляются только внутри процесса. ASGI-режим (asgi.py) работает только с PostgreSQL.
+DB_BACKEND = os.environ.get('DB_BACKEND', 'postgres')
+SQLITE_PATH = os.environ.get('SQLITE_PATH', DB_PATH)
+SQLITE_BUSY_TIMEOUT = float(os.environ.get('SQLITE_BUSY_TIMEOUT', 5))  # сек. ожидания блокировки записи
+
+
+def _connect():
+    if DB_BACKEND == 'sqlite':
+        os.makedirs(os.path.dirname(SQLITE_PATH) or '.', exist_ok=True)
+        return sqlite_backend.connect(SQLITE_PATH, busy_timeout=SQLITE_BUSY_TIMEOUT, on_notify=_deliver_local_event,
+                                      cursor_class=InstrumentedSQLiteCursor)
+    return psycopg2.connect(
+        host=os.environ.get('DB_HOST'),
+        database=os.environ.get('DB_NAME'),
+        user=os.environ.get('DB_USER'),
+        password=os.environ.get('DB_PASSWORD'),
+        port=os.environ.get('DB_PORT'),
+        cursor_factory=InstrumentedCursor
+    )
+
+
+def execute_values(cursor, query, argslist, **kwargs):
+    """psycopg2.extras.execute_values или его аналог для курсора SQLite."""
+    if isinstance(cursor, sqlite_backend.SQLiteCursor):
+        return sqlite_backend.execute_values(cursor, query, argslist, **kwargs)
+    return psycopg2.extras.execute_values(cursor, query, argslist, **kwargs)
+
+
+class ConnectionPool:
+    """Thread-safe connection pool with health checks on checkout and recycling after max_uses."""
+
+    def __init__(self, connect, min_size=1, max_size=10, max_uses=1000, timeout=10, ping_interval=30):
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max(max_size, 1)
+        self.max_uses = max_uses
+        self.timeout = timeout
+        self.ping_interval = ping_interval
+        self._cond = threading.Condition()
+        self._idle = []  # [(conn, uses, last_used)]
+        self._uses = {}  # id(conn) -> количество выдач для соединений, находящихся в работе
+        self._size = 0  # открытые соединения: свободные + выданные + подключающиеся
+        self._stats = defaultdict(int)
+        for _ in range(min(min_size, self.max_size)):
+            self._idle.append((self._new_connection(), 0, time.monotonic()))
+            self._size += 1
+
+    def _new_connection(self):
+        conn = self._connect()
+        with self._cond:
+            self._stats['created'] += 1
+        return conn
+
+    def _release_slot(self, conn, reason):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+        with self._cond:
+            self._size -= 1
+            self._stats[reason] += 1
+            self._cond.notify()
+
+    def _is_healthy(self, conn, last_used):
+        if conn.closed or conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            return False
+        if self.ping_interval and time.monotonic() - last_used > self.ping_interval:
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+                conn.rollback()
+            except psycopg2.Error:
+                return False
+        return True
+
+    def _reserve(self):
+        """Возвращает свободное соединение или (None, 0, 0), если занят слот под новое."""
+        deadline = time.monotonic() + self.timeout
+        with self._cond:
+            while True:
+                if self._idle:
+                    return self._idle.pop()
+                if self._size < self.max_size:
+                    self._size += 1
+                    return None, 0, 0
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise psycopg2.pool.PoolError("connection pool exhausted")
+                self._stats['waits'] += 1
+                self._cond.wait(remaining)
+
+    def getconn(self):
+        while True:
+            conn, uses, last_used = self._reserve()
+            if conn is None:
+                try:
+                    conn = self._new_connection()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+                break
+            if self._is_healthy(conn, last_used):
+                break
+            self._release_slot(conn, 'failed_checks')
+
+        with self._cond:
+            self._uses[id(conn)] = uses + 1
+            self._stats['checkouts'] += 1
+        return conn
+
+    def putconn(self, conn, discard=False):
+        with self._cond:
+            uses = self._uses.pop(id(conn), 0)
+
+        if not discard and not conn.closed and conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                discard = True
+
+        if discard or conn.closed:
+            self._release_slot(conn, 'discarded')
+        elif self.max_uses and uses >= self.max_uses:
+            self._release_slot(conn, 'recycled')
+        else:
+            with self._cond:
+                self._idle.append((conn, uses, time.monotonic()))
+                self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'max_uses': self.max_uses,
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': len(self._uses),
+                **{key: self._stats[key] for key in ('created', 'checkouts', 'waits', 'timeouts', 'failed_checks', 'recycled', 'discarded')}
+            }
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                _pool = ConnectionPool(
+                    _connect,
+                    min_size=DB_POOL_MIN_SIZE,
+                    max_size=DB_POOL_MAX_SIZE,
+                    max_uses=DB_POOL_MAX_USES,
+                    timeout=DB_POOL_TIMEOUT,
+                    ping_interval=DB_POOL_PING_INTERVAL
+                )
+                _pool_pid = os.getpid()
+    return _pool
+
+
 def get_db():
     db = getattr(g, '_database', None)
     if db is None:
-        db = g._database = psycopg2.connect(
-            host=os.environ.get('DB_HOST'),
-            database=os.environ.get('DB_NAME'),
-            user=os.environ.get('DB_USER'),
-            password=os.environ.get('DB_PASSWORD'),
-            port=os.environ.get('DB_PORT'),
-            cursor_factory=RealDictCursor
-        )
+        db = g._database = get_pool().getconn()
     return db
 
 @app.teardown_appcontext
 def close_connection(exception):
-    db = getattr(g, '_database', None)
+    db = g.pop('_database', None)
     if db is not None:
-        db.close()
+        # Незавершенная транзакция откатывается в putconn; разорванное соединение в пул не вернется
+        get_pool().putconn(db, discard=isinstance(exception, psycopg2.OperationalError))
+
+
+# --- QUERY INSTRUMENTATION ---
+# Курсоры обоих бэкендов считают запросы, время в БД и прочитанные строки текущего HTTP-запроса (g._db_stats).
+# После ответа статистика попадает в метрики воркера (/api/system/metrics, текстовый формат Prometheus)
+# с меткой эндпоинта Flask. Запрос, выполнивший один и тот же SQL больше QUERY_REPEAT_WARN раз, логируется как N+1.
+QUERY_REPEAT_WARN = int(os.environ.get('QUERY_REPEAT_WARN', 10))  # 0 - не проверять
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100)
+
+_SQL_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+
+@lru_cache(maxsize=1024)
+def statement_shape(query):
+    """Форма запроса: литералы заменены на ?, пробелы схлопнуты (для запросов с подставленными значениями)."""
+    if isinstance(query, bytes):
+        query = query.decode(errors='replace')
+    return ' '.join(_SQL_LITERALS.sub('?', query[:2000]).split())
+
+
+class RequestDbStats:
+    """Запросы к БД одного HTTP-запроса."""
+    __slots__ = ('queries', 'db_time', 'rows', 'statements')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.rows = 0
+        self.statements = Counter()  # текст запроса -> сколько раз выполнен
+
+    def repeated(self, threshold):
+        """[(форма, число выполнений)] для форм, выполненных больше threshold раз."""
+        shapes = Counter()
+        for query, count in self.statements.items():
+            shapes[statement_shape(query)] += count
+        return [(shape, count) for shape, count in shapes.items() if count > threshold]
+
+
+def _request_db_stats():
+    return g.get('_db_stats') if has_request_context() else None
+
+
+class _QueryStatsMixin:
+    """Учет запросов и строк в g._db_stats; вне HTTP-запроса (фоновые потоки) ничего не делает."""
+
+    def execute(self, query, params=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, params)
+        finally:
+            self._record_query(query, params, time.perf_counter() - started)
+
+    def executemany(self, query, params_seq):
+        started = time.perf_counter()
+        try:
+            return super().executemany(query, params_seq)
+        finally:
+            self._record_query(query, None, time.perf_counter() - started)
+
+    def _record_query(self, query, params, elapsed):
+        stats = _request_db_stats()
+        if stats is not None:
+            stats.queries += 1
+            stats.db_time += elapsed
+            stats.statements[query] += 1
+        if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS:
+            record_slow_query(query, params, elapsed)
+
+    def _count_rows(self, count):
+        stats = _request_db_stats()
+        if stats is not None:
+            stats.rows += count
+
+    def fetchone(self):
+        row = super().fetchone()
+        self._count_rows(row is not None)
+        return row
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(size)
+        self._count_rows(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        self._count_rows(len(rows))
+        return rows
+
+
+class InstrumentedCursor(_QueryStatsMixin, RealDictCursor):
+    pass
+
+
+class InstrumentedSQLiteCursor(_QueryStatsMixin, sqlite_backend.SQLiteCursor):
+    pass
+
+
+class MetricsRegistry:
+    """Счетчики и гистограммы воркера в памяти; render() отдает их в текстовом формате Prometheus."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._meta = {}  # имя -> (тип, описание, границы корзин)
+        self._values = {}  # (имя, метки) -> число или [счетчики корзин..., сумма, количество]
+
+    def counter(self, name, description):
+        self._meta[name] = ('counter', description, None)
+
+    def histogram(self, name, description, buckets):
+        self._meta[name] = ('histogram', description, buckets)
+
+    def inc(self, name, labels, value=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        buckets = self._meta[name][2]
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            series = self._values.setdefault(key, [0] * (len(buckets) + 2))
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        with self._lock:
+            values = {key: list(value) if isinstance(value, list) else value for key, value in self._values.items()}
+
+        def fmt(labels, extra=()):
+            pairs = [f'{k}="{v}"' for k, v in (*labels, *extra)]
+            return '{' + ','.join(pairs) + '}' if pairs else ''
+
+        lines = []
+        for name, (kind, description, buckets) in sorted(self._meta.items()):
+            lines += [f"# HELP {name} {description}", f"# TYPE {name} {kind}"]
+            for (series_name, labels), value in sorted(values.items()):
+                if series_name != name:
+                    continue
+                if kind == 'counter':
+                    lines.append(f"{name}{fmt(labels)} {value}")
+                    continue
+                for bound, count in zip(buckets, value):
+                    lines.append(f"{name}_bucket{fmt(labels, [('le', bound)])} {count}")
+                lines.append(f"{name}_bucket{fmt(labels, [('le', '+Inf')])} {value[-1]}")
+                lines.append(f"{name}_sum{fmt(labels)} {value[-2]}")
+                lines.append(f"{name}_count{fmt(labels)} {value[-1]}")
+        return '\n'.join(lines) + '\n'
+
+
+metrics = MetricsRegistry()
+metrics.counter('albion_http_requests_total', 'HTTP requests by endpoint, method and status.')
+metrics.histogram('albion_http_request_duration_seconds', 'Handler wall time per request.', LATENCY_BUCKETS)
+metrics.histogram('albion_db_time_seconds', 'Time spent in database calls per request.', LATENCY_BUCKETS)
+metrics.histogram('albion_db_queries_per_request', 'Database statements executed per request.', QUERY_COUNT_BUCKETS)
+metrics.counter('albion_db_queries_total', 'Database statements executed.')
+metrics.counter('albion_db_rows_fetched_total', 'Rows fetched from the database.')
+metrics.counter('albion_db_repeated_statements_total', 'Requests that ran one statement shape more than QUERY_REPEAT_WARN times.')
+
+
+def record_request_metrics(endpoint, method, status, duration, stats):
+    """Переносит статистику завершенного запроса в метрики и предупреждает о повторяющихся запросах (N+1)."""
+    labels = {'endpoint': endpoint}
+    metrics.inc('albion_http_requests_total', {'endpoint': endpoint, 'method': method, 'status': status})
+    metrics.observe('albion_http_request_duration_seconds', labels, duration)
+    metrics.observe('albion_db_time_seconds', labels, stats.db_time)
+    metrics.observe('albion_db_queries_per_request', labels, stats.queries)
+    metrics.inc('albion_db_queries_total', labels, stats.queries)
+    metrics.inc('albion_db_rows_fetched_total', labels, stats.rows)
+    if QUERY_REPEAT_WARN:
+        for shape, count in stats.repeated(QUERY_REPEAT_WARN):
+            metrics.inc('albion_db_repeated_statements_total', labels)
+            logger.warning(f"Possible N+1 in {endpoint}: statement executed {count} times: {shape[:300]}")
+
+# --- SLOW QUERY LOG ---
+# Включается SLOW_QUERY_MS > 0: запросы дольше порога пишутся (нормализованный SQL, параметры без строковых
+# значений, эндпоинт, длительность) в ротируемый JSON-lines файл SLOW_QUERY_LOG. Для SELECT фоновый поток
+# на отдельном соединении снимает план: EXPLAIN (ANALYZE, BUFFERS) в откатываемой транзакции с statement_timeout
+# (в SQLite - EXPLAIN QUERY PLAN), не чаще раза в SLOW_QUERY_EXPLAIN_INTERVAL секунд на форму запроса
+# и с вероятностью SLOW_QUERY_EXPLAIN_SAMPLE. Запросы обработчиков не ждут ни записи, ни EXPLAIN.
+# ANALYZE выполняет запрос повторно, поэтому план снимается только для простого чтения (_explainable):
+# без записи, блокировок строк и функций вне _EXPLAIN_FUNCTIONS (pg_advisory_*, pg_notify и т.п.),
+# и никогда - для запросов миграций.
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 0))  # 0 - журнал выключен
+SLOW_QUERY_LOG = os.environ.get('SLOW_QUERY_LOG', 'data/slow_queries.log')
+SLOW_QUERY_LOG_MAX_BYTES = int(os.environ.get('SLOW_QUERY_LOG_MAX_BYTES', 5 * 1024 * 1024))
+SLOW_QUERY_LOG_BACKUPS = int(os.environ.get('SLOW_QUERY_LOG_BACKUPS', 3))
+SLOW_QUERY_EXPLAIN_SAMPLE = float(os.environ.get('SLOW_QUERY_EXPLAIN_SAMPLE', 1.0))  # доля запросов с EXPLAIN
+SLOW_QUERY_EXPLAIN_INTERVAL = float(os.environ.get('SLOW_QUERY_EXPLAIN_INTERVAL', 300))
+SLOW_QUERY_EXPLAIN_TIMEOUT_MS = int(os.environ.get('SLOW_QUERY_EXPLAIN_TIMEOUT_MS', 10000))
+SLOW_QUERY_QUEUE_SIZE = 100
+SLOW_QUERY_PARAMS_MAX_CHARS = 1000
+# Журнал читает основатель любой гильдии: строки параметров (коды, ники, комментарии) в него не попадают,
+# а у входа/регистрации параметры не пишутся вовсе
+SLOW_QUERY_SECRET_ENDPOINTS = frozenset({'login', 'logout_endpoint'})
+_PLAN_STRINGS = re.compile(r"'(?:[^']|'')*'")
+
+# Функции и ключевые слова перед "(", допустимые в простом чтении; любой другой вызов исключает запрос из EXPLAIN
+_EXPLAIN_FUNCTIONS = frozenset({
+    'count', 'sum', 'avg', 'min', 'max', 'coalesce', 'nullif', 'round', 'lower', 'upper', 'length', 'trim',
+    'greatest', 'least', 'date_trunc', 'row_number', 'rank', 'dense_rank', 'array', 'array_agg', 'unnest',
+    'string_agg', 'bool_or', 'bool_and', 'cast', 'extract', 'now', 'make_interval', 'to_regclass', 'abs',
+    'floor', 'ceil', 'exists', 'any', 'in', 'over', 'filter', 'values',
+    'select', 'from', 'join', 'on', 'where', 'and', 'or', 'not', 'as', 'with', 'recursive', 'when', 'then',
+    'else', 'by', 'between', 'having', 'using', 'union', 'all', 'is', 'distinct', 'lateral', 'window', 'rows',
+})
+_EXPLAIN_WRITES = re.compile(r"\b(INSERT|UPDATE|DELETE|MERGE|INTO|LOCK|SHARE|COPY|CALL|DO)\b", re.IGNORECASE)
+_EXPLAIN_CALLS = re.compile(r"(?<!\bAS )\b(\w+)\s*\(", re.IGNORECASE)
+
+slow_query_log = logging.getLogger('app.slow_queries')
+slow_query_log.propagate = False
+_slow_queries = queue.Queue(maxsize=SLOW_QUERY_QUEUE_SIZE)
+# explaining=True в потоке EXPLAIN: его запросы не журналируются; migrating=True - запросы миграций без EXPLAIN
+_slow_query_local = threading.local()
+_slow_query_worker_pid = None
+_slow_query_lock = threading.Lock()
+
+
+def _redact_params(params):
+    """repr параметров для журнала: числа, даты и NULL как есть, строки - только длина."""
+    def redact(value):
+        if isinstance(value, (str, bytes)):
+            return f"<{type(value).__name__}:{len(value)}>"
+        if isinstance(value, (list, tuple)):
+            return [redact(item) for item in value]
+        if isinstance(value, dict):
+            return {key: redact(item) for key, item in value.items()}
+        return value
+    return repr(redact(params))[:SLOW_QUERY_PARAMS_MAX_CHARS]
+
+
+def record_slow_query(query, params, elapsed):
+    """Ставит медленный запрос в очередь фонового потока; при переполненной очереди запись теряется."""
+    if getattr(_slow_query_local, 'explaining', False):
+        return
+    endpoint = request.endpoint if has_request_context() else f"thread:{threading.current_thread().name}"
+    entry = {
+        'time': datetime.datetime.now().isoformat(timespec='seconds'),
+        'endpoint': endpoint,
+        'duration_ms': round(elapsed * 1000, 2),
+        'sql': statement_shape(query),
+        'params': _redact_params(params) if params is not None and endpoint not in SLOW_QUERY_SECRET_ENDPOINTS else None,
+    }
+    explain = (not getattr(_slow_query_local, 'migrating', False) and endpoint not in SLOW_QUERY_SECRET_ENDPOINTS
+               and _explainable(query))
+    _ensure_slow_query_worker()
+    try:
+        _slow_queries.put_nowait((entry, query, params, explain))
+    except queue.Full:
+        pass
+
+
+@lru_cache(maxsize=1024)
+def _explainable(query):
+    """Запрос - простое чтение: SELECT/WITH без записи, блокировок и функций вне _EXPLAIN_FUNCTIONS."""
+    if isinstance(query, bytes):
+        query = query.decode(errors='replace')
+    query = _SQL_LITERALS.sub('?', query).strip()
+    if not query.upper().startswith(('SELECT', 'WITH')) or _EXPLAIN_WRITES.search(query):
+        return False
+    return all(name.lower() in _EXPLAIN_FUNCTIONS for name in _EXPLAIN_CALLS.findall(query))
+
+
+def explain_query(conn, query, params):
+    """Строки плана запроса; транзакция всегда откатывается."""
+    if isinstance(query, bytes):
+        query = query.decode()
+    cursor = conn.cursor()
+    try:
+        if DB_BACKEND == 'sqlite':
+            cursor.execute(f"EXPLAIN QUERY PLAN {query}", params)
+            return [row['detail'] for row in cursor.fetchall()]
+        cursor.execute("SET LOCAL statement_timeout = %s", (SLOW_QUERY_EXPLAIN_TIMEOUT_MS,))
+        cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS) {query}", params)
+        return [row['QUERY PLAN'] for row in cursor.fetchall()]
+    finally:
+        conn.rollback()
+        if DB_BACKEND != 'sqlite' and not conn.closed:
+            # Сессионные advisory-блокировки не снимаются откатом
+            conn.cursor().execute("SELECT pg_advisory_unlock_all()")
+            conn.rollback()
+
+
+def _slow_query_loop():
+    _slow_query_local.explaining = True
+    explained_at = {}  # форма запроса -> время последнего EXPLAIN
+    conn = None
+    while True:
+        entry, query, params, explain = _slow_queries.get()
+        now = time.monotonic()
+        if (explain
+                and now - explained_at.get(entry['sql'], -SLOW_QUERY_EXPLAIN_INTERVAL) >= SLOW_QUERY_EXPLAIN_INTERVAL
+                and random.random() < SLOW_QUERY_EXPLAIN_SAMPLE):
+            explained_at[entry['sql']] = now
+            try:
+                if conn is None or conn.closed:
+                    conn = _connect()
+                # Значения параметров попадают в условия плана: строки в нем тоже скрываются
+                entry['plan'] = [_PLAN_STRINGS.sub("'?'", line) for line in explain_query(conn, query, params)]
+            except Exception as e:
+                entry['plan_error'] = str(e)
+                if conn is not None:
+                    conn.close()
+                conn = None
+        slow_query_log.info(json.dumps(entry, default=str, ensure_ascii=False))
+
+
+def _ensure_slow_query_worker():
+    global _slow_query_worker_pid
+    if _slow_query_worker_pid == os.getpid():
+        return
+    with _slow_query_lock:
+        if _slow_query_worker_pid == os.getpid():
+            return
+        if not slow_query_log.handlers:
+            os.makedirs(os.path.dirname(SLOW_QUERY_LOG) or '.', exist_ok=True)
+            handler = logging.handlers.RotatingFileHandler(
+                SLOW_QUERY_LOG, maxBytes=SLOW_QUERY_LOG_MAX_BYTES, backupCount=SLOW_QUERY_LOG_BACKUPS, encoding='utf-8')
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            slow_query_log.addHandler(handler)
+            slow_query_log.setLevel(logging.INFO)
+        threading.Thread(target=_slow_query_loop, name='slow-query-explain', daemon=True).start()
+        _slow_query_worker_pid = os.getpid()
+
+
+def read_slow_queries(limit, endpoint=None):
+    """Последние limit записей журнала (с ротированными файлами), новые первыми."""
+    entries = []
+    for path in [SLOW_QUERY_LOG] + [f"{SLOW_QUERY_LOG}.{i}" for i in range(1, SLOW_QUERY_LOG_BACKUPS + 1)]:
+        try:
+            with open(path, encoding='utf-8') as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            continue
+        for line in reversed(lines):
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if endpoint and entry.get('endpoint') != endpoint:
+                continue
+            entries.append(entry)
+            if len(entries) >= limit:
+                return entries
+    return entries
+
+
+# --- AUTHENTICATED IDENTITY ---
+# id/status/guild_id текущего игрока загружаются один раз за запрос и кешируются между запросами
+# в ограниченном LRU с коротким TTL. Кеш локален для воркера: изменения, сделанные другим воркером,
+# становятся видны не позже чем через IDENTITY_CACHE_TTL секунд.
+IDENTITY_CACHE_TTL = float(os.environ.get('IDENTITY_CACHE_TTL', 30))
+IDENTITY_CACHE_SIZE = int(os.environ.get('IDENTITY_CACHE_SIZE', 1024))
+
+_identity_cache = OrderedDict()  # player_id -> (expires_at, identity)
+_identity_lock = threading.Lock()
+
+
+def get_identity():
+    """Returns {'id', 'status', 'guild_id'} of the logged-in player, or None."""
+    if 'player_id' not in session:
+        return None
+    player_id = session['player_id']
+
+    identity = g.get('_identity')
+    if identity is not None and identity['id'] == player_id:
+        return identity
+
+    now = time.monotonic()
+    with _identity_lock:
+        entry = _identity_cache.get(player_id)
+        if entry is not None and entry[0] > now:
+            _identity_cache.move_to_end(player_id)
+            identity = entry[1]
+
+    if identity is None:
+        cursor = get_db().cursor()
+        cursor.execute("SELECT id, status, guild_id FROM players WHERE id = %s", (player_id,))
+        row = cursor.fetchone()
+        if not row:
+            return None
+        identity = {'id': row['id'], 'status': row['status'], 'guild_id': row['guild_id']}
+        with _identity_lock:
+            _identity_cache[player_id] = (now + IDENTITY_CACHE_TTL, identity)
+            _identity_cache.move_to_end(player_id)
+            while len(_identity_cache) > IDENTITY_CACHE_SIZE:
+                _identity_cache.popitem(last=False)
+
+    g._identity = dict(identity)
+    return g._identity
+
+
+def invalidate_identity(player_id):
+    """Сбрасывает закешированную личность игрока после изменения его статуса, гильдии или наставника."""
+    with _identity_lock:
+        _identity_cache.pop(player_id, None)
+    identity = g.get('_identity')
+    if identity is not None and identity['id'] == player_id:
+        g.pop('_identity')
+
 
 # --- AUTH DECORATORS ---
 def management_required(f):
@@ -52,11 +646,7 @@ def management_required(f):
     def decorated_function(*args, **kwargs):
         if 'player_id' not in session:
             return jsonify({'status': 'error', 'message': 'Authentication required'}), 401
-        player_id = session['player_id']
-        db = get_db()
-        cursor = db.cursor()
-        cursor.execute("SELECT status, guild_id FROM players WHERE id = %s", (player_id,))
-        player = cursor.fetchone()
+        player = get_identity()
         if not player:
             return jsonify({'status': 'error', 'message': 'Player not found'}), 401
         if player['status'] not in ['founder', 'mentor']:
@@ -72,10 +662,7 @@ def login_required(f):
         if 'player_id' not in session:
             return jsonify({'status': 'error', 'message': 'Authentication required'}), 401
         
-        db = get_db()
-        cursor = db.cursor()
-        cursor.execute("SELECT id, status, guild_id FROM players WHERE id = %s", (session['player_id'],))
-        player = cursor.fetchone()
+        player = get_identity()
 
         if not player:
             session.pop('player_id', None) # Clean up invalid session
@@ -115,9 +702,7 @@ def privilege_required(f):
         if 'player_id' not in session:
             return jsonify({'status': 'error', 'message': 'Authentication required'}), 401
         player_id = session['player_id']
-        cursor = get_db().cursor()
-        cursor.execute("SELECT status, guild_id FROM players WHERE id = %s", (player_id,))
-        player = cursor.fetchone()
+        player = get_identity()
         if not player or player['status'] not in ['mentor', 'founder', 'наставник']:
             return jsonify({'status': 'error', 'message': 'Доступ запрещен. Требуются права Наставника, Ментора или Основателя.'}), 403
         
@@ -128,252 +713,1003 @@ def privilege_required(f):
     return decorated_function
 
 
-# --- DATABASE INITIALIZATION (PostgreSQL Version) ---
-# --- DATABASE INITIALIZATION (PostgreSQL Version) ---
-def init_db():
-    with app.app_context():
-        db = get_db()
+# --- SCHEMA MIGRATIONS ---
+# Версионированные миграции: каждая применяется один раз и записывается в schema_migrations.
+# Шаги идемпотентны (IF NOT EXISTS), поэтому база, созданная старым init_db, догоняется без ручных правок.
+# Применяются командой `flask db upgrade` при деплое (или при старте процесса, если DB_AUTO_MIGRATE=1:
+# gunicorn.conf.py, asgi.py, python app.py). Запросы пользователей миграции не выполняют.
+DB_AUTO_MIGRATE = os.environ.get('DB_AUTO_MIGRATE', '0') == '1'
+MIGRATION_LOCK_KEY = 7310420  # pg_advisory_lock: миграции одновременно выполняет только один процесс
+
+MIGRATIONS = []
+
+
+def migration(version, name, transactional=True):
+    """
+    Регистрирует шаг миграции up(db).
+    transactional=False - шаг выполняется в autocommit (нужно для CREATE INDEX CONCURRENTLY).
+    """
+    def decorator(func):
+        MIGRATIONS.append({'version': version, 'name': name, 'transactional': transactional, 'up': func})
+        MIGRATIONS.sort(key=lambda m: m['version'])
+        return func
+    return decorator
+
+
+def get_pending_migrations(cursor):
+    """Возвращает еще не примененные миграции по возрастанию версии."""
+    cursor.execute("SELECT to_regclass('schema_migrations') IS NOT NULL AS present")
+    if not cursor.fetchone()['present']:
+        return list(MIGRATIONS)
+    cursor.execute("SELECT version FROM schema_migrations")
+    applied = {row['version'] for row in cursor.fetchall()}
+    return [m for m in MIGRATIONS if m['version'] not in applied]
+
+
+def run_migrations():
+    """Применяет все ожидающие миграции на отдельном соединении. Возвращает список примененных версий."""
+    db = _connect()
+    applied = []
+    _slow_query_local.migrating = True
+    try:
+        db.autocommit = True
         cursor = db.cursor()
+        _migration_lock(db, acquire=True)
+        try:
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            ''')
+            # Список читается уже под блокировкой: параллельный процесс мог применить часть миграций
+            for step in get_pending_migrations(cursor):
+                logger.info(f"Applying migration {step['version']:04d}_{step['name']}...")
+                db.autocommit = not step['transactional']
+                try:
+                    step['up'](db)
+                    db.cursor().execute(
+                        "INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+                        (step['version'], step['name'])
+                    )
+                    if step['transactional']:
+                        db.commit()
+                except Exception:
+                    if not db.autocommit:
+                        db.rollback()
+                    raise
+                finally:
+                    db.autocommit = True
+                applied.append(step['version'])
+        finally:
+            _migration_lock(db, acquire=False)
+    finally:
+        _slow_query_local.migrating = False
+        db.close()
+    return applied
 
-        # Создаем таблицу гильдий (нет зависимостей)
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS guilds (
-            id SERIAL PRIMARY KEY,
-            name TEXT UNIQUE NOT NULL,
-            code TEXT NOT NULL,
-            founder_code TEXT,
-            mentor_code TEXT,
-            tutor_code TEXT,
-            kill_fame INTEGER DEFAULT 0,
-            death_fame INTEGER DEFAULT 0,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        ''')
-
-        # Создаем таблицу игроков (зависит от guilds)
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS players (
-            id SERIAL PRIMARY KEY,
-            nickname TEXT UNIQUE NOT NULL,
-            guild_id INTEGER NOT NULL,
-            status TEXT DEFAULT 'active',
-            balance INTEGER DEFAULT 0,
-            mentor_id INTEGER,
-            description TEXT,
-            avatar_url TEXT,
-            specialization TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (guild_id) REFERENCES guilds(id) ON DELETE CASCADE,
-            FOREIGN KEY (mentor_id) REFERENCES players(id) ON DELETE SET NULL
-        )
-        ''')
-
-        # >>> ИСПРАВЛЕНИЕ: Таблица online_activity перенесена сюда, ПОСЛЕ создания players
-        # Создаем таблицу активности (зависит от players)
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS online_activity (
-            player_id INTEGER PRIMARY KEY,
-            last_seen TIMESTAMP NOT NULL,
-            FOREIGN KEY (player_id) REFERENCES players(id) ON DELETE CASCADE
-        )
-        ''')
-        
-        # Проверка и добавление колонки 'specialization' в 'players'
-        cursor.execute("""
-            SELECT column_name
-            FROM information_schema.columns
-            WHERE table_name = 'players' AND column_name = 'specialization';
-        """)
-        if cursor.fetchone() is None:
-            logger.info("Adding 'specialization' column to 'players' table.")
-            cursor.execute("ALTER TABLE players ADD COLUMN specialization TEXT")
-
-        # Создаем таблицу контента (нет зависимостей)
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS content (
-            id SERIAL PRIMARY KEY,
-            name TEXT UNIQUE NOT NULL
-        )
-        ''')
-
-        # Создаем таблицу сессий (зависит от players и content)
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS sessions (
-            id SERIAL PRIMARY KEY,
-            player_id INTEGER NOT NULL,
-            content_id INTEGER NOT NULL,
-            score REAL NOT NULL,
-            role TEXT NOT NULL,
-            error_types TEXT,
-            work_on TEXT,
-            comments TEXT,
-            mentor_id INTEGER,
-            session_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (player_id) REFERENCES players(id) ON DELETE CASCADE,
-            FOREIGN KEY (content_id) REFERENCES content(id),
-            FOREIGN KEY (mentor_id) REFERENCES players(id)
-        )
-        ''')
-
-        # Создаем таблицу рекомендаций (зависит от players)
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS recommendations (
-            id SERIAL PRIMARY KEY,
-            player_id INTEGER NOT NULL,
-            title TEXT NOT NULL,
-            description TEXT,
-            priority TEXT DEFAULT 'medium',
-            status TEXT DEFAULT 'pending',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (player_id) REFERENCES players(id) ON DELETE CASCADE
-        )
-        ''')
-
-        # Создаем таблицу целей (зависит от players и content)
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS goals (
-            id SERIAL PRIMARY KEY,
-            player_id INTEGER NOT NULL,
-            created_by_id INTEGER,
-            title TEXT NOT NULL,
-            description TEXT,
-            status TEXT DEFAULT 'in_progress',
-            due_date TIMESTAMP,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            metric TEXT,
-            metric_target REAL,
-            metric_start_value REAL,
-            metric_content_id INTEGER,
-            metric_role TEXT,
-            FOREIGN KEY (player_id) REFERENCES players(id) ON DELETE CASCADE,
-            FOREIGN KEY (created_by_id) REFERENCES players(id) ON DELETE SET NULL,
-            FOREIGN KEY (metric_content_id) REFERENCES content(id) ON DELETE SET NULL
-        )
-        ''')
-
-        # Создаем таблицу запросов помощи (зависит от players и guilds)
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS help_requests (
-            id SERIAL PRIMARY KEY,
-            player_id INTEGER NOT NULL,
-            guild_id INTEGER NOT NULL,
-            status TEXT DEFAULT 'pending',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (player_id) REFERENCES players(id) ON DELETE CASCADE,
-            FOREIGN KEY (guild_id) REFERENCES guilds(id) ON DELETE CASCADE
-        )
-        ''')
 
-        # Проверка и добавление колонок в таблицу 'goals'
-        cursor.execute("""
-            SELECT column_name
-            FROM information_schema.columns
-            WHERE table_name = 'goals' AND column_name = 'metric';
-        """)
-        if cursor.fetchone() is None:
-            logger.info("Adding dynamic metric columns to 'goals' table.")
-            cursor.execute("ALTER TABLE goals ADD COLUMN metric TEXT")
-            cursor.execute("ALTER TABLE goals ADD COLUMN metric_target REAL")
-            cursor.execute("ALTER TABLE goals ADD COLUMN metric_start_value REAL")
-            cursor.execute("ALTER TABLE goals ADD COLUMN metric_content_id INTEGER")
-            cursor.execute("ALTER TABLE goals ADD COLUMN metric_role TEXT")
-
-        # Заполняем таблицу гильдий, если она пуста
-        cursor.execute("SELECT COUNT(*) FROM guilds")
-        if cursor.fetchone()['count'] == 0:
-            guilds_data = [
-                ("Grey Knights", "GK123", "FOUNDERGK_UIO123", "MENTORGK_UIO942", "TUTORGK_UIO051"),
-                ("Mure", "MURE456", "FOUNDERMURE_UIO321", "MENTORMURE_UIO249", "TUTORMURE_UIO150")
+def _migration_lock(db, acquire):
+    """pg_advisory_lock/unlock по MIGRATION_LOCK_KEY; у SQLite - flock файла рядом с базой."""
+    if DB_BACKEND == 'sqlite':
+        (db.advisory_lock if acquire else db.advisory_unlock)(MIGRATION_LOCK_KEY)
+    else:
+        db.cursor().execute(f"SELECT pg_advisory_{'lock' if acquire else 'unlock'}(%s)", (MIGRATION_LOCK_KEY,))
+
+
+def _create_index_concurrently(db, name, definition):
+    """CREATE INDEX CONCURRENTLY с удалением невалидного остатка прерванной прошлой попытки."""
+    cursor = db.cursor()
+    if DB_BACKEND == 'sqlite':
+        # SQLite строит индекс в одной транзакции: невалидных остатков не бывает
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {definition}")
+        return
+    cursor.execute("""
+        SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relname = %s AND NOT i.indisvalid
+    """, (name,))
+    if cursor.fetchone():
+        logger.warning(f"Dropping invalid index {name} left by an interrupted build.")
+        cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+    cursor.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {definition}")
+
+
+@migration(1, 'baseline')
+def _migration_baseline(db):
+    """Базовые таблицы и начальные данные (бывший init_db)."""
+    cursor = db.cursor()
+    # Создаем таблицу гильдий (нет зависимостей)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS guilds (
+        id SERIAL PRIMARY KEY,
+        name TEXT UNIQUE NOT NULL,
+        code TEXT NOT NULL,
+        founder_code TEXT,
+        mentor_code TEXT,
+        tutor_code TEXT,
+        kill_fame INTEGER DEFAULT 0,
+        death_fame INTEGER DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+
+    # Создаем таблицу игроков (зависит от guilds)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS players (
+        id SERIAL PRIMARY KEY,
+        nickname TEXT UNIQUE NOT NULL,
+        guild_id INTEGER NOT NULL,
+        status TEXT DEFAULT 'active',
+        balance INTEGER DEFAULT 0,
+        mentor_id INTEGER,
+        description TEXT,
+        avatar_url TEXT,
+        specialization TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (guild_id) REFERENCES guilds(id) ON DELETE CASCADE,
+        FOREIGN KEY (mentor_id) REFERENCES players(id) ON DELETE SET NULL
+    )
+    ''')
+
+    # >>> ИСПРАВЛЕНИЕ: Таблица online_activity перенесена сюда, ПОСЛЕ создания players
+    # Создаем таблицу активности (зависит от players)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS online_activity (
+        player_id INTEGER PRIMARY KEY,
+        last_seen TIMESTAMP NOT NULL,
+        FOREIGN KEY (player_id) REFERENCES players(id) ON DELETE CASCADE
+    )
+    ''')
+    
+    # Колонки, добавленные после первых релизов (старые базы создавались без них)
+    cursor.execute("ALTER TABLE players ADD COLUMN IF NOT EXISTS specialization TEXT")
+
+    # Создаем таблицу контента (нет зависимостей)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS content (
+        id SERIAL PRIMARY KEY,
+        name TEXT UNIQUE NOT NULL
+    )
+    ''')
+
+    # Создаем таблицу сессий (зависит от players и content)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS sessions (
+        id SERIAL PRIMARY KEY,
+        player_id INTEGER NOT NULL,
+        content_id INTEGER NOT NULL,
+        score REAL NOT NULL,
+        role TEXT NOT NULL,
+        error_types TEXT,
+        work_on TEXT,
+        comments TEXT,
+        mentor_id INTEGER,
+        session_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (player_id) REFERENCES players(id) ON DELETE CASCADE,
+        FOREIGN KEY (content_id) REFERENCES content(id),
+        FOREIGN KEY (mentor_id) REFERENCES players(id)
+    )
+    ''')
+
+    # Создаем таблицу рекомендаций (зависит от players)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS recommendations (
+        id SERIAL PRIMARY KEY,
+        player_id INTEGER NOT NULL,
+        title TEXT NOT NULL,
+        description TEXT,
+        priority TEXT DEFAULT 'medium',
+        status TEXT DEFAULT 'pending',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (player_id) REFERENCES players(id) ON DELETE CASCADE
+    )
+    ''')
+
+    # Создаем таблицу целей (зависит от players и content)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS goals (
+        id SERIAL PRIMARY KEY,
+        player_id INTEGER NOT NULL,
+        created_by_id INTEGER,
+        title TEXT NOT NULL,
+        description TEXT,
+        status TEXT DEFAULT 'in_progress',
+        due_date TIMESTAMP,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        metric TEXT,
+        metric_target REAL,
+        metric_start_value REAL,
+        metric_content_id INTEGER,
+        metric_role TEXT,
+        FOREIGN KEY (player_id) REFERENCES players(id) ON DELETE CASCADE,
+        FOREIGN KEY (created_by_id) REFERENCES players(id) ON DELETE SET NULL,
+        FOREIGN KEY (metric_content_id) REFERENCES content(id) ON DELETE SET NULL
+    )
+    ''')
+
+    # Создаем таблицу запросов помощи (зависит от players и guilds)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS help_requests (
+        id SERIAL PRIMARY KEY,
+        player_id INTEGER NOT NULL,
+        guild_id INTEGER NOT NULL,
+        status TEXT DEFAULT 'pending',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (player_id) REFERENCES players(id) ON DELETE CASCADE,
+        FOREIGN KEY (guild_id) REFERENCES guilds(id) ON DELETE CASCADE
+    )
+    ''')
+
+    # Динамические метрики целей
+    cursor.execute("""
+        ALTER TABLE goals
+            ADD COLUMN IF NOT EXISTS metric TEXT,
+            ADD COLUMN IF NOT EXISTS metric_target REAL,
+            ADD COLUMN IF NOT EXISTS metric_start_value REAL,
+            ADD COLUMN IF NOT EXISTS metric_content_id INTEGER,
+            ADD COLUMN IF NOT EXISTS metric_role TEXT
+    """)
+
+    # Заполняем таблицу гильдий, если она пуста
+    cursor.execute("SELECT COUNT(*) FROM guilds")
+    if cursor.fetchone()['count'] == 0:
+        guilds_data = [
+            ("Grey Knights", "GK123", "FOUNDERGK_UIO123", "MENTORGK_UIO942", "TUTORGK_UIO051"),
+            ("Mure", "MURE456", "FOUNDERMURE_UIO321", "MENTORMURE_UIO249", "TUTORMURE_UIO150")
+        ]
+        for name, code, founder_code, mentor_code, tutor_code in guilds_data:
+            hashed_code = hashlib.sha256(code.encode()).hexdigest()
+            hashed_founder_code = hashlib.sha256(founder_code.encode()).hexdigest()
+            hashed_mentor_code = hashlib.sha256(mentor_code.encode()).hexdigest()
+            hashed_tutor_code = hashlib.sha256(tutor_code.encode()).hexdigest()
+            cursor.execute(
+                "INSERT INTO guilds (name, code, founder_code, mentor_code, tutor_code) VALUES (%s, %s, %s, %s, %s)",
+                (name, hashed_code, hashed_founder_code, hashed_mentor_code, hashed_tutor_code)
+            )
+
+    # Заполняем таблицу контента, если она пуста
+    cursor.execute("SELECT COUNT(*) FROM content")
+    if cursor.fetchone()['count'] == 0:
+        contents = ['Замки', 'Клаймы', 'Открытый мир', 'HG 5v5', 'Авалон', 'Скримы']
+        cursor.executemany("INSERT INTO content (name) VALUES (%s)", [(c,) for c in contents])
+
+    # Заполняем таблицу игроков, если она пуста
+    cursor.execute("SELECT COUNT(*) FROM players")
+    if cursor.fetchone()['count'] == 0:
+        cursor.execute("SELECT id FROM guilds WHERE name = 'Grey Knights'")
+        grey_knights_id_row = cursor.fetchone()
+        cursor.execute("SELECT id FROM guilds WHERE name = 'Mure'")
+        mure_id_row = cursor.fetchone()
+
+        if grey_knights_id_row and mure_id_row:
+            grey_knights_id = grey_knights_id_row['id']
+            mure_id = mure_id_row['id']
+
+            players_to_insert = [
+                ("CORPUS", grey_knights_id, "founder", None, "Основатель гильдии Grey Knights", None, 'D-Tank/E-Tank'),
+                ("lympeen", grey_knights_id, "mentor", 1, "Ментор альянса", None, 'Support'),
+                ("VoldeDron", grey_knights_id, "active", 2, "Активный участник", None, None),
+                ("misterhe111", mure_id, "founder", None, "Основатель гильдии Mure", None, 'Healer')
             ]
-            for name, code, founder_code, mentor_code, tutor_code in guilds_data:
-                hashed_code = hashlib.sha256(code.encode()).hexdigest()
-                hashed_founder_code = hashlib.sha256(founder_code.encode()).hexdigest()
-                hashed_mentor_code = hashlib.sha256(mentor_code.encode()).hexdigest()
-                hashed_tutor_code = hashlib.sha256(tutor_code.encode()).hexdigest()
-                cursor.execute(
-                    "INSERT INTO guilds (name, code, founder_code, mentor_code, tutor_code) VALUES (%s, %s, %s, %s, %s)",
-                    (name, hashed_code, hashed_founder_code, hashed_mentor_code, hashed_tutor_code)
-                )
+            cursor.executemany(
+                "INSERT INTO players (nickname, guild_id, status, mentor_id, description, avatar_url, specialization) VALUES (%s, %s, %s, %s, %s, %s, %s)",
+                players_to_insert
+            )
+            logger.info("Successfully inserted initial players.")
+        else:
+            logger.error("Could not find required guilds 'Grey Knights' or 'Mure' to seed initial players.")
 
-        # Заполняем таблицу контента, если она пуста
-        cursor.execute("SELECT COUNT(*) FROM content")
-        if cursor.fetchone()['count'] == 0:
-            contents = ['Замки', 'Клаймы', 'Открытый мир', 'HG 5v5', 'Авалон', 'Скримы']
-            cursor.executemany("INSERT INTO content (name) VALUES (%s)", [(c,) for c in contents])
-
-        # Заполняем таблицу игроков, если она пуста
-        cursor.execute("SELECT COUNT(*) FROM players")
-        if cursor.fetchone()['count'] == 0:
-            cursor.execute("SELECT id FROM guilds WHERE name = 'Grey Knights'")
-            grey_knights_id_row = cursor.fetchone()
-            cursor.execute("SELECT id FROM guilds WHERE name = 'Mure'")
-            mure_id_row = cursor.fetchone()
-
-            if grey_knights_id_row and mure_id_row:
-                grey_knights_id = grey_knights_id_row['id']
-                mure_id = mure_id_row['id']
-
-                players_to_insert = [
-                    ("CORPUS", grey_knights_id, "founder", None, "Основатель гильдии Grey Knights", None, 'D-Tank/E-Tank'),
-                    ("lympeen", grey_knights_id, "mentor", 1, "Ментор альянса", None, 'Support'),
-                    ("VoldeDron", grey_knights_id, "active", 2, "Активный участник", None, None),
-                    ("misterhe111", mure_id, "founder", None, "Основатель гильдии Mure", None, 'Healer')
-                ]
-                cursor.executemany(
-                    "INSERT INTO players (nickname, guild_id, status, mentor_id, description, avatar_url, specialization) VALUES (%s, %s, %s, %s, %s, %s, %s)",
-                    players_to_insert
-                )
-                logger.info("Successfully inserted initial players.")
+
+@migration(2, 'session_error_categories')
+def _migration_session_error_categories(db):
+    """Категории ошибок сессий, вычисляются при записи; существующие сессии дозаполняются."""
+    cursor = db.cursor()
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS session_error_categories (
+        session_id INTEGER NOT NULL,
+        category TEXT NOT NULL,
+        PRIMARY KEY (session_id, category),
+        FOREIGN KEY (session_id) REFERENCES sessions(id) ON DELETE CASCADE
+    )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_session_error_categories_category ON session_error_categories(category)")
+    rebuild_error_categories(db, only_missing=True)
+
+
+@migration(3, 'session_daily_rollup')
+def _migration_session_daily_rollup(db):
+    """Дневные агрегаты оценок по (игрок, день, роль, контент), обновляются в save_session."""
+    cursor = db.cursor()
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS session_daily_rollup (
+        player_id INTEGER NOT NULL,
+        day DATE NOT NULL,
+        role TEXT NOT NULL,
+        content_id INTEGER NOT NULL,
+        score_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+        score_count INTEGER NOT NULL DEFAULT 0,
+        score_min REAL,
+        score_max REAL,
+        last_session_at TIMESTAMP,
+        PRIMARY KEY (player_id, day, role, content_id),
+        FOREIGN KEY (player_id) REFERENCES players(id) ON DELETE CASCADE,
+        FOREIGN KEY (content_id) REFERENCES content(id)
+    )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_session_daily_rollup_day ON session_daily_rollup(day)")
+    rebuild_session_rollup(db)
+
+
+# Индексы под горячие предикаты: (имя, определение, проверочный запрос для `flask db check-indexes`)
+HOT_QUERY_INDEXES = [
+    ('idx_sessions_player_date_id', 'sessions (player_id, session_date, id)',
+     "SELECT score FROM sessions WHERE player_id = 1 AND session_date >= NOW() - INTERVAL '30 days'"),
+    ('idx_sessions_session_date', 'sessions (session_date)',
+     "SELECT id FROM sessions WHERE session_date >= NOW() - INTERVAL '7 days'"),
+    ('idx_sessions_role', 'sessions (role)',
+     "SELECT id FROM sessions WHERE role = 'Healer'"),
+    ('idx_players_guild_status', 'players (guild_id, status)',
+     "SELECT id FROM players WHERE guild_id = 1 AND status = 'active'"),
+    ('idx_players_mentor', 'players (mentor_id)',
+     "SELECT id FROM players WHERE mentor_id = 1"),
+    ('idx_goals_player_status', 'goals (player_id, status)',
+     "SELECT id FROM goals WHERE player_id = 1 AND status = 'in_progress'"),
+    ('idx_help_requests_guild_status', 'help_requests (guild_id, status)',
+     "SELECT id FROM help_requests WHERE guild_id = 1 AND status = 'pending'"),
+]
+
+
+@migration(4, 'hot_query_indexes', transactional=False)
+def _migration_hot_query_indexes(db):
+    """Вторичные индексы; CONCURRENTLY не блокирует запись в таблицы на время построения."""
+    for name, definition, _ in HOT_QUERY_INDEXES:
+        _create_index_concurrently(db, name, definition)
+
+
+@migration(5, 'data_versions')
+def _migration_data_versions(db):
+    """Счетчики версий данных для ETag статистики (см. bump_data_version)."""
+    db.cursor().execute('''
+    CREATE TABLE IF NOT EXISTS data_versions (
+        scope TEXT PRIMARY KEY,
+        version BIGINT NOT NULL DEFAULT 0
+    )
+    ''')
+
+
+@migration(6, 'online_activity_online_since')
+def _migration_online_activity_online_since(db):
+    """Начало текущей онлайн-сессии игрока в снимке присутствия."""
+    db.cursor().execute("ALTER TABLE online_activity ADD COLUMN IF NOT EXISTS online_since TIMESTAMP")
+
+
+# Индексы под keyset-пагинацию; проверяются вместе с HOT_QUERY_INDEXES в `flask db check-indexes`.
+# Списки игроков сортируются по nickname, для него уже есть уникальный индекс players_nickname_key.
+# История сессий идет по тому же индексу, что и горячий запрос за 30 дней: B-tree читается и в обратном
+# порядке (ORDER BY session_date DESC, id DESC), поэтому второй индекс на sessions не нужен.
+KEYSET_INDEXES = [
+    ('idx_sessions_player_date_id', 'sessions (player_id, session_date, id)',
+     "SELECT id FROM sessions WHERE player_id = 1 AND (session_date, id) < (NOW()::timestamp, 1000) "
+     "ORDER BY session_date DESC, id DESC LIMIT 50"),
+]
+
+
+@migration(7, 'keyset_pagination_indexes', transactional=False)
+def _migration_keyset_pagination_indexes(db):
+    """
+    Индекс (player_id, session_date, id) для keyset-пагинации истории сессий; он же заменяет
+    idx_sessions_player_date из миграции 4 (тот же префикс), который удаляется.
+    """
+    for name, definition, _ in KEYSET_INDEXES:
+        _create_index_concurrently(db, name, definition)
+    concurrently = '' if DB_BACKEND == 'sqlite' else ' CONCURRENTLY'
+    db.cursor().execute(f"DROP INDEX{concurrently} IF EXISTS idx_sessions_player_date")
+
+
+def _plan_index_names(plan):
+    """Собирает имена индексов из JSON-плана EXPLAIN."""
+    names = set()
+    if 'Index Name' in plan:
+        names.add(plan['Index Name'])
+    for child in plan.get('Plans', []):
+        names |= _plan_index_names(child)
+    return names
+
+
+def _sqlite_plan_index_names(rows):
+    """Собирает имена индексов из строк EXPLAIN QUERY PLAN SQLite."""
+    return {match.group(1) for row in rows
+            for match in [re.search(r'USING (?:COVERING )?INDEX (\w+)', row['detail'])] if match}
+
+
+def check_hot_query_indexes(db):
+    """
+    Проверяет через EXPLAIN, что горячие запросы используют свои индексы.
+    Seq scan запрещается, чтобы на маленьких таблицах план не уходил в последовательное чтение.
+    Возвращает [(имя индекса, использован ли, индексы в плане)].
+    """
+    cursor = db.cursor()
+    results = []
+    if DB_BACKEND == 'sqlite':
+        for name, _, query in HOT_QUERY_INDEXES + KEYSET_INDEXES:
+            cursor.execute(f"EXPLAIN QUERY PLAN {query}")
+            used = _sqlite_plan_index_names(cursor.fetchall())
+            results.append((name, name in used, sorted(used)))
+        return results
+    try:
+        cursor.execute("SET LOCAL enable_seqscan = off")
+        for name, _, query in HOT_QUERY_INDEXES + KEYSET_INDEXES:
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {query}")
+            used = _plan_index_names(cursor.fetchone()['QUERY PLAN'][0]['Plan'])
+            results.append((name, name in used, sorted(used)))
+    finally:
+        db.rollback()
+    return results
+
+
+db_cli = AppGroup('db', help='Миграции схемы базы данных.')
+app.cli.add_command(db_cli)
+
+
+@db_cli.command('upgrade')
+def db_upgrade_command():
+    """Применяет ожидающие миграции."""
+    applied = run_migrations()
+    click.echo(f"Applied migrations: {applied}" if applied else "Database is up to date.")
+
+
+@db_cli.command('status')
+def db_status_command():
+    """Показывает примененные и ожидающие миграции."""
+    pending = {m['version'] for m in get_pending_migrations(get_db().cursor())}
+    for step in MIGRATIONS:
+        state = 'pending' if step['version'] in pending else 'applied'
+        click.echo(f"{step['version']:04d}_{step['name']}: {state}")
+
+
+@db_cli.command('check-indexes')
+def db_check_indexes_command():
+    """Проверяет через EXPLAIN, что горячие запросы идут по индексам. Код выхода 1 при ошибке."""
+    failed = False
+    for name, ok, used in check_hot_query_indexes(get_db()):
+        click.echo(f"{'OK  ' if ok else 'FAIL'} {name} (plan uses: {', '.join(used) or 'no index'})")
+        failed = failed or not ok
+    if failed:
+        raise SystemExit(1)
+
+
+# --- SCHEMA READINESS & PRESENCE ---
+# Проверка схемы выполняется один раз на процесс. Присутствие хранится в памяти воркера (PresenceStore)
+# и истекает по TTL; online_activity - лишь снимок: фоновый поток раз в PRESENCE_FLUSH_INTERVAL секунд
+# записывает туда отметки этого воркера одним multi-row upsert и вливает обратно отметки остальных.
+PRESENCE_FLUSH_INTERVAL = float(os.environ.get('PRESENCE_FLUSH_INTERVAL', 5))
+PRESENCE_TIMEOUT = 15 * 60  # сек. без активности, после которых игрок считается offline
+PRESENCE_EXPIRE_INTERVAL = 60  # как часто фоновый поток удаляет устаревшие строки снимка
+
+_schema_ready = False
+_schema_lock = threading.Lock()
+
+_presence_lock = threading.Lock()
+_presence_flusher_pid = None
+
+
+def migrate_on_start():
+    """При DB_AUTO_MIGRATE=1 применяет ожидающие миграции; вызывается при старте процесса, до запросов."""
+    if not DB_AUTO_MIGRATE:
+        return
+    applied = run_migrations()
+    if applied:
+        logger.info(f"Applied {len(applied)} migration(s) on start.")
+
+
+def ensure_schema():
+    """Проверяет ожидающие миграции один раз на процесс и предупреждает о них (не применяет)."""
+    global _schema_ready
+    if _schema_ready:
+        return
+    with _schema_lock:
+        if _schema_ready:
+            return
+        with app.app_context():
+            db = get_db()
+            pending = get_pending_migrations(db.cursor())
+            db.rollback()
+            if pending:
+                logger.warning(f"{len(pending)} pending migration(s); run `flask db upgrade`.")
+        _schema_ready = True
+
+
+class PresenceStore:
+    """
+    Онлайн-игроки в памяти: player_id -> [online_since, last_seen] (naive UTC) и карточка для списка.
+    Порядок по online_since (длительность сессии) пересчитывается только при входе/выходе игроков,
+    поэтому список онлайн отдается уже отсортированным.
+    """
+
+    def __init__(self, timeout):
+        self.timeout = datetime.timedelta(seconds=timeout)
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._cards = {}
+        self._dirty = set()  # игроки, отметки которых еще не записаны в снимок
+        self._order = []
+
+    def touch(self, player_id, now):
+        with self._lock:
+            entry = self._entries.get(player_id)
+            if entry is None or now - entry[1] > self.timeout:
+                self._entries[player_id] = [now, now]
+                self._order = None
             else:
-                logger.error("Could not find required guilds 'Grey Knights' or 'Mure' to seed initial players.")
+                entry[1] = max(entry[1], now)
+            self._dirty.add(player_id)
+
+    def take_dirty(self):
+        """Забирает несохраненные отметки: {player_id: (online_since, last_seen)}."""
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            return {pid: tuple(self._entries[pid]) for pid in dirty if pid in self._entries}
+
+    def mark_dirty(self, player_ids):
+        with self._lock:
+            self._dirty.update(player_ids)
+
+    def merge(self, rows):
+        """Вливает строки снимка (отметки других воркеров) вместе с карточками игроков."""
+        with self._lock:
+            for row in rows:
+                pid = row['player_id']
+                entry = self._entries.get(pid)
+                if entry is None:
+                    self._entries[pid] = [row['online_since'], row['last_seen']]
+                    self._order = None
+                else:
+                    if row['online_since'] < entry[0]:
+                        entry[0] = row['online_since']
+                        self._order = None
+                    entry[1] = max(entry[1], row['last_seen'])
+                self._cards[pid] = {key: row[key] for key in ('player_name', 'guild_name', 'status', 'avatar_url')}
+
+    def set_cards(self, cards):
+        with self._lock:
+            for card in cards:
+                self._cards[card['player_id']] = {key: card[key] for key in ('player_name', 'guild_name', 'status', 'avatar_url')}
+
+    def missing_cards(self):
+        with self._lock:
+            return [pid for pid in self._entries if pid not in self._cards]
+
+    def expire(self, now):
+        """Удаляет игроков без активности дольше timeout. Возвращает их id."""
+        with self._lock:
+            left = [pid for pid, (_, last_seen) in self._entries.items() if now - last_seen > self.timeout]
+            for pid in left:
+                del self._entries[pid]
+                self._cards.pop(pid, None)
+                self._dirty.discard(pid)
+            if left:
+                self._order = None
+            return left
+
+    def online(self, now):
+        """Список онлайн-игроков с карточками, по убыванию длительности сессии."""
+        with self._lock:
+            if self._order is None:
+                self._order = sorted(self._entries, key=lambda pid: self._entries[pid][0])
+            return [{'player_id': pid, **self._cards[pid],
+                     'duration_seconds': int((now - self._entries[pid][0]).total_seconds())}
+                    for pid in self._order
+                    if pid in self._cards and now - self._entries[pid][1] <= self.timeout]
+
+
+presence_store = PresenceStore(PRESENCE_TIMEOUT)
+
+
+def _utcnow():
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+def record_heartbeat(player_id):
+    """Отмечает активность игрока в памяти; снимок в БД пишет фоновый поток."""
+    presence_store.touch(player_id, _utcnow())
+    _ensure_presence_flusher()
+
+
+_PRESENCE_CARDS_QUERY = """
+    SELECT p.id as player_id, p.nickname as player_name, COALESCE(g.name, 'N/A') as guild_name,
+           p.status, p.avatar_url
+    FROM players p LEFT JOIN guilds g ON p.guild_id = g.id
+    WHERE p.id = ANY(%s)
+"""
+
+
+def load_presence_cards(cursor, player_ids):
+    cursor.execute(_PRESENCE_CARDS_QUERY, (list(player_ids),))
+    return [dict(row) for row in cursor.fetchall()]
+
+
+def flush_presence(db):
+    """Записывает несохраненные отметки этого воркера в снимок одним запросом. Возвращает число игроков."""
+    batch = presence_store.take_dirty()
+    if not batch:
+        return 0
 
+    try:
+        cursor = db.cursor()
+        if DB_BACKEND == 'sqlite':
+            publish_presence(cursor, joined=_sqlite_upsert_presence(cursor, batch))
+            db.commit()
+            return len(batch)
+        # JOIN с players отбрасывает игроков, удаленных после последнего запроса, вместо нарушения FK.
+        # Сессия начинается заново, если прошлая отметка в снимке старше PRESENCE_TIMEOUT.
+        # xmax = 0 только у вставленных строк: это игроки, которые только что появились онлайн
+        rows = execute_values(cursor, """
+            INSERT INTO online_activity (player_id, online_since, last_seen)
+            SELECT v.player_id, v.online_since, v.last_seen
+            FROM (VALUES %s) AS v(player_id, online_since, last_seen)
+            JOIN players p ON p.id = v.player_id
+            ON CONFLICT (player_id) DO UPDATE SET
+                online_since = CASE
+                    WHEN online_activity.last_seen < EXCLUDED.online_since - make_interval(secs => {timeout})
+                        THEN EXCLUDED.online_since
+                    ELSE LEAST(COALESCE(online_activity.online_since, EXCLUDED.online_since), EXCLUDED.online_since)
+                END,
+                last_seen = GREATEST(online_activity.last_seen, EXCLUDED.last_seen)
+            RETURNING player_id, (xmax = 0) AS inserted
+        """.format(timeout=int(PRESENCE_TIMEOUT)),
+            [(pid, online_since, last_seen) for pid, (online_since, last_seen) in sorted(batch.items())],
+            page_size=len(batch), fetch=True)
+        publish_presence(cursor, joined=[row['player_id'] for row in rows if row['inserted']])
         db.commit()
+    except Exception:
+        db.rollback()
+        presence_store.mark_dirty(batch)
+        raise
+    return len(batch)
+
+
+def _sqlite_upsert_presence(cursor, batch):
+    """Upsert снимка для SQLite (нет xmax): появившиеся онлайн - те, кого не было в снимке до записи."""
+    cursor.execute("SELECT player_id FROM online_activity WHERE player_id = ANY(%s)", (list(batch),))
+    existing = {row['player_id'] for row in cursor.fetchall()}
+    # WHERE true отделяет JOIN ... ON от ON CONFLICT (иначе SQLite не разбирает upsert из SELECT)
+    rows = execute_values(cursor, """
+        INSERT INTO online_activity (player_id, online_since, last_seen)
+        SELECT v.player_id, v.online_since, v.last_seen
+        FROM (VALUES %s) AS v(player_id, online_since, last_seen)
+        JOIN players p ON p.id = v.player_id
+        WHERE true
+        ON CONFLICT (player_id) DO UPDATE SET
+            online_since = CASE
+                WHEN online_activity.last_seen < datetime(EXCLUDED.online_since, '-{timeout} seconds')
+                    THEN EXCLUDED.online_since
+                ELSE MIN(COALESCE(online_activity.online_since, EXCLUDED.online_since), EXCLUDED.online_since)
+            END,
+            last_seen = MAX(online_activity.last_seen, EXCLUDED.last_seen)
+        RETURNING player_id
+    """.format(timeout=int(PRESENCE_TIMEOUT)),
+        [(pid, online_since, last_seen) for pid, (online_since, last_seen) in sorted(batch.items())],
+        page_size=len(batch), fetch=True)
+    return [row['player_id'] for row in rows if row['player_id'] not in existing]
+
+
+def refresh_presence(db):
+    """Вливает в память актуальные строки снимка (отметки других воркеров) и убирает истекшие."""
+    cursor = db.cursor()
+    cursor.execute("""
+        SELECT oa.player_id, COALESCE(oa.online_since, oa.last_seen) as online_since, oa.last_seen,
+               p.nickname as player_name, COALESCE(g.name, 'N/A') as guild_name, p.status, p.avatar_url
+        FROM online_activity oa
+        JOIN players p ON oa.player_id = p.id
+        LEFT JOIN guilds g ON p.guild_id = g.id
+        WHERE oa.last_seen >= (NOW() AT TIME ZONE 'UTC') - make_interval(secs => %s)
+    """, (PRESENCE_TIMEOUT,))
+    presence_store.merge(cursor.fetchall())
+    db.rollback()
+    presence_store.expire(_utcnow())
 
 
+def expire_presence(db):
+    """Удаляет отметки старше PRESENCE_TIMEOUT и рассылает событие об ушедших игроках."""
+    cursor = db.cursor()
+    cursor.execute("DELETE FROM online_activity WHERE last_seen < (NOW() AT TIME ZONE 'UTC') - make_interval(secs => %s) RETURNING player_id",
+                   (PRESENCE_TIMEOUT,))
+    publish_presence(cursor, left=[row['player_id'] for row in cursor.fetchall()])
+    db.commit()
+
+
+def _presence_flush_loop():
+    last_expired = 0
+    while True:
+        time.sleep(PRESENCE_FLUSH_INTERVAL)
+        try:
+            pool = get_pool()
+            conn = pool.getconn()
+            try:
+                flush_presence(conn)
+                refresh_presence(conn)
+                if time.monotonic() - last_expired >= PRESENCE_EXPIRE_INTERVAL:
+                    expire_presence(conn)
+                    last_expired = time.monotonic()
+            finally:
+                pool.putconn(conn)
+        except Exception as e:
+            logger.error(f"Failed to flush online activity: {e}")
+
+
+def _ensure_presence_flusher():
+    global _presence_flusher_pid
+    if _presence_flusher_pid == os.getpid():
+        return
+    with _presence_lock:
+        if _presence_flusher_pid == os.getpid():
+            return
+        threading.Thread(target=_presence_flush_loop, name='presence-flusher', daemon=True).start()
+        _presence_flusher_pid = os.getpid()
+
+
+# --- SERVER-SENT EVENTS ---
+# Изменения присутствия и числа запросов помощи рассылаются через Postgres NOTIFY (в транзакции
+# записи, доставляется после commit). В каждом воркере, где есть открытые потоки /api/events,
+# фоновый поток слушает канал и раскладывает события по очередям подписчиков, поэтому
+# открытая вкладка без изменений не создает нагрузки на БД.
+# С DB_BACKEND=sqlite слушателя нет: соединение само раздает события подписчикам после commit.
+# Каждая открытая вкладка держит бесконечный ответ, поэтому потоки включаются только SSE_ENABLED=1
+# на сервере с потоковыми воркерами (gunicorn.conf.py: gthread); иначе дашборд опрашивает сервер.
+SSE_ENABLED = os.environ.get('SSE_ENABLED', '0') == '1'
+EVENTS_CHANNEL = 'app_events'
+SSE_KEEPALIVE_INTERVAL = float(os.environ.get('SSE_KEEPALIVE_INTERVAL', 25))
+SSE_QUEUE_SIZE = 100
+NOTIFY_MAX_MEMBERS = 20  # игроков в одном NOTIFY (полезная нагрузка ограничена 8000 байт)
+
+
+class EventBroker:
+    """In-process pub/sub: у каждого подписчика своя ограниченная очередь."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+
+    def subscribe(self):
+        subscriber = queue.Queue(maxsize=SSE_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def publish(self, message):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(message)
+            except queue.Full:
+                pass  # медленный клиент пропустит событие и пересинхронизируется при переподключении
+
+
+event_broker = EventBroker()
+_event_listener_pid = None
+_event_listener_lock = threading.Lock()
+
+
+def publish_event(cursor, event, data, guild_id=None):
+    """Ставит событие в NOTIFY текущей транзакции. guild_id - получат только члены этой гильдии."""
+    payload = json.dumps({'event': event, 'data': data, 'guild_id': guild_id}, default=str)
+    if DB_BACKEND == 'sqlite':
+        cursor.connection.notify(EVENTS_CHANNEL, payload)  # доставит _deliver_local_event после commit
+    else:
+        cursor.execute("SELECT pg_notify(%s, %s)", (EVENTS_CHANNEL, payload))
+
+
+def _deliver_local_event(channel, payload):
+    """Обработчик NOTIFY соединений SQLite: события раздаются подписчикам этого процесса."""
+    event_broker.publish(json.loads(payload))
+
+
+def publish_presence(cursor, joined=(), left=()):
+    """Рассылает diff присутствия: появившиеся игроки (с карточкой) и ушедшие (id)."""
+    joined, left = list(joined), list(left)
+    if joined:
+        members = [{**card, 'duration_seconds': 0} for card in load_presence_cards(cursor, joined)]
+        for start in range(0, len(members), NOTIFY_MAX_MEMBERS):
+            publish_event(cursor, 'presence', {'joined': members[start:start + NOTIFY_MAX_MEMBERS], 'left': []})
+    if left:
+        publish_event(cursor, 'presence', {'joined': [], 'left': left})
+
+
+def publish_help_request_count(cursor, guild_id):
+    """Рассылает менторам гильдии актуальное число ожидающих запросов помощи."""
+    cursor.execute("SELECT COUNT(*) FROM help_requests WHERE guild_id = %s AND status = 'pending'", (guild_id,))
+    publish_event(cursor, 'help_requests', {'count': cursor.fetchone()['count']}, guild_id=guild_id)
+
+
+def _event_listener_loop():
+    while True:
+        conn = None
+        try:
+            conn = _connect()
+            conn.autocommit = True
+            conn.cursor().execute(f"LISTEN {EVENTS_CHANNEL}")
+            while True:
+                if select.select([conn], [], [], 60) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    event_broker.publish(json.loads(notify.payload))
+        except Exception as e:
+            logger.error(f"Event listener failed, reconnecting: {e}")
+            time.sleep(5)
+        finally:
+            if conn is not None:
+                conn.close()
+
+
+def _ensure_event_listener():
+    global _event_listener_pid
+    if DB_BACKEND == 'sqlite' or _event_listener_pid == os.getpid():
+        return
+    with _event_listener_lock:
+        if _event_listener_pid == os.getpid():
+            return
+        threading.Thread(target=_event_listener_loop, name='event-listener', daemon=True).start()
+        _event_listener_pid = os.getpid()
+
+
+def _format_sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+@app.route('/api/events')
+def event_stream():
+    """
+    SSE-поток событий для дашборда: 'presence' (diff онлайн-игроков) и 'help_requests'
+    (только менторам своей гильдии). Соединение с БД не удерживается: личность читается
+    до начала потока, а пока поток открыт, игрок считается онлайн.
+    """
+    if not SSE_ENABLED:
+        return jsonify({'status': 'error', 'message': 'Server-sent events are disabled'}), 404
+    if 'player_id' not in session:
+        return jsonify({'status': 'error', 'message': 'Authentication required'}), 401
+    player = get_identity()
+    if not player:
+        return jsonify({'status': 'error', 'message': 'Player not found'}), 404
+
+    player_id, guild_id = player['id'], player['guild_id']
+    is_mentor = player['status'] in ['mentor', 'founder', 'наставник']
+    _ensure_event_listener()
+    subscriber = event_broker.subscribe()
+
+    def generate():
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    message = subscriber.get(timeout=SSE_KEEPALIVE_INTERVAL)
+                except queue.Empty:
+                    record_heartbeat(player_id)
+                    yield ": keepalive\n\n"
+                    continue
+                if message['guild_id'] is not None and (message['guild_id'] != guild_id or not is_mentor):
+                    continue
+                yield _format_sse(message['event'], message['data'])
+        finally:
+            event_broker.unsubscribe(subscriber)
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 
 # --- LOGGING MIDDLEWARE ---
 
 @app.before_request
 def log_request_info():
     logger.debug(f"Request: {request.method} {request.path} | Session: {session}")
+    g._request_started = time.perf_counter()
+    g._db_stats = RequestDbStats()
     # Пропускаем инициализацию для статических файлов, чтобы избежать лишних вызовов
     if request.path.startswith('/static/'):
         return
         
     try:
-        db = get_db()
-        cursor = db.cursor()
-        
-        # Проверяем, существует ли таблица 'players'. Если нет — инициализируем БД.
-        cursor.execute("SELECT EXISTS (SELECT FROM information_schema.tables WHERE table_name = 'players');")
-        # ИСПРАВЛЕНИЕ: Обращаемся к результату по имени поля 'exists', а не по индексу [0]
-        if not cursor.fetchone()['exists']:
-            logger.info("Database not initialized. Running init_db()...")
-            init_db()
-            logger.info("Database initialized successfully on first request.")
-        
-        if 'player_id' in session:
-            # Обновляем активность игрока с использованием корректного синтаксиса PostgreSQL
-            cursor.execute(
-                """
-                INSERT INTO online_activity (player_id, last_seen)
-                VALUES (%s, NOW())
-                ON CONFLICT (player_id)
-                DO UPDATE SET last_seen = EXCLUDED.last_seen
-                """,
-                (session['player_id'],)
-            )
-            db.commit()
+        ensure_schema()
     except Exception as e:
-        logger.error(f"Failed to initialize DB or update online activity for player {session.get('player_id')}: {e}")
+        logger.error(f"Failed to initialize DB: {e}")
         logger.error(traceback.format_exc())
 
+    if 'player_id' in session:
+        record_heartbeat(session['player_id'])
+
 @app.after_request
 def log_response_info(response):
     logger.debug(f"Response status: {response.status}")
+    stats = g.get('_db_stats')
+    if stats is not None:
+        record_request_metrics(request.endpoint or 'unmatched', request.method, response.status_code,
+                               time.perf_counter() - g._request_started, stats)
     return response
 
+# --- KEYSET PAGINATION ---
+# Списки отдаются страницами: ?limit=N&cursor=<next_cursor прошлой страницы>. Курсор - значения ключа
+# сортировки последней отданной строки; условие (ключ) > (курсор) идет по индексу, поэтому глубокие
+# страницы стоят столько же, сколько первая (в отличие от OFFSET).
+PAGE_SIZE_DEFAULT = int(os.environ.get('PAGE_SIZE_DEFAULT', 50))
+PAGE_SIZE_MAX = int(os.environ.get('PAGE_SIZE_MAX', 200))
+
+
+class InvalidCursor(ValueError):
+    """Курсор пагинации не разбирается или не подходит к списку."""
+
+
+def encode_cursor(values):
+    """Непрозрачный токен из значений ключа: base64 от JSON-массива (даты - ISO-строки)."""
+    values = [v.isoformat() if isinstance(v, (datetime.date, datetime.datetime)) else v for v in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+
+# Типы значений ключа сортировки: курсор с чужими типами отклоняется до SQL (400 вместо 500)
+NICKNAME_CURSOR = (str,)
+SESSION_HISTORY_CURSOR = (datetime.datetime, int)
+
+
+def _cursor_value_ok(value, kind):
+    if kind is datetime.datetime:
+        try:
+            datetime.datetime.fromisoformat(value)
+        except (TypeError, ValueError):
+            return False
+        return True
+    if kind is int:
+        return isinstance(value, int) and not isinstance(value, bool)
+    return isinstance(value, kind)
+
+
+def decode_cursor(token, kinds):
+    """Значения курсора; kinds - типы элементов ключа (datetime - ISO-строка)."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except ValueError:
+        raise InvalidCursor(token)
+    if not isinstance(values, list) or len(values) != len(kinds):
+        raise InvalidCursor(token)
+    if not all(_cursor_value_ok(value, kind) for value, kind in zip(values, kinds)):
+        raise InvalidCursor(token)
+    return values
+
+
+def get_page_args(kinds):
+    """(limit, значения курсора или None) из ?limit=&cursor=; limit ограничен PAGE_SIZE_MAX."""
+    limit = min(max(request.args.get('limit', PAGE_SIZE_DEFAULT, type=int), 1), PAGE_SIZE_MAX)
+    token = request.args.get('cursor')
+    return limit, decode_cursor(token, kinds) if token else None
+
+
+def fetch_page(cursor, query, params, limit, key):
+    """
+    Выполняет query (с ORDER BY по ключу, без LIMIT), запрашивая на строку больше limit,
+    чтобы узнать, есть ли следующая страница. key(row) - значения ключа строки.
+    Возвращает (строки, next_cursor или None).
+    """
+    cursor.execute(f"{query} LIMIT %s", (*params, limit + 1))
+    rows = [dict(row) for row in cursor.fetchall()]
+    next_cursor = encode_cursor(key(rows[limit - 1])) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+@app.errorhandler(InvalidCursor)
+def invalid_cursor_error(error):
+    return jsonify({'status': 'error', 'message': 'Invalid pagination cursor'}), 400
+
+
+def _nickname_key(row):
+    return (row['nickname'],)
+
+
 # --- AUTHENTICATION ROUTES ---
 @app.route('/api/auth/login', methods=['POST'])
 def login():
@@ -435,6 +1771,7 @@ def login():
                     (nickname, guild['id'], 'pending')
                 )
                 player = cursor.fetchone() # Получаем запись нового игрока
+                bump_data_version(db, player_ids=[player['id']])
                 db.commit()
             else:
                 return jsonify({'success': False, 'error': 'Неверный код гильдии для регистрации'}), 401
@@ -523,6 +1860,14 @@ def get_player_details_for_management(player_id):
     })
 
 # --- FOUNDER-SPECIFIC ROUTES ---
+@app.route('/api/founder/slow-queries', methods=['GET'])
+@founder_required
+def get_slow_queries():
+    """Последние записи журнала медленных запросов (новые первыми); ?limit= (до 1000), ?endpoint=."""
+    limit = min(max(request.args.get('limit', 100, type=int), 1), 1000)
+    return jsonify({'status': 'success', 'enabled': bool(SLOW_QUERY_MS), 'threshold_ms': SLOW_QUERY_MS,
+                    'queries': read_slow_queries(limit, request.args.get('endpoint'))})
+
 @app.route('/api/guilds/pending-players', methods=['GET'])
 @founder_required
 def get_pending_players():
@@ -537,7 +1882,9 @@ def approve_player(player_id):
     db = get_db()
     cursor = db.cursor()
     cursor.execute("UPDATE players SET status = 'active' WHERE id = %s AND guild_id = %s AND status = 'pending'", (player_id, g.founder_guild_id))
+    bump_data_version(db, player_ids=[player_id])
     db.commit()
+    invalidate_identity(player_id)
     if cursor.rowcount > 0:
         return jsonify({'status': 'success', 'message': 'Player approved'})
     return jsonify({'status': 'error', 'message': 'Player not found or not pending'}), 404
@@ -548,7 +1895,9 @@ def deny_player(player_id):
     db = get_db()
     cursor = db.cursor()
     cursor.execute("DELETE FROM players WHERE id = %s AND guild_id = %s AND status = 'pending'", (player_id, g.founder_guild_id))
+    bump_data_version(db, player_ids=[player_id], guild_ids=[g.founder_guild_id])
     db.commit()
+    invalidate_identity(player_id)
     if cursor.rowcount > 0:
         return jsonify({'status': 'success', 'message': 'Player denied and removed'})
     return jsonify({'status': 'error', 'message': 'Player not found or not pending'}), 404
@@ -569,7 +1918,9 @@ def promote_player_to_tutor(player_id):
         return jsonify({'status': 'error', 'message': 'Только активных игроков можно повысить.'}), 400
 
     cursor.execute("UPDATE players SET status = 'наставник' WHERE id = %s", (player_id,))
+    bump_data_version(db, player_ids=[player_id])
     db.commit()
+    invalidate_identity(player_id)
 
     if cursor.rowcount > 0:
         return jsonify({'status': 'success', 'message': 'Игрок успешно повышен до наставника.'})
@@ -600,18 +1951,20 @@ def remove_student_assignment(student_id):
 @app.route('/api/guilds/manageable-players', methods=['GET'])
 @management_required
 def get_manageable_players():
-    """Возвращает всех игроков (кроме текущего) для управления."""
-    cursor = get_db().cursor()
+    """Игроки (кроме текущего) для управления, страницами по nickname."""
+    limit, after = get_page_args(NICKNAME_CURSOR)
+    after_filter = "AND p.nickname > %s" if after else ""
     # <<< ИСПРАВЛЕНИЕ: Заменено JOIN на LEFT JOIN для стабильности
-    cursor.execute("""
+    query = f"""
         SELECT p.id, p.nickname, p.status, p.created_at, g.name as guild_name
         FROM players p
         LEFT JOIN guilds g ON p.guild_id = g.id
-        WHERE p.status != 'pending' AND p.id != %s
+        WHERE p.status != 'pending' AND p.id != %s {after_filter}
         ORDER BY p.nickname ASC
-    """, (session['player_id'],))
-    players = cursor.fetchall()
-    return jsonify({'status': 'success', 'players': [dict(p) for p in players]})
+    """
+    players, next_cursor = fetch_page(get_db().cursor(), query, (session['player_id'], *(after or ())),
+                                      limit, _nickname_key)
+    return jsonify({'status': 'success', 'players': players, 'next_cursor': next_cursor})
 
 
 @app.route('/api/players/<int:player_id>', methods=['DELETE'])
@@ -634,7 +1987,9 @@ def delete_player(player_id):
         return jsonify({'status': 'error', 'message': 'Founder cannot be deleted'}), 403
 
     cursor.execute("DELETE FROM players WHERE id = %s", (player_id,))
+    bump_data_version(db, player_ids=[player_id], guild_ids=[player_to_delete['guild_id']])
     db.commit()
+    invalidate_identity(player_id)
     
     if cursor.rowcount > 0:
         return jsonify({'status': 'success', 'message': 'Player successfully deleted'})
@@ -648,10 +2003,7 @@ def index():
     if 'player_id' not in session:
         return redirect('/login.html')
     
-    db = get_db()
-    cursor = db.cursor()
-    cursor.execute("SELECT status FROM players WHERE id = %s", (session['player_id'],))
-    player = cursor.fetchone()
+    player = get_identity()
 
     if player and player['status'] == 'pending':
         return redirect('/pending.html')
@@ -668,10 +2020,7 @@ def serve_page(filename):
     if 'player_id' not in session:
         return redirect('/login.html')
 
-    db = get_db()
-    cursor = db.cursor()
-    cursor.execute("SELECT status FROM players WHERE id = %s", (session['player_id'],))
-    player = cursor.fetchone()
+    player = get_identity()
     player_status = player['status'] if player else None
 
     if player_status == 'pending':
@@ -682,7 +2031,7 @@ def serve_page(filename):
             return redirect('/dashboard.html')
             
     if filename in ['dashboard.html', 'pending.html']:
-        return render_template(filename)
+        return render_template(filename, sse_enabled=SSE_ENABLED)
         
     return send_from_directory(app.static_folder, filename)
 
@@ -691,15 +2040,6 @@ def send_static(path):
     return send_from_directory('static', path)
 
 # --- UTILITY FUNCTIONS ---
-def get_date_filter(period_str):
-    """Returns an SQL condition for date filtering for PostgreSQL."""
-    if period_str == '7':
-        return " AND session_date >= (NOW() - INTERVAL '7 days')"
-    elif period_str == '30':
-        return " AND session_date >= (NOW() - INTERVAL '30 days')"
-    else: # 'all' or any other value
-        return ""
-
 ERROR_CATEGORIES = {
     'Позиционка': ['позиционк', 'позиция', 'далеко', 'положение', 'стоит не там', 'дистанция', 'кайт'],
     'Тайминг': ['тайминг', 'долго', 'не успеваешь', 'вовремя', 'поздно', 'реакция', 'быстрее', 'медленно'],
@@ -708,66 +2048,159 @@ ERROR_CATEGORIES = {
     'Другое': []
 }
 
+def _keyword_trie_pattern(keywords):
+    """Regex из префиксного дерева слов: на каждой позиции совпадает самое длинное слово."""
+    trie = {}
+    for keyword in keywords:
+        node = trie
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[''] = {}
+
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        return f'(?:{body})?' if '' in node else body
+
+    return build(trie)
+
+def _compile_error_matcher(categories):
+    """
+    Собирает все ключевые слова в одну regex-альтернативу по префиксному дереву, а категории -
+    в битовые маски. findall дает непересекающиеся совпадения, поэтому:
+    - маска слова включает категории всех слов, которые являются его подстроками;
+    - для слов, чей конец может быть началом слова другой категории, запоминаем такие слова
+      и проверяем их отдельно, когда это слово найдено.
+    """
+    bits = {category: 1 << i for i, category in enumerate(categories)}
+    keyword_masks = defaultdict(int)
+    for category, keywords in categories.items():
+        for keyword in keywords:
+            keyword_masks[keyword.lower()] |= bits[category]
+
+    masks = {}
+    for keyword in keyword_masks:
+        masks[keyword] = 0
+        for other, mask in keyword_masks.items():
+            if other in keyword:
+                masks[keyword] |= mask
+    overlaps = {}
+    for keyword in keyword_masks:
+        tails = [keyword[i:] for i in range(1, len(keyword))]
+        candidates = tuple(
+            other for other, mask in keyword_masks.items()
+            if mask & ~masks[keyword] and any(other.startswith(tail) for tail in tails)
+        )
+        if candidates:
+            overlaps[keyword] = candidates
+
+    names = list(categories)
+    mask_categories = [[names[i] for i in range(len(names)) if mask >> i & 1] for mask in range(1 << len(names))]
+    pattern = re.compile(_keyword_trie_pattern(masks)) if masks else None
+    return pattern, masks, overlaps, mask_categories
+
+_error_pattern, _error_keyword_masks, _error_keyword_overlaps, _error_mask_categories = _compile_error_matcher(ERROR_CATEGORIES)
+
 def categorize_error_text(text):
     if not text:
         return []
-    text_lower = text.lower()
-    found_categories = set()
-    for category, keywords in ERROR_CATEGORIES.items():
-        for keyword in keywords:
-            if keyword in text_lower:
-                found_categories.add(category)
-    if not found_categories:
+    mask = 0
+    if _error_pattern is not None:
+        text_lower = text.lower()
+        for keyword in _error_pattern.findall(text_lower):
+            mask |= _error_keyword_masks[keyword]
+            if keyword in _error_keyword_overlaps:
+                for other in _error_keyword_overlaps[keyword]:
+                    if _error_keyword_masks[other] & ~mask and other in text_lower:
+                        mask |= _error_keyword_masks[other]
+    if not mask:
         return ['Другое']
-    return list(found_categories)
-
-# +++ GOALS API ROUTES +++
+    return list(_error_mask_categories[mask])
+
+def categorize_error_texts(texts):
+    """Пакетная категоризация: список текстов -> список списков категорий (одинаковые тексты считаются один раз)."""
+    cache = {}
+    result = []
+    for text in texts:
+        categories = cache.get(text)
+        if categories is None:
+            categories = cache[text] = categorize_error_text(text)
+        result.append(categories)
+    return result
+
+def _session_error_text(error_types, work_on):
+    """Текст для категоризации; None, если у сессии нет ни ошибок, ни пунктов для работы."""
+    if not error_types and not work_on:
+        return None
+    return f"{error_types or ''}, {work_on or ''}"
+
+def store_error_categories(cursor, sessions):
+    """Сохраняет категории ошибок для [(session_id, error_types, work_on), ...] одним INSERT."""
+    texts = [(session_id, _session_error_text(error_types, work_on)) for session_id, error_types, work_on in sessions]
+    texts = [(session_id, text) for session_id, text in texts if text is not None]
+    rows = []
+    for (session_id, _), categories in zip(texts, categorize_error_texts([text for _, text in texts])):
+        rows.extend((session_id, category) for category in categories)
+    if rows:
+        execute_values(cursor, "INSERT INTO session_error_categories (session_id, category) VALUES %s ON CONFLICT DO NOTHING", rows)
+    return len(rows)
+
+def rebuild_error_categories(db, only_missing=True, batch_size=1000):
+    """
+    Пересчитывает session_error_categories пачками по id.
+    only_missing=True - дозаполняет сессии без категорий (backfill),
+    False - пересчитывает все (после изменения ERROR_CATEGORIES).
+    """
+    cursor = db.cursor()
+    missing_filter = "AND NOT EXISTS (SELECT 1 FROM session_error_categories sec WHERE sec.session_id = s.id)" if only_missing else ""
+    last_id, processed = 0, 0
+    while True:
+        cursor.execute(f"""
+            SELECT s.id, s.error_types, s.work_on FROM sessions s
+            WHERE s.id > %s
+              AND ((s.error_types IS NOT NULL AND s.error_types != '') OR (s.work_on IS NOT NULL AND s.work_on != ''))
+              {missing_filter}
+            ORDER BY s.id
+            LIMIT %s
+        """, (last_id, batch_size))
+        batch = cursor.fetchall()
+        if not batch:
+            break
+        ids = [row['id'] for row in batch]
+        if not only_missing:
+            cursor.execute("DELETE FROM session_error_categories WHERE session_id = ANY(%s)", (ids,))
+        store_error_categories(cursor, [(row['id'], row['error_types'], row['work_on']) for row in batch])
+        db.commit()
+        last_id = ids[-1]
+        processed += len(batch)
+    return processed
+
+@app.cli.command('backfill-error-categories')
+def backfill_error_categories_command():
+    """Заполняет категории ошибок для сессий, у которых их еще нет."""
+    ensure_schema()
+    db = get_db()
+    processed = rebuild_error_categories(db, only_missing=True)
+    bump_all_data_versions(db)
+    db.commit()
+    logger.info(f"Backfilled error categories for {processed} sessions.")
 
-def _calculate_dynamic_progress(goal_dict):
-    """Рассчитывает прогресс цели на основе данных из сессий."""
+@app.cli.command('recategorize-errors')
+def recategorize_errors_command():
+    """Пересчитывает категории ошибок всех сессий (после изменения ERROR_CATEGORIES)."""
+    ensure_schema()
     db = get_db()
-    cursor = db.cursor()
+    processed = rebuild_error_categories(db, only_missing=False)
+    bump_all_data_versions(db)
+    db.commit()
+    logger.info(f"Recategorized errors for {processed} sessions.")
 
-    metric = goal_dict.get('metric')
-    if not metric:
-        return 0 # Если цель без метрики (простая задача), прогресс 0
+# +++ GOALS API ROUTES +++
 
-    player_id = goal_dict['player_id']
-    content_id = goal_dict.get('metric_content_id')
-    role = goal_dict.get('metric_role')
-    start_date = goal_dict['created_at']
-    due_date = goal_dict['due_date']
-    
-    # Собираем базовый запрос и условия
-    query_parts = ["FROM sessions WHERE player_id = %s AND session_date >= %s"]
-    params = [player_id, start_date]
-
-    if due_date:
-        query_parts.append("AND session_date <= %s")
-        params.append(due_date)
-    if content_id:
-        query_parts.append("AND content_id = %s")
-        params.append(content_id)
-    if role:
-        query_parts.append("AND role = %s")
-        params.append(role)
-
-    full_query_suffix = " ".join(query_parts)
-
-    # Вычисляем текущее значение метрики
-    current_value = 0
-    if metric == 'avg_score':
-        cursor.execute(f"SELECT AVG(score) as avg {full_query_suffix}", params)
-        result = cursor.fetchone()
-        current_value = result['avg'] if result and result['avg'] is not None else 0
-    elif metric == 'session_count':
-        # ИСПРАВЛЕНИЕ: Добавлен псевдоним 'count'
-        cursor.execute(f"SELECT COUNT(id) as count {full_query_suffix}", params)
-        result = cursor.fetchone()
-        # ИСПРАВЛЕНИЕ: Обращение по имени 'count'
-        current_value = result['count'] if result and result['count'] is not None else 0
-    
-    # Рассчитываем прогресс в процентах
+def _goal_progress_percent(goal_dict, current_value):
+    """Переводит текущее значение метрики цели в прогресс 0-100%."""
     start_value = goal_dict.get('metric_start_value') or 0
     target_value = goal_dict.get('metric_target') or 0
 
@@ -781,6 +2214,57 @@ def _calculate_dynamic_progress(goal_dict):
     # Ограничиваем значение прогресса от 0 до 100
     return max(0, min(100, round(progress)))
 
+def _calculate_goals_progress(goals):
+    """
+    Рассчитывает прогресс целей на основе данных из сессий одним запросом для всего списка.
+    Фильтры каждой цели (игрок, период, контент, роль) передаются массивами (unnest)
+    и соединяются с sessions. Возвращает {goal_id: progress}.
+    """
+    progress = {goal['id']: 0 for goal in goals}  # Цели без метрики (простые задачи) - прогресс 0
+    metric_goals = [goal for goal in goals if goal.get('metric') in ('avg_score', 'session_count')]
+    if not metric_goals:
+        return progress
+
+    cursor = get_db().cursor()
+    cursor.execute(GOALS_PROGRESS_QUERY, goals_progress_params(metric_goals))
+    apply_goals_progress(progress, metric_goals, cursor.fetchall())
+    return progress
+
+GOALS_PROGRESS_QUERY = """
+    SELECT v.goal_id, AVG(s.score) as avg, COUNT(s.id) as count
+    FROM unnest(%s::integer[], %s::integer[], %s::timestamp[], %s::timestamp[], %s::integer[], %s::text[])
+        AS v(goal_id, player_id, start_date, due_date, content_id, role)
+    LEFT JOIN sessions s
+        ON s.player_id = v.player_id
+        AND s.session_date >= v.start_date
+        AND (v.due_date IS NULL OR s.session_date <= v.due_date)
+        AND (v.content_id IS NULL OR s.content_id = v.content_id)
+        AND (v.role IS NULL OR s.role = v.role)
+    GROUP BY v.goal_id
+"""
+
+def goals_progress_params(metric_goals):
+    """Параметры GOALS_PROGRESS_QUERY: по массиву на каждое поле фильтра целей."""
+    return (
+        [goal['id'] for goal in metric_goals],
+        [goal['player_id'] for goal in metric_goals],
+        [goal['created_at'] for goal in metric_goals],
+        [goal.get('due_date') or None for goal in metric_goals],
+        [goal.get('metric_content_id') or None for goal in metric_goals],
+        [goal.get('metric_role') or None for goal in metric_goals],
+    )
+
+def apply_goals_progress(progress, metric_goals, results):
+    """Заполняет progress[goal_id] по строкам GOALS_PROGRESS_QUERY."""
+    values = {row['goal_id']: row for row in results}
+    for goal in metric_goals:
+        row = values.get(goal['id'])
+        if goal['metric'] == 'avg_score':
+            current_value = row['avg'] if row and row['avg'] is not None else 0
+        else:
+            current_value = row['count'] if row and row['count'] is not None else 0
+        progress[goal['id']] = _goal_progress_percent(goal, current_value)
+
 # <<< ПРОВЕРКА: Убедитесь, что эта функция полностью заменена
 @app.route('/api/mentors/my-students', methods=['GET'])
 def get_my_students():
@@ -824,12 +2308,10 @@ def get_goals_view():
             ORDER BY g.status ASC, g.due_date DESC, g.created_at DESC
         """, (current_player['id'],))
         
-        my_goals_raw = cursor.fetchall()
-        my_goals = []
-        for goal_row in my_goals_raw:
-            goal_dict = dict(goal_row)
-            goal_dict['progress'] = _calculate_dynamic_progress(goal_dict)
-            my_goals.append(goal_dict)
+        my_goals = [dict(goal_row) for goal_row in cursor.fetchall()]
+        my_progress = _calculate_goals_progress(my_goals)
+        for goal_dict in my_goals:
+            goal_dict['progress'] = my_progress[goal_dict['id']]
 
         response_data = {'my_goals': my_goals, 'student_goals': []}
 
@@ -867,12 +2349,12 @@ def get_goals_view():
                     ORDER BY g.player_id, g.status ASC, g.due_date DESC
                 """
                 cursor.execute(goals_query, managed_player_ids)
-                all_student_goals_raw = cursor.fetchall()
+                all_student_goals = [dict(goal_row) for goal_row in cursor.fetchall()]
+                student_progress = _calculate_goals_progress(all_student_goals)
                 
                 goals_by_player = defaultdict(list)
-                for goal_row in all_student_goals_raw:
-                    goal_dict = dict(goal_row)
-                    goal_dict['progress'] = _calculate_dynamic_progress(goal_dict)
+                for goal_dict in all_student_goals:
+                    goal_dict['progress'] = student_progress[goal_dict['id']]
                     goals_by_player[goal_dict['player_id']].append(goal_dict)
 
                 for player in managed_players:
@@ -948,6 +2430,7 @@ def create_goal():
             VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)""",
         (player_id, g.player['id'], title, description, due_date, metric, metric_target, start_value, metric_content_id, metric_role)
     )
+    bump_data_version(db, player_ids=[player_id])
     db.commit()
     return jsonify({'status': 'success', 'message': 'Goal created successfully'})
 
@@ -979,6 +2462,7 @@ def update_goal(goal_id):
         "UPDATE goals SET title = %s, description = %s, due_date = %s WHERE id = %s",
         (title, description, due_date, goal_id)
     )
+    bump_data_version(db, player_ids=[goal['player_id']])
     db.commit()
     return jsonify({'status': 'success', 'message': 'Goal updated successfully'})
 
@@ -1008,6 +2492,7 @@ def delete_goal(goal_id):
         return jsonify({'status': 'error', 'message': 'You do not have permission to delete this goal'}), 403
 
     cursor.execute("DELETE FROM goals WHERE id = %s", (goal_id,))
+    bump_data_version(db, player_ids=[goal['player_id']])
     db.commit()
     
     if cursor.rowcount > 0:
@@ -1016,70 +2501,58 @@ def delete_goal(goal_id):
 
 
 # --- GENERAL API ROUTES ---
+APP_VERSION = '1.5.1'
+
+# Независимые запросы system_status: ключ ответа -> SQL (ASGI-режим выполняет их параллельно)
+SYSTEM_STATUS_QUERIES = {
+    'last_update': 'SELECT MAX(session_date) as value FROM sessions',
+    'total_players': 'SELECT COUNT(*) as value FROM players',
+    'total_mentors': "SELECT COUNT(*) as value FROM players WHERE status IN ('mentor', 'founder', 'наставник')",
+}
+
 @app.route('/api/system/status', methods=['GET'])
 def system_status():
-    db = get_db()
-    cursor = db.cursor()
-    cursor.execute('SELECT MAX(session_date) as last_update FROM sessions')
-    last_update = cursor.fetchone()['last_update'] or 'N/A'
-    cursor.execute('SELECT COUNT(*) as total_players FROM players')
-    total_players = cursor.fetchone()['total_players']
-    cursor.execute("SELECT COUNT(*) as total_mentors FROM players WHERE status IN ('mentor', 'founder', 'наставник')")
-    total_mentors = cursor.fetchone()['total_mentors']
+    cursor = get_db().cursor()
+    counters = {}
+    for key, query in SYSTEM_STATUS_QUERIES.items():
+        cursor.execute(query)
+        counters[key] = cursor.fetchone()['value']
     
     user_status = 'offline'
     if 'player_id' in session:
-        cursor.execute("SELECT status FROM players WHERE id = %s", (session['player_id'],))
-        player = cursor.fetchone()
+        player = get_identity()
         user_status = player['status'] if player else 'offline'
 
-    return jsonify({
+    return jsonify(system_status_payload(counters, user_status))
+
+def system_status_payload(counters, user_status):
+    return {
         'status': 'online', 
         'user_status': user_status,
-        'version': '1.5.1', # Version bump
-        'last_update': last_update, 'total_players': total_players, 'total_mentors': total_mentors
-    })
+        'version': APP_VERSION,
+        'last_update': counters['last_update'] or 'N/A',
+        'total_players': counters['total_players'], 'total_mentors': counters['total_mentors']
+    }
 
-# Что заменить: app.py -> функция @app.route('/api/system/online-members', methods=['GET'])
+@app.route('/api/system/db-pool', methods=['GET'])
+def db_pool_stats():
+    """Статистика пула соединений текущего воркера."""
+    return jsonify({'status': 'success', 'pid': os.getpid(), 'pool': get_pool().stats()})
+
+@app.route('/api/system/metrics', methods=['GET'])
+def system_metrics():
+    """Метрики запросов текущего воркера (время, запросы к БД, строки по эндпоинтам) для Prometheus."""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/api/system/online-members', methods=['GET'])
 def get_online_members():
-    db = get_db()
-    cursor = db.cursor()
-    timeout_seconds = 15 * 60  # 15 минут
+    """Онлайн-игроки из памяти воркера, по убыванию длительности сессии. Ничего не пишет в БД."""
     try:
-        cursor.execute("DELETE FROM online_activity WHERE EXTRACT(EPOCH FROM (NOW() - last_seen)) > %s", (timeout_seconds,))
-        db.commit()
-        query = """
-            SELECT 
-                p.id, p.nickname, p.status, p.avatar_url, 
-                g.name as guild_name,
-                oa.last_seen
-            FROM online_activity oa
-            JOIN players p ON oa.player_id = p.id
-            LEFT JOIN guilds g ON p.guild_id = g.id
-        """
-        cursor.execute(query)
-        online_members_list = []
-        # ИСПРАВЛЕНИЕ: Используем timezone.utc для корректного сравнения
-        current_time = datetime.datetime.now(datetime.timezone.utc)
-        for player_row in cursor.fetchall():
-            player = dict(player_row)
-            last_seen_dt = player['last_seen']
-            # >>> ИСПРАВЛЕНИЕ: Проверяем, есть ли у времени часовой пояс. Если нет, считаем его как UTC.
-            if last_seen_dt.tzinfo is None:
-                last_seen_dt = last_seen_dt.replace(tzinfo=datetime.timezone.utc)
-            duration_seconds = (current_time - last_seen_dt).total_seconds()
-            online_members_list.append({
-                'player_id': player['id'],
-                'player_name': player['nickname'],
-                'guild_name': player['guild_name'] or 'N/A',
-                'status': player['status'],
-                'avatar_url': player['avatar_url'],
-                'duration_seconds': int(duration_seconds)
-            })
-        online_members_list.sort(key=lambda x: x['duration_seconds'], reverse=True)
-        return jsonify({'status': 'success', 'online_members': online_members_list})
+        # Карточки игроков, еще не попавших в снимок (например, только что вошедших), читаются один раз
+        missing = presence_store.missing_cards()
+        if missing:
+            presence_store.set_cards(load_presence_cards(get_db().cursor(), missing))
+        return jsonify({'status': 'success', 'online_members': presence_store.online(_utcnow())})
     except Exception as e:
         logger.error(f"Error in get_online_members: {e}\n{traceback.format_exc()}")
         return jsonify({'status': 'error', 'message': "Internal server error"}), 500
@@ -1100,43 +2573,59 @@ def get_guild(guild_id):
         return jsonify({'status': 'error', 'message': 'Guild not found'}), 404
     return jsonify({'status': 'success', 'guild': dict(guild)})
 
-@app.route('/api/guilds/<int:guild_id>/top-players', methods=['GET'])
-def get_top_players(guild_id):
-    min_sessions = request.args.get('min_sessions', 0, type=int)
-    limit = request.args.get('limit', 10, type=int)
-    cursor = get_db().cursor()
-    
-    # ИСПРАВЛЕНИЕ: Добавлены p.nickname и p.avatar_url в GROUP BY
-    query = '''
-        SELECT p.id, p.nickname, p.avatar_url, AVG(s.score) as avg_score, COUNT(s.id) as session_count,
-               (SELECT role FROM sessions WHERE player_id = p.id GROUP BY role ORDER BY COUNT(*) DESC LIMIT 1) as main_role
-        FROM players p 
-        LEFT JOIN sessions s ON p.id = s.player_id
-        JOIN guilds g ON p.guild_id = g.id
-        WHERE g.name IN ('Grey Knights', 'Mure')
+# Ранг: 70% - средний балл, 30% - число сессий (оба нормированы по максимуму в выборке).
+# Все считается в БД по дневному агрегату, main_role - роль с наибольшим числом сессий.
+_LEADERBOARD_QUERY = """
+    WITH role_stats AS (
+        SELECT r.player_id, r.role, SUM(r.score_count) AS cnt, SUM(r.score_sum) AS total,
+               ROW_NUMBER() OVER (PARTITION BY r.player_id ORDER BY SUM(r.score_count) DESC, r.role) AS role_rank
+        FROM session_daily_rollup r
+        JOIN players p ON p.id = r.player_id
+        WHERE {scope}
+        GROUP BY r.player_id, r.role
+    ),
+    player_stats AS (
+        SELECT p.id, p.nickname, p.avatar_url,
+               SUM(rs.total) / NULLIF(SUM(rs.cnt), 0) AS avg_score,
+               COALESCE(SUM(rs.cnt), 0)::integer AS session_count,
+               MAX(CASE WHEN rs.role_rank = 1 THEN rs.role END) AS main_role
+        FROM players p
+        LEFT JOIN role_stats rs ON rs.player_id = p.id
+        WHERE {scope}
         GROUP BY p.id, p.nickname, p.avatar_url
-        HAVING COUNT(s.id) >= %s
-    '''
-    cursor.execute(query, (min_sessions,))
-    players = [dict(row) for row in cursor.fetchall()]
-    
-    if players:
-        valid_scores = [p['avg_score'] for p in players if p['avg_score'] is not None]
-        valid_counts = [p['session_count'] for p in players]
-
-        max_score_val = max(valid_scores) if valid_scores else 0
-        max_count_val = max(valid_counts) if valid_counts else 0
-
-        max_score = max_score_val if max_score_val > 0 else 1
-        max_count = max_count_val if max_count_val > 0 else 1
-
-        for p in players:
-            p['rank'] = (0.7 * (p.get('avg_score') or 0) / max_score) + (0.3 * p['session_count'] / max_count)
-
-        players.sort(key=lambda p: p['rank'], reverse=True)
+        HAVING COALESCE(SUM(rs.cnt), 0) >= %(min_sessions)s
+    ),
+    normalized AS (
+        SELECT ps.*,
+               CASE WHEN MAX(avg_score) OVER () > 0 THEN MAX(avg_score) OVER () ELSE 1 END AS max_score,
+               CASE WHEN MAX(session_count) OVER () > 0 THEN MAX(session_count) OVER () ELSE 1 END AS max_count
+        FROM player_stats ps
+    )
+    SELECT id, nickname, avatar_url, avg_score, session_count, main_role,
+           0.7 * COALESCE(avg_score, 0) / max_score + 0.3 * session_count::float / max_count AS rank
+    FROM normalized
+    ORDER BY rank DESC, id
+    LIMIT %(limit)s
+"""
+
+def query_leaderboard(cursor, guild_id=None, min_sessions=0, limit=10):
+    """Топ игроков гильдии (guild_id) или всего альянса (None). limit=0 - без ограничения."""
+    scope = "p.guild_id = %(guild_id)s" if guild_id is not None else "TRUE"
+    cursor.execute(_LEADERBOARD_QUERY.format(scope=scope), {
+        'guild_id': guild_id,
+        'min_sessions': min_sessions,
+        'limit': limit or None  # LIMIT NULL == LIMIT ALL
+    })
+    return [dict(row) for row in cursor.fetchall()]
 
-    players_to_return = players if limit == 0 else players[:limit]
-    return jsonify({'status': 'success', 'players': players_to_return})
+@app.route('/api/guilds/<int:guild_id>/top-players', methods=['GET'])
+def get_top_players(guild_id):
+    """Рейтинг игроков гильдии; ?scope=alliance - рейтинг по всему альянсу."""
+    min_sessions = request.args.get('min_sessions', 0, type=int)
+    limit = request.args.get('limit', 10, type=int)
+    scope_guild_id = None if request.args.get('scope') == 'alliance' else guild_id
+    players = query_leaderboard(get_db().cursor(), scope_guild_id, min_sessions, limit)
+    return jsonify({'status': 'success', 'players': players})
 
 # ЗАМЕНИТЬ СУЩЕСТВУЮЩУЮ ФУНКЦИЮ в app.py
 @app.route('/api/players', methods=['GET'])
@@ -1175,13 +2664,17 @@ def get_players():
         # Обычные игроки видят только себя
         query_where = "WHERE p.id = %s"
         params = (user_id,)
+
+    limit, after = get_page_args(NICKNAME_CURSOR)
+    if after:
+        query_where += " AND p.nickname > %s"
+        params = (*params, *after)
         
     query_order = "ORDER BY p.nickname ASC"
     final_query = f"{query_base} {query_where} {query_order}"
     
-    cursor.execute(final_query, params)
-    players = [dict(p) for p in cursor.fetchall()]
-    return jsonify({'status': 'success', 'players': players})
+    players, next_cursor = fetch_page(cursor, final_query, params, limit, _nickname_key)
+    return jsonify({'status': 'success', 'players': players, 'next_cursor': next_cursor})
 
 @app.route('/api/players/current', methods=['GET'])
 def get_current_player():
@@ -1245,6 +2738,7 @@ def upload_avatar():
         db = get_db()
         cursor = db.cursor()
         cursor.execute("UPDATE players SET avatar_url = %s WHERE id = %s", (avatar_url, session['player_id']))
+        bump_data_version(db, player_ids=[session['player_id']])
         db.commit()
         return jsonify({'status': 'success', 'avatar_url': avatar_url})
 
@@ -1272,18 +2766,76 @@ def update_current_player_profile():
     return jsonify({'status': 'error', 'message': 'Не удалось обновить профиль.'}), 500
 
 
+# --- CSV EXPORT ---
+# Сессии читаются именованным (server-side) курсором порциями по EXPORT_FETCH_SIZE строк и отдаются
+# потоком, поэтому память не зависит от размера истории. stream_with_context держит соединение
+# из пула до конца выгрузки.
+EXPORT_FETCH_SIZE = int(os.environ.get('EXPORT_FETCH_SIZE', 2000))
+EXPORT_CHUNK_ROWS = 500  # строк CSV в одном отдаваемом куске
+
+def _stream_csv(query, params, header):
+    """Генератор CSV-кусков по результату query."""
+    db = get_db()
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    try:
+        with db.cursor(name='csv_export', cursor_factory=psycopg2.extensions.cursor) as cursor:
+            cursor.itersize = EXPORT_FETCH_SIZE
+            cursor.execute(query, params)
+            for i, row in enumerate(cursor, 1):
+                writer.writerow(row)
+                if i % EXPORT_CHUNK_ROWS == 0:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+        yield buffer.getvalue()
+    finally:
+        db.rollback()
+
+def _gzip_stream(chunks):
+    """Сжимает поток текстовых кусков в формат gzip на лету."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 - gzip-заголовок
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
 @app.route('/api/players/<int:player_id>/export', methods=['GET'])
 def export_player_data(player_id):
-    cursor = get_db().cursor()
-    cursor.execute('SELECT s.*, c.name as content_name FROM sessions s JOIN content c ON s.content_id = c.id WHERE s.player_id = %s', (player_id,))
-    sessions = cursor.fetchall()
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(['ID', 'Date', 'Content', 'Role', 'Score', 'Error Types', 'Work On', 'Comments'])
-    for s in sessions:
-        writer.writerow([s['id'], s['session_date'], s['content_name'], s['role'], s['score'], s['error_types'], s['work_on'], s['comments']])
-    output.seek(0)
-    return Response(output.getvalue(), mimetype='text/csv', headers={"Content-disposition": f"attachment; filename=player_{player_id}_data.csv"})
+    query = """
+        SELECT s.id, s.session_date, c.name, s.role, s.score, s.error_types, s.work_on, s.comments
+        FROM sessions s JOIN content c ON s.content_id = c.id
+        WHERE s.player_id = %s
+        ORDER BY s.session_date, s.id
+    """
+    header = ['ID', 'Date', 'Content', 'Role', 'Score', 'Error Types', 'Work On', 'Comments']
+    return Response(stream_with_context(_stream_csv(query, (player_id,), header)), mimetype='text/csv',
+                    headers={"Content-disposition": f"attachment; filename=player_{player_id}_data.csv"})
+
+@app.route('/api/founder/guild-export', methods=['GET'])
+@founder_required
+def export_guild_data():
+    """Все сессии гильдии основателя одним CSV; ?gzip=1 - сжатый .csv.gz."""
+    query = """
+        SELECT s.id, s.session_date, p.id, p.nickname, c.name, s.role, s.score,
+               s.error_types, s.work_on, s.comments, s.mentor_id
+        FROM sessions s
+        JOIN players p ON s.player_id = p.id
+        JOIN content c ON s.content_id = c.id
+        WHERE p.guild_id = %s
+        ORDER BY s.session_date, s.id
+    """
+    header = ['ID', 'Date', 'Player ID', 'Player', 'Content', 'Role', 'Score', 'Error Types', 'Work On', 'Comments', 'Mentor ID']
+    guild_id = g.founder_guild_id
+    chunks = _stream_csv(query, (guild_id,), header)
+    filename = f"guild_{guild_id}_sessions.csv"
+    if request.args.get('gzip') in ('1', 'true'):
+        return Response(stream_with_context(_gzip_stream(chunks)), mimetype='application/gzip',
+                        headers={"Content-disposition": f"attachment; filename={filename}.gz"})
+    return Response(stream_with_context(chunks), mimetype='text/csv',
+                    headers={"Content-disposition": f"attachment; filename={filename}"})
 
 @app.route('/api/players/<int:player_id>/sessions', methods=['GET'])
 def get_player_sessions(player_id):
@@ -1301,28 +2853,55 @@ def get_player_sessions(player_id):
     return jsonify({'status': 'success', 'sessions': sessions})
 
 
+@app.route('/api/players/<int:player_id>/session-history', methods=['GET'])
+@login_required
+def get_player_session_history(player_id):
+    """
+    История сессий игрока от новых к старым, страницами по (session_date, id).
+    Доступна самому игроку и наставникам/менторам/основателю.
+    """
+    if player_id != g.player['id'] and g.player['status'] not in ['mentor', 'founder', 'наставник']:
+        return jsonify({'status': 'error', 'message': 'Access denied'}), 403
+    limit, after = get_page_args(SESSION_HISTORY_CURSOR)
+    after_filter = "AND (s.session_date, s.id) < (%s::timestamp, %s)" if after else ""
+    query = f"""
+        SELECT s.id, s.session_date, s.score, s.role, s.error_types, s.work_on, s.comments,
+               c.name as content_name, m.nickname as mentor_name
+        FROM sessions s
+        JOIN content c ON s.content_id = c.id
+        LEFT JOIN players m ON s.mentor_id = m.id
+        WHERE s.player_id = %s {after_filter}
+        ORDER BY s.session_date DESC, s.id DESC
+    """
+    sessions, next_cursor = fetch_page(get_db().cursor(), query, (player_id, *(after or ())), limit,
+                                       lambda row: (row['session_date'], row['id']))
+    return jsonify({'status': 'success', 'sessions': sessions, 'next_cursor': next_cursor})
+
+
 @app.route('/api/guilds/<int:guild_id>/role-ratings', methods=['GET'])
 def get_role_ratings(guild_id):
-    db = get_db()
-    cursor = db.cursor()
-    roles = ['D-Tank', 'E-Tank', 'Healer', 'Support', 'DPS', 'Battlemount']
-    ratings = {}
-    
-    for role in roles:
-        query = """
-            SELECT p.nickname, AVG(s.score) as avg_score
-            FROM sessions s
-            JOIN players p ON s.player_id = p.id
-            WHERE p.guild_id = %s AND s.role = %s
-            GROUP BY p.id, p.nickname
-            HAVING COUNT(s.id) >= 3
-            ORDER BY avg_score DESC
-            LIMIT 5
-        """
-        cursor.execute(query, (guild_id, role))
-        players = cursor.fetchall()
-        ratings[role] = [{'nickname': p['nickname'], 'avg_score': round(p['avg_score'], 2)} for p in players]
-        
+    """Топ-N игроков гильдии по каждой роли, встречающейся в данных, одним запросом."""
+    min_sessions = request.args.get('min_sessions', 3, type=int)
+    top_n = request.args.get('top_n', 5, type=int)
+    cursor = get_db().cursor()
+    cursor.execute("""
+        SELECT role, nickname, avg_score
+        FROM (
+            SELECT r.role, p.nickname, SUM(r.score_sum) / SUM(r.score_count) as avg_score,
+                   ROW_NUMBER() OVER (PARTITION BY r.role ORDER BY SUM(r.score_sum) / SUM(r.score_count) DESC, p.id) as rn
+            FROM session_daily_rollup r
+            JOIN players p ON r.player_id = p.id
+            WHERE p.guild_id = %s
+            GROUP BY r.role, p.id, p.nickname
+            HAVING SUM(r.score_count) >= GREATEST(%s, 1)
+        ) ranked
+        WHERE rn <= %s
+        ORDER BY role, rn
+    """, (guild_id, min_sessions, top_n))
+
+    ratings = defaultdict(list)
+    for row in cursor.fetchall():
+        ratings[row['role']].append({'nickname': row['nickname'], 'avg_score': round(row['avg_score'], 2)})
     return jsonify({'status': 'success', 'ratings': ratings})
 
 @app.route('/api/content', methods=['GET'])
@@ -1332,6 +2911,22 @@ def get_content():
     return jsonify({'status': 'success', 'content': [dict(c) for c in cursor.fetchall()]})
 
 
+def insert_sessions(cursor, rows):
+    """
+    Вставляет сессии [(player_id, content_id, score, role, error_types, work_on, comments, mentor_id, session_date)]
+    одним multi-row INSERT и обновляет производные таблицы в транзакции вызывающего. Возвращает id.
+    """
+    session_ids = [row['id'] for row in execute_values(cursor, """
+        INSERT INTO sessions (player_id, content_id, score, role, error_types, work_on, comments, mentor_id, session_date)
+        VALUES %s
+        RETURNING id
+    """, rows, page_size=max(len(rows), 1), fetch=True)]
+    # Категории ошибок считаются один раз при записи, графики читают их простым GROUP BY
+    store_error_categories(cursor, [(session_id, row[4], row[5]) for session_id, row in zip(session_ids, rows)])
+    apply_sessions_to_rollup(cursor, session_ids)
+    bump_data_version(cursor.connection, player_ids={row[0] for row in rows})
+    return session_ids
+
 @app.route('/api/sessions', methods=['POST'])
 @privilege_required 
 def save_session():
@@ -1340,57 +2935,314 @@ def save_session():
     if not all(field in data for field in required):
         return jsonify({'status': 'error', 'message': 'Missing required fields'}), 400
     
-    player_id_to_log = data.get('playerId')
-
     db = get_db()
-    cursor = db.cursor()
-    cursor.execute('''
-        INSERT INTO sessions (player_id, content_id, score, role, error_types, work_on, comments, mentor_id, session_date)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-    ''', (
-        player_id_to_log, data['contentId'], data['score'], data['role'],
+    insert_sessions(db.cursor(), [(
+        data.get('playerId'), data['contentId'], data['score'], data['role'],
         data.get('errorTypes'), data.get('workOn'), data.get('comments'),
         session.get('player_id'), 
         data.get('sessionDate', datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
-    ))
+    )])
     db.commit()
 
     return jsonify({'status': 'success', 'message': 'Session saved.'})
 
+SESSION_BATCH_MAX_SIZE = int(os.environ.get('SESSION_BATCH_MAX_SIZE', 10000))
+
+def _parse_batch_session(item, mentor_id, now):
+    """Проверяет одну сессию пакета. Возвращает (строка для insert_sessions, список ошибок)."""
+    if not isinstance(item, dict):
+        return None, ['Session must be an object']
+    errors = [f"Missing required field '{field}'" for field in ('playerId', 'contentId', 'score', 'role') if item.get(field) in (None, '')]
+    if errors:
+        return None, errors
+
+    player_id, content_id, score = item['playerId'], item['contentId'], item['score']
+    if not isinstance(player_id, int) or isinstance(player_id, bool):
+        errors.append("'playerId' must be an integer")
+    if not isinstance(content_id, int) or isinstance(content_id, bool):
+        errors.append("'contentId' must be an integer")
+    if not isinstance(score, (int, float)) or isinstance(score, bool):
+        errors.append("'score' must be a number")
+    if not isinstance(item['role'], str):
+        errors.append("'role' must be a string")
+    session_date = item.get('sessionDate') or now
+    try:
+        datetime.datetime.fromisoformat(session_date)
+    except (TypeError, ValueError):
+        errors.append("'sessionDate' must be 'YYYY-MM-DD HH:MM:SS'")
+    if errors:
+        return None, errors
+
+    return (player_id, content_id, score, item['role'], item.get('errorTypes'), item.get('workOn'),
+            item.get('comments'), mentor_id, session_date), []
+
+@app.route('/api/sessions/batch', methods=['POST'])
+@privilege_required
+def save_sessions_batch():
+    """
+    Пакетное сохранение сессий (например, после ZvZ): принимает массив сессий (или {"sessions": [...]})
+    в формате POST /api/sessions. Пакет проверяется целиком и пишется одной транзакцией:
+    при любой ошибке ничего не сохраняется, а в ответе перечислены ошибки по индексам строк.
+    """
+    data = request.get_json(silent=True)
+    items = data.get('sessions') if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items:
+        return jsonify({'status': 'error', 'message': 'Expected a non-empty array of sessions'}), 400
+    if len(items) > SESSION_BATCH_MAX_SIZE:
+        return jsonify({'status': 'error', 'message': f'Batch is limited to {SESSION_BATCH_MAX_SIZE} sessions'}), 413
+
+    mentor_id = session.get('player_id')
+    now = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    rows, errors = [], []
+    for index, item in enumerate(items):
+        row, row_errors = _parse_batch_session(item, mentor_id, now)
+        if row_errors:
+            errors.append({'index': index, 'errors': row_errors})
+        else:
+            rows.append((index, row))
+
+    db = get_db()
+    cursor = db.cursor()
+    # Ссылки на игроков и контент проверяются двумя запросами на весь пакет, а не нарушением FK
+    cursor.execute("SELECT id FROM players WHERE id = ANY(%s)", (list({row[0] for _, row in rows}),))
+    known_players = {r['id'] for r in cursor.fetchall()}
+    cursor.execute("SELECT id FROM content WHERE id = ANY(%s)", (list({row[1] for _, row in rows}),))
+    known_content = {r['id'] for r in cursor.fetchall()}
+    for index, row in rows:
+        row_errors = []
+        if row[0] not in known_players:
+            row_errors.append(f"Player {row[0]} not found")
+        if row[1] not in known_content:
+            row_errors.append(f"Content {row[1]} not found")
+        if row_errors:
+            errors.append({'index': index, 'errors': row_errors})
+
+    if errors:
+        errors.sort(key=lambda e: e['index'])
+        return jsonify({'status': 'error', 'message': f'{len(errors)} invalid session(s), nothing saved', 'errors': errors}), 400
+
+    session_ids = insert_sessions(cursor, [row for _, row in rows])
+    db.commit()
+    return jsonify({'status': 'success', 'saved': len(session_ids), 'ids': session_ids})
+
+# --- DAILY ROLLUP ---
+# session_daily_rollup хранит sum/count/min/max оценок по (игрок, день, роль, контент).
+# Статистика читает его вместо сырых sessions, поэтому время ответа не растет с историей.
+_ROLLUP_UPSERT = """
+    INSERT INTO session_daily_rollup AS r
+        (player_id, day, role, content_id, score_sum, score_count, score_min, score_max, last_session_at)
+    SELECT player_id, session_date::date, role, content_id, SUM(score), COUNT(*), MIN(score), MAX(score), MAX(session_date)
+    FROM sessions
+    {where}
+    GROUP BY player_id, session_date::date, role, content_id
+    ON CONFLICT (player_id, day, role, content_id) DO UPDATE SET
+        score_sum = r.score_sum + EXCLUDED.score_sum,
+        score_count = r.score_count + EXCLUDED.score_count,
+        score_min = LEAST(r.score_min, EXCLUDED.score_min),
+        score_max = GREATEST(r.score_max, EXCLUDED.score_max),
+        last_session_at = GREATEST(r.last_session_at, EXCLUDED.last_session_at)
+"""
+
+def apply_sessions_to_rollup(cursor, session_ids):
+    """Добавляет только что вставленные сессии в дневной агрегат (в транзакции вызывающего)."""
+    if session_ids:
+        cursor.execute(_ROLLUP_UPSERT.format(where="WHERE id = ANY(%s)"), (list(session_ids),))
+
+def rebuild_session_rollup(db):
+    """Пересобирает session_daily_rollup из sessions с нуля."""
+    cursor = db.cursor()
+    # Блокировка не дает параллельным save_session дописать строки между очисткой и пересчетом
+    cursor.execute("LOCK TABLE session_daily_rollup IN SHARE ROW EXCLUSIVE MODE")
+    cursor.execute("DELETE FROM session_daily_rollup")
+    cursor.execute(_ROLLUP_UPSERT.format(where=""))
+    rows = cursor.rowcount
+    db.commit()
+    return rows
+
+@app.cli.command('rebuild-session-rollup')
+def rebuild_session_rollup_command():
+    """Пересобирает дневные агрегаты сессий из таблицы sessions."""
+    ensure_schema()
+    db = get_db()
+    rows = rebuild_session_rollup(db)
+    bump_all_data_versions(db)
+    db.commit()
+    logger.info(f"Rebuilt session_daily_rollup: {rows} rows.")
+
+def get_date_range(default_period='all', args=None):
+    """
+    Диапазон дат из ?from=YYYY-MM-DD&to=YYYY-MM-DD (обе границы включительно),
+    иначе из ?period=7|30|all. Возвращает (date_from, date_to), None - без границы.
+    args - аргументы запроса (по умолчанию request.args).
+    """
+    args = request.args if args is None else args
+
+    def parse(name):
+        value = args.get(name)
+        if not value:
+            return None
+        try:
+            return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+        except ValueError:
+            return None
+
+    date_from, date_to = parse('from'), parse('to')
+    if date_from or date_to:
+        return date_from, date_to
+    period = args.get('period', default_period)
+    if period in ('7', '30'):
+        return datetime.date.today() - datetime.timedelta(days=int(period)), None
+    return None, None
+
+def get_range_filter(date_range, column='r.day'):
+    """
+    SQL-условие (с ведущим AND) и параметры для фильтрации по диапазону дат.
+    Подходит и для r.day в session_daily_rollup, и для s.session_date в sessions.
+    """
+    date_from, date_to = date_range
+    conditions, params = [], []
+    if date_from:
+        conditions.append(f" AND {column} >= %s")
+        params.append(date_from)
+    if date_to:
+        conditions.append(f" AND {column} < %s")
+        params.append(date_to + datetime.timedelta(days=1))
+    return ''.join(conditions), params
+
+# --- DATA VERSIONS & STATISTICS CACHE ---
+# data_versions хранит счетчики по областям 'alliance', 'guild:<id>', 'player:<id>'. Каждая запись,
+# влияющая на статистику, увеличивает их в своей транзакции. ETag ответа статистики строится из версий
+# нужных областей, пути с аргументами и текущей даты (окна "последние N дней" сдвигаются и без записей):
+# условный запрос получает 304 без аналитических запросов, а повторный - ответ из кеша воркера.
+STATS_CACHE_SIZE = int(os.environ.get('STATS_CACHE_SIZE', 512))
+
+_stats_cache = OrderedDict()  # (path, args, etag) -> (body, mimetype)
+_stats_cache_lock = threading.Lock()
+
+
+def bump_data_version(db, player_ids=(), guild_ids=()):
+    """Увеличивает версии альянса, указанных игроков и гильдий (включая гильдии этих игроков)."""
+    player_ids, guild_ids = list(player_ids), list(guild_ids)
+    # Строки блокируются в порядке scope, чтобы параллельные записи не упирались в deadlock
+    db.cursor().execute("""
+        INSERT INTO data_versions AS v (scope, version)
+        SELECT scope, 1 FROM (
+            SELECT 'alliance' AS scope
+            UNION SELECT 'player:' || pid FROM unnest(%(players)s::integer[]) AS pid
+            UNION SELECT 'guild:' || guild_id FROM players WHERE id = ANY(%(players)s::integer[])
+            UNION SELECT 'guild:' || gid FROM unnest(%(guilds)s::integer[]) AS gid
+        ) scopes
+        ORDER BY scope
+        ON CONFLICT (scope) DO UPDATE SET version = v.version + 1
+    """, {'players': player_ids, 'guilds': guild_ids})
+
+
+def bump_all_data_versions(db):
+    """Увеличивает версии всех областей: после пересборки производных таблиц (команды CLI) устарел любой ответ."""
+    db.cursor().execute("UPDATE data_versions SET version = version + 1")
+    bump_data_version(db)  # строка 'alliance' могла еще не существовать
+
+
+def get_data_version(scopes, guild_of_player=None):
+    """Строка-токен версий для областей scopes (+ гильдии игрока guild_of_player)."""
+    cursor = get_db().cursor()
+    cursor.execute("""
+        SELECT scope, version FROM data_versions
+        WHERE scope = ANY(%s)
+           OR scope = (SELECT 'guild:' || guild_id FROM players WHERE id = %s)
+        ORDER BY scope
+    """, (list(scopes), guild_of_player))
+    return ','.join(f"{row['scope']}={row['version']}" for row in cursor.fetchall())
+
+
+def statistics_cache(scope):
+    """
+    ETag/304 и кеш ответов для GET статистики. scope - от каких данных зависит ответ:
+    'player' (игрок из <player_id>), 'player+guild' (игрок и его гильдия), 'guild' (<guild_id>)
+    или 'alliance' (любая запись).
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            # Вызов из другого эндпоинта (as_json=False) возвращает сырые данные без кеша
+            if kwargs.get('as_json') is False:
+                return f(*args, **kwargs)
+            player_id, guild_id = kwargs.get('player_id'), kwargs.get('guild_id')
+            if scope == 'player':
+                version = get_data_version([f'player:{player_id}'])
+            elif scope == 'player+guild':
+                version = get_data_version([f'player:{player_id}'], guild_of_player=player_id)
+            elif scope == 'guild':
+                version = get_data_version([f'guild:{guild_id}'])
+            else:
+                version = get_data_version(['alliance'])
+
+            query_args = tuple(sorted(request.args.items(multi=True)))
+            etag = hashlib.sha1(f"{request.path}?{query_args}|{version}|{datetime.date.today()}".encode()).hexdigest()
+            if etag in request.if_none_match:
+                response = Response(status=304)
+            else:
+                key = (request.path, query_args, etag)
+                with _stats_cache_lock:
+                    cached = _stats_cache.get(key)
+                    if cached is not None:
+                        _stats_cache.move_to_end(key)
+                if cached is not None:
+                    response = Response(cached[0], mimetype=cached[1])
+                else:
+                    response = app.make_response(f(*args, **kwargs))
+                    if response.status_code != 200:
+                        return response
+                    with _stats_cache_lock:
+                        _stats_cache[key] = (response.get_data(), response.mimetype)
+                        while len(_stats_cache) > STATS_CACHE_SIZE:
+                            _stats_cache.popitem(last=False)
+            response.set_etag(etag)
+            # Браузер хранит ответ, но перепроверяет его каждый раз (If-None-Match)
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return decorated_function
+    return decorator
+
 # --- STATISTICS API ROUTES ---
 
 @app.route('/api/statistics/player/<int:player_id>', methods=['GET'])
+@statistics_cache('player')
 def get_player_stats(player_id):
-    period = request.args.get('period', '7')
-    date_filter = get_date_filter(period)
+    range_filter, range_params = get_range_filter(get_date_range('7'))
     
-    query = f"SELECT AVG(score) as avg_score, COUNT(*) as session_count, MAX(session_date) as last_update FROM sessions WHERE player_id = %s {date_filter}"
+    query = f"""
+        SELECT SUM(r.score_sum) / NULLIF(SUM(r.score_count), 0) as avg_score,
+               COALESCE(SUM(r.score_count), 0) as session_count,
+               MAX(r.last_session_at) as last_update
+        FROM session_daily_rollup r WHERE r.player_id = %s {range_filter}
+    """
     
     cursor = get_db().cursor()
-    cursor.execute(query, (player_id,))
+    cursor.execute(query, (player_id, *range_params))
     stats = cursor.fetchone()
     return jsonify({'status': 'success', 'avgScore': stats['avg_score'] or 0, 'sessionCount': stats['session_count'], 'lastUpdate': stats['last_update']})
 
 @app.route('/api/statistics/comparison/<int:player_id>', methods=['GET'])
+@statistics_cache('player+guild')
 def get_comparison_with_average(player_id):
     try:
         cursor = get_db().cursor()
-        period = request.args.get('period', 'all')
-        date_filter = get_date_filter(period)
+        range_filter, range_params = get_range_filter(get_date_range('all'))
 
-        cursor.execute(f"SELECT AVG(score) as avg_score FROM sessions WHERE player_id = %s {date_filter}", (player_id,))
+        cursor.execute(f"SELECT SUM(r.score_sum) / NULLIF(SUM(r.score_count), 0) as avg_score FROM session_daily_rollup r WHERE r.player_id = %s {range_filter}", (player_id, *range_params))
         player_score_row = cursor.fetchone()
         player_score = (player_score_row['avg_score'] or 0) if player_score_row else 0
         
         query = f"""
             SELECT MAX(avg_score) as best_player_score FROM (
-                SELECT AVG(s.score) as avg_score 
+                SELECT SUM(r.score_sum) / NULLIF(SUM(r.score_count), 0) as avg_score 
                 FROM players p 
-                JOIN sessions s ON p.id = s.player_id 
-                WHERE p.guild_id = (SELECT guild_id FROM players WHERE id = %s) {date_filter.replace("AND", "AND s.")}
+                JOIN session_daily_rollup r ON p.id = r.player_id 
+                WHERE p.guild_id = (SELECT guild_id FROM players WHERE id = %s) {range_filter}
                 GROUP BY p.id
-            )"""
-        cursor.execute(query, (player_id,))
+            ) as guild_scores"""
+        cursor.execute(query, (player_id, *range_params))
         top_row = cursor.fetchone()
         best_player_score = (top_row['best_player_score'] or 0) if top_row else 0
 
@@ -1399,26 +3251,31 @@ def get_comparison_with_average(player_id):
         logger.error(f"Error in get_comparison_with_average: {e}\n{traceback.format_exc()}")
         return jsonify({'status': 'error', 'message': "Internal server error"}), 500
 
+# Сессии без записанных ошибок, как и раньше, попадают в 'Другое'
+PLAYER_ERROR_COUNTS_QUERY = """
+    SELECT COALESCE(sec.category, 'Другое') as category, COUNT(*) as count
+    FROM sessions s
+    LEFT JOIN session_error_categories sec ON sec.session_id = s.id
+    WHERE s.player_id = %s
+    GROUP BY 1
+"""
+
 def _get_player_comparison_stats(player_id):
     cursor = get_db().cursor()
     cursor.execute("SELECT AVG(score) as avg_score, COUNT(id) as session_count FROM sessions WHERE player_id = %s", (player_id,))
     stats = cursor.fetchone()
     
-    cursor.execute("SELECT error_types, work_on FROM sessions WHERE player_id = %s", (player_id,))
-    error_counts = defaultdict(int)
-    for row in cursor.fetchall():
-        full_text = f"{row['error_types'] or ''} {row['work_on'] or ''}"
-        categories = categorize_error_text(full_text)
-        for category in categories:
-            error_counts[category] += 1
+    cursor.execute(PLAYER_ERROR_COUNTS_QUERY, (player_id,))
+    error_counts = {row['category']: row['count'] for row in cursor.fetchall()}
             
     return {
         'score': stats['avg_score'] or 0,
         'sessions': stats['session_count'] or 0,
-        'errors': dict(error_counts)
+        'errors': error_counts
     }
 
 @app.route('/api/statistics/full-comparison', methods=['GET'])
+@statistics_cache('alliance')
 def full_compare_two_players():
     player1_id = request.args.get('p1', type=int)
     player2_id = request.args.get('p2', type=int)
@@ -1426,11 +3283,15 @@ def full_compare_two_players():
     if not player1_id or not player2_id:
         return jsonify({'status': 'error', 'message': 'Two player IDs are required'}), 400
 
-    p1_trend = get_player_trend(player1_id, as_json=False)
-    p2_trend = get_player_trend(player2_id, as_json=False)
-    
-    p1_roles = get_player_role_scores(player1_id, as_json=False)
-    p2_roles = get_player_role_scores(player2_id, as_json=False)
+    # Тренды обоих игроков - одним запросом на общей оси корзин
+    granularity, moving_avg = get_trend_args()
+    cursor = get_db().cursor()
+    cursor.execute(*player_trend_query((player1_id, player2_id), get_date_range('all'), granularity, moving_avg))
+    trends = players_trend_data(cursor.fetchall(), (player1_id, player2_id), granularity, moving_avg)
+    p1_trend, p2_trend = trends[player1_id], trends[player2_id]
+
+    p1_roles = get_player_role_scores(player_id=player1_id, as_json=False)
+    p2_roles = get_player_role_scores(player_id=player2_id, as_json=False)
     
     p1_errors = _get_player_comparison_stats(player1_id)['errors']
     p2_errors = _get_player_comparison_stats(player2_id)['errors']
@@ -1450,97 +3311,173 @@ def full_compare_two_players():
     })
 
 @app.route('/api/statistics/player-trend/<int:player_id>', methods=['GET'])
-def get_player_trend(player_id, as_json=True):
-    period = request.args.get('period', '30' if as_json else 'all')
-    date_filter = get_date_filter(period)
-    
-    query = f"SELECT to_char(session_date, 'YYYY-WW') as week, AVG(score) as avg_score FROM sessions WHERE player_id = %s {date_filter} GROUP BY week ORDER BY week"
-    
+@statistics_cache('player')
+def get_player_trend(player_id):
+    """Тренд среднего балла (?granularity=day|week|month, ?moving_avg=N, ?period= или ?from=&to=, по умолчанию 30 дней)."""
+    granularity, moving_avg = get_trend_args()
     cursor = get_db().cursor()
-    cursor.execute(query, (player_id,))
-    rows = cursor.fetchall()
-    
-    data = {'weeks': [r['week'] for r in rows], 'scores': [round(r['avg_score'] or 0, 2) for r in rows]}
-    return jsonify({'status': 'success', **data}) if as_json else data
+    cursor.execute(*player_trend_query((player_id,), get_date_range('30'), granularity, moving_avg))
+    data = player_trend_data(cursor.fetchall(), granularity, moving_avg)
+    return jsonify({'status': 'success', **data})
+
+# Запрос и форма ответа вынесены отдельно: их же использует ASGI-режим (asgi.py)
+TREND_GRANULARITIES = {'day': '1 day', 'week': '1 week', 'month': '1 month'}
+TREND_MOVING_AVG_MAX = 52
+
+def get_trend_args(args=None):
+    """(granularity, moving_avg) из ?granularity=day|week|month (по умолчанию week) и ?moving_avg=N корзин (0 - без него)."""
+    args = request.args if args is None else args
+    granularity = args.get('granularity', 'week')
+    if granularity not in TREND_GRANULARITIES:
+        granularity = 'week'
+    try:
+        moving_avg = int(args.get('moving_avg', 0))
+    except ValueError:
+        moving_avg = 0
+    return granularity, min(max(moving_avg, 0), TREND_MOVING_AVG_MAX)
+
+def player_trend_query(player_ids, date_range, granularity='week', moving_avg=0):
+    """
+    Тренд игроков по корзинам date_trunc(granularity) из дневного агрегата: условие по r.day идет
+    по первичному ключу, корзины - даты и сортируются хронологически. Корзины без сессий между первой
+    и последней заполняются (avg_score NULL, sessions 0) на общей для всех игроков оси; скользящее
+    среднее за moving_avg корзин взвешено по числу сессий и считается оконной функцией в том же запросе.
+    """
+    range_filter, range_params = get_range_filter(date_range)
+    return f"""
+        WITH RECURSIVE totals AS (
+            SELECT r.player_id, date_trunc('{granularity}', r.day)::date as bucket,
+                   SUM(r.score_sum) as score_sum, SUM(r.score_count) as score_count
+            FROM session_daily_rollup r WHERE r.player_id = ANY(%s) {range_filter}
+            GROUP BY r.player_id, bucket
+        ), buckets AS (
+            SELECT MIN(bucket) as bucket FROM totals
+            UNION ALL
+            SELECT (bucket + INTERVAL '{TREND_GRANULARITIES[granularity]}')::date FROM buckets
+            WHERE bucket < (SELECT MAX(bucket) FROM totals)
+        )
+        SELECT p.player_id, b.bucket, t.score_sum / NULLIF(t.score_count, 0) as avg_score,
+               COALESCE(t.score_count, 0) as sessions,
+               SUM(t.score_sum) OVER w / NULLIF(SUM(t.score_count) OVER w, 0) as moving_avg
+        FROM (SELECT DISTINCT player_id FROM totals) p
+        CROSS JOIN buckets b
+        LEFT JOIN totals t ON t.player_id = p.player_id AND t.bucket = b.bucket
+        WINDOW w AS (PARTITION BY p.player_id ORDER BY b.bucket ROWS BETWEEN {max(moving_avg - 1, 0)} PRECEDING AND CURRENT ROW)
+        ORDER BY p.player_id, b.bucket
+    """, (list(player_ids), *range_params)
+
+def _trend_label(bucket, granularity):
+    """Подпись корзины: дата начала дня/недели (понедельник), для месяца - YYYY-MM."""
+    label = str(bucket)[:10]
+    return label[:7] if granularity == 'month' else label
+
+def player_trend_data(rows, granularity='week', moving_avg=0):
+    """
+    Ряд одного игрока из строк player_trend_query (или trend_series). Пропуски - None в scores.
+    weeks - прежнее имя labels, оставлено для существующих клиентов.
+    """
+    labels = [_trend_label(r['bucket'], granularity) for r in rows]
+    data = {
+        'granularity': granularity,
+        'labels': labels,
+        'weeks': labels,
+        'scores': [round(r['avg_score'], 2) if r['avg_score'] is not None else None for r in rows],
+        'sessions': [r['sessions'] for r in rows],
+    }
+    if moving_avg:
+        data['moving_avg'] = [round(r['moving_avg'], 2) if r['moving_avg'] is not None else None for r in rows]
+    return data
+
+def players_trend_data(rows, player_ids, granularity='week', moving_avg=0):
+    """{player_id: ряд} из одного запроса player_trend_query по нескольким игрокам."""
+    by_player = {player_id: [] for player_id in player_ids}
+    for row in rows:
+        by_player[row['player_id']].append(row)
+    return {player_id: player_trend_data(by_player[player_id], granularity, moving_avg) for player_id in player_ids}
 
 @app.route('/api/statistics/player-role-scores/<int:player_id>', methods=['GET'])
+@statistics_cache('player')
 def get_player_role_scores(player_id, as_json=True):
-    period = request.args.get('period', 'all')
-    date_filter = get_date_filter(period)
-    
-    query = f"SELECT role, AVG(score) as avg_score FROM sessions WHERE player_id = %s {date_filter} GROUP BY role ORDER BY avg_score DESC"
-    
     cursor = get_db().cursor()
-    cursor.execute(query, (player_id,))
-    rows = cursor.fetchall()
-    
-    data = {'roles': [r['role'] for r in rows], 'scores': [round(r['avg_score'] or 0, 2) for r in rows]}
+    cursor.execute(*player_role_scores_query(player_id, get_date_range('all')))
+    data = player_role_scores_data(cursor.fetchall())
     return jsonify({'status': 'success', **data}) if as_json else data
 
+def player_role_scores_query(player_id, date_range):
+    range_filter, range_params = get_range_filter(date_range)
+    return f"""
+        SELECT r.role, SUM(r.score_sum) / NULLIF(SUM(r.score_count), 0) as avg_score
+        FROM session_daily_rollup r WHERE r.player_id = %s {range_filter}
+        GROUP BY r.role ORDER BY avg_score DESC
+    """, (player_id, *range_params)
+
+def player_role_scores_data(rows):
+    return {'roles': [r['role'] for r in rows], 'scores': [round(r['avg_score'] or 0, 2) for r in rows]}
+
 
 @app.route('/api/statistics/player-content-scores/<int:player_id>', methods=['GET'])
+@statistics_cache('player')
 def get_player_content_scores(player_id):
-    period = request.args.get('period', 'all')
-    date_filter = get_date_filter(period)
+    range_filter, range_params = get_range_filter(get_date_range('all'))
     
     query = f"""
-        SELECT c.name as content, AVG(s.score) as avg_score 
-        FROM sessions s JOIN content c ON s.content_id = c.id 
-        WHERE s.player_id = %s {date_filter.replace("AND", "AND s.")} 
+        SELECT c.name as content, SUM(r.score_sum) / NULLIF(SUM(r.score_count), 0) as avg_score 
+        FROM session_daily_rollup r JOIN content c ON r.content_id = c.id 
+        WHERE r.player_id = %s {range_filter} 
         GROUP BY c.id ORDER BY avg_score DESC
     """
     
     cursor = get_db().cursor()
-    cursor.execute(query, (player_id,))
+    cursor.execute(query, (player_id, *range_params))
     rows = cursor.fetchall()
     return jsonify({'status': 'success', 'contents': [r['content'] for r in rows], 'scores': [round(r['avg_score'] or 0, 2) for r in rows]})
 
 @app.route('/api/statistics/player-error-types/<int:player_id>', methods=['GET'])
+@statistics_cache('player')
 def get_player_error_types(player_id):
-    period = request.args.get('period', 'all')
-    date_filter = get_date_filter(period)
+    range_filter, range_params = get_range_filter(get_date_range('all'), 's.session_date')
     
-    query = f"SELECT error_types, work_on FROM sessions WHERE player_id = %s AND (error_types IS NOT NULL AND error_types != '' OR work_on IS NOT NULL AND work_on != '') {date_filter}"
+    query = f"""
+        SELECT sec.category, COUNT(*) as count
+        FROM session_error_categories sec
+        JOIN sessions s ON s.id = sec.session_id
+        WHERE s.player_id = %s {range_filter}
+        GROUP BY sec.category
+    """
     
     cursor = get_db().cursor()
-    cursor.execute(query, (player_id,))
-    
-    error_counts = defaultdict(int)
-    for row in cursor.fetchall():
-        full_text = f"{row['error_types'] or ''}, {row['work_on'] or ''}"
-        categories = categorize_error_text(full_text)
-        for category in categories:
-            error_counts[category] += 1
+    cursor.execute(query, (player_id, *range_params))
+    rows = cursor.fetchall()
             
-    return jsonify({'status': 'success', 'errors': list(error_counts.keys()), 'counts': list(error_counts.values())})
+    return jsonify({'status': 'success', 'errors': [r['category'] for r in rows], 'counts': [r['count'] for r in rows]})
 
 
 @app.route('/api/statistics/error-distribution/<int:player_id>', methods=['GET'])
+@statistics_cache('player')
 def get_error_distribution(player_id):
-    period = request.args.get('period', 'all')
-    date_filter = get_date_filter(period)
+    range_filter, range_params = get_range_filter(get_date_range('all'), 's.session_date')
     
     query = f"""
         SELECT c.name as content, COUNT(s.id) as count
         FROM sessions s
         JOIN content c ON s.content_id = c.id
-        WHERE s.player_id = %s AND (s.error_types IS NOT NULL AND s.error_types != '' OR s.work_on IS NOT NULL AND s.work_on != '') {date_filter.replace("AND", "AND s.")}
+        WHERE s.player_id = %s AND (s.error_types IS NOT NULL AND s.error_types != '' OR s.work_on IS NOT NULL AND s.work_on != '') {range_filter}
         GROUP BY c.name
     """
     cursor = get_db().cursor()
-    cursor.execute(query, (player_id,))
+    cursor.execute(query, (player_id, *range_params))
     rows = cursor.fetchall()
     return jsonify({'status': 'success', 'contents': [r['content'] for r in rows], 'counts': [r['count'] for r in rows]})
 
 @app.route('/api/statistics/error-score-correlation/<int:player_id>', methods=['GET'])
+@statistics_cache('player')
 def get_error_score_correlation(player_id):
-    period = request.args.get('period', 'all')
-    date_filter = get_date_filter(period)
+    range_filter, range_params = get_range_filter(get_date_range('all'), 's.session_date')
     
-    query = f"SELECT score, error_types, work_on FROM sessions WHERE player_id = %s {date_filter}"
+    query = f"SELECT s.score, s.error_types, s.work_on FROM sessions s WHERE s.player_id = %s {range_filter}"
     
     cursor = get_db().cursor()
-    cursor.execute(query, (player_id,))
+    cursor.execute(query, (player_id, *range_params))
     points = []
     for row in cursor.fetchall():
         error_count = 0
@@ -1551,6 +3488,136 @@ def get_error_score_correlation(player_id):
         points.append({'errors': error_count, 'score': row['score']})
     return jsonify({'status': 'success', 'points': points})
 
+def _trend_bucket(day, granularity):
+    """Python-эквивалент date_trunc(granularity, day)::date: неделя начинается с понедельника."""
+    if granularity == 'month':
+        return day.replace(day=1)
+    if granularity == 'week':
+        return day - datetime.timedelta(days=day.weekday())
+    return day
+
+def trend_series(totals, granularity='week', moving_avg=0):
+    """
+    {корзина: [sum, count]} -> ряд player_trend_data с теми же заполненными пропусками
+    и взвешенным скользящим средним, что и player_trend_query (для уже прочитанных строк сессий).
+    """
+    rows, window = [], []
+    bucket, last = (min(totals), max(totals)) if totals else (None, None)
+    while bucket is not None and bucket <= last:
+        total, count = totals.get(bucket, (0, 0))
+        window = (window + [(total, count)])[-max(moving_avg, 1):]
+        window_count = sum(c for _, c in window)
+        rows.append({
+            'bucket': bucket,
+            'avg_score': total / count if count else None,
+            'sessions': count,
+            'moving_avg': sum(t for t, _ in window) / window_count if window_count else None,
+        })
+        if granularity == 'month':
+            bucket = (bucket + datetime.timedelta(days=32)).replace(day=1)
+        else:
+            bucket += datetime.timedelta(days=7 if granularity == 'week' else 1)
+    return player_trend_data(rows, granularity, moving_avg)
+
+def _sorted_averages(groups):
+    """{key: [sum, count]} -> список (key, avg), отсортированный по убыванию среднего."""
+    averages = [(key, total / count) for key, (total, count) in groups.items()]
+    averages.sort(key=lambda item: item[1], reverse=True)
+    return averages
+
+@app.route('/api/statistics/player-bundle/<int:player_id>', methods=['GET'])
+@statistics_cache('player+guild')
+def get_player_bundle(player_id):
+    """
+    Все данные личного дашборда за один запрос (?period= или ?from=&to=, для тренда ?granularity=&moving_avg=):
+    сессии игрока читаются один раз, а статистика, тренд, оценки по ролям/контенту и ошибки считаются
+    из одного набора строк.
+    """
+    try:
+        date_range = get_date_range('7')
+        granularity, moving_avg = get_trend_args()
+        range_filter, range_params = get_range_filter(date_range, 's.session_date')
+        cursor = get_db().cursor()
+
+        cursor.execute(f"""
+            SELECT s.score, s.role, s.error_types, s.work_on, s.session_date, s.content_id, c.name as content_name,
+                   ARRAY(SELECT sec.category FROM session_error_categories sec WHERE sec.session_id = s.id) as error_categories
+            FROM sessions s JOIN content c ON s.content_id = c.id
+            WHERE s.player_id = %s {range_filter}
+        """, (player_id, *range_params))
+        rows = cursor.fetchall()
+
+        # Лучший средний балл в гильдии — единственная метрика, которой нужны чужие сессии (берется из агрегата)
+        rollup_filter, rollup_params = get_range_filter(date_range)
+        cursor.execute(f"""
+            SELECT MAX(avg_score) as best_player_score FROM (
+                SELECT SUM(r.score_sum) / NULLIF(SUM(r.score_count), 0) as avg_score
+                FROM players p
+                JOIN session_daily_rollup r ON p.id = r.player_id
+                WHERE p.guild_id = (SELECT guild_id FROM players WHERE id = %s) {rollup_filter}
+                GROUP BY p.id
+            ) as guild_scores""", (player_id, *rollup_params))
+        top_row = cursor.fetchone()
+        best_player_score = (top_row['best_player_score'] or 0) if top_row else 0
+
+        total_score = 0
+        last_update = None
+        buckets = defaultdict(lambda: [0, 0])
+        roles = defaultdict(lambda: [0, 0])
+        contents = defaultdict(lambda: [0, 0])
+        content_names = {}
+        error_counts = defaultdict(int)
+        error_distribution = defaultdict(int)
+        points = []
+
+        for row in rows:
+            score = row['score']
+            total_score += score
+            if row['session_date'] is not None:
+                if last_update is None or row['session_date'] > last_update:
+                    last_update = row['session_date']
+                bucket = buckets[_trend_bucket(row['session_date'].date(), granularity)]
+                bucket[0] += score
+                bucket[1] += 1
+            role = roles[row['role']]
+            role[0] += score
+            role[1] += 1
+            content = contents[row['content_id']]
+            content[0] += score
+            content[1] += 1
+            content_names[row['content_id']] = row['content_name']
+
+            if row['error_types'] or row['work_on']:
+                for category in row['error_categories']:
+                    error_counts[category] += 1
+                error_distribution[row['content_name']] += 1
+
+            error_count = 0
+            if row['error_types']:
+                error_count += len([e for e in row['error_types'].split(',') if e.strip()])
+            if row['work_on']:
+                error_count += len([e for e in row['work_on'].split(',') if e.strip()])
+            points.append({'errors': error_count, 'score': score})
+
+        avg_score = total_score / len(rows) if rows else 0
+        role_scores = _sorted_averages(roles)
+        content_scores = _sorted_averages(contents)
+
+        return jsonify({
+            'status': 'success',
+            'stats': {'avgScore': avg_score, 'sessionCount': len(rows), 'lastUpdate': last_update},
+            'comparison': {'playerScore': round(avg_score, 2), 'bestPlayerScore': round(best_player_score, 2)},
+            'trend': trend_series(buckets, granularity, moving_avg),
+            'roleScores': {'roles': [r for r, _ in role_scores], 'scores': [round(avg, 2) for _, avg in role_scores]},
+            'contentScores': {'contents': [content_names[c] for c, _ in content_scores], 'scores': [round(avg, 2) for _, avg in content_scores]},
+            'errorTypes': {'errors': list(error_counts.keys()), 'counts': list(error_counts.values())},
+            'errorDistribution': {'contents': list(error_distribution.keys()), 'counts': list(error_distribution.values())},
+            'errorScore': {'points': points}
+        })
+    except Exception as e:
+        logger.error(f"Error in get_player_bundle: {e}\n{traceback.format_exc()}")
+        return jsonify({'status': 'error', 'message': "Internal server error"}), 500
+
 @app.route('/api/recommendations/player/<int:player_id>', methods=['GET'])
 def get_player_recommendations(player_id):
     cursor = get_db().cursor()
@@ -1559,54 +3626,60 @@ def get_player_recommendations(player_id):
     return jsonify({'status': 'success', 'recommendations': [dict(r) for r in recs]})
 
 @app.route('/api/statistics/guild-role-distribution', methods=['GET'])
+@statistics_cache('alliance')
 def get_guild_role_distribution():
+    range_filter, range_params = get_range_filter(get_date_range('all'))
     cursor = get_db().cursor()
-    cursor.execute("SELECT role, COUNT(*) as count FROM sessions GROUP BY role")
+    cursor.execute(f"SELECT r.role, SUM(r.score_count) as count FROM session_daily_rollup r WHERE TRUE {range_filter} GROUP BY r.role", range_params)
     rows = cursor.fetchall()
     return jsonify({'status': 'success', 'roles': [r['role'] for r in rows], 'counts': [r['count'] for r in rows]})
 
 @app.route('/api/statistics/guild-error-types', methods=['GET'])
+@statistics_cache('alliance')
 def get_guild_error_types():
     cursor = get_db().cursor()
-    cursor.execute("SELECT error_types, work_on FROM sessions WHERE (error_types IS NOT NULL AND error_types != '') OR (work_on IS NOT NULL AND work_on != '')")
-    error_counts = defaultdict(int)
-    for row in cursor.fetchall():
-        full_text = f"{row['error_types'] or ''}, {row['work_on'] or ''}"
-        categories = categorize_error_text(full_text)
-        for category in categories:
-            error_counts[category] += 1
-            
-    return jsonify({'status': 'success', 'errors': list(error_counts.keys()), 'counts': list(error_counts.values())})
+    cursor.execute("SELECT category, COUNT(*) as count FROM session_error_categories GROUP BY category")
+    rows = cursor.fetchall()
+    return jsonify({'status': 'success', 'errors': [r['category'] for r in rows], 'counts': [r['count'] for r in rows]})
 
 @app.route('/api/statistics/top-errors', methods=['GET'])
+@statistics_cache('alliance')
 def get_top_errors():
     cursor = get_db().cursor()
-    cursor.execute("SELECT error_types, work_on FROM sessions WHERE (error_types IS NOT NULL AND error_types != '') OR (work_on IS NOT NULL AND work_on != '')")
-    error_counts = defaultdict(int)
-    for row in cursor.fetchall():
-        full_text = f"{row['error_types'] or ''}, {row['work_on'] or ''}"
-        categories = categorize_error_text(full_text)
-        for category in categories:
-            error_counts[category] += 1
-
-    sorted_errors = sorted(error_counts.items(), key=lambda item: item[1], reverse=True)
-    return jsonify({'status': 'success', 'errors': [e[0] for e in sorted_errors], 'counts': [e[1] for e in sorted_errors]})
+    cursor.execute("SELECT category, COUNT(*) as count FROM session_error_categories GROUP BY category ORDER BY count DESC")
+    rows = cursor.fetchall()
+    return jsonify({'status': 'success', 'errors': [r['category'] for r in rows], 'counts': [r['count'] for r in rows]})
 
 @app.route('/api/statistics/guild/<int:guild_id>', methods=['GET'])
+@statistics_cache('guild')
 def get_guild_stats(guild_id):
+    range_filter, range_params = get_range_filter(get_date_range('30'))
     cursor = get_db().cursor()
-    cursor.execute("SELECT COUNT(DISTINCT p.id) as active_players, COUNT(s.id) as session_count, AVG(s.score) as avg_score FROM players p LEFT JOIN sessions s ON p.id = s.player_id WHERE p.guild_id = %s AND s.session_date >= (NOW() - INTERVAL '30 days')", (guild_id,))
+    cursor.execute(f"""
+        SELECT COUNT(DISTINCT r.player_id) as active_players, SUM(r.score_count) as session_count,
+               SUM(r.score_sum) / NULLIF(SUM(r.score_count), 0) as avg_score
+        FROM session_daily_rollup r JOIN players p ON p.id = r.player_id
+        WHERE p.guild_id = %s {range_filter}
+    """, (guild_id, *range_params))
     stats = cursor.fetchone()
     return jsonify({'status': 'success', 'activePlayers': stats['active_players'] or 0, 'sessionCount': stats['session_count'] or 0, 'avgScore': stats['avg_score'] or 0})
 
 @app.route('/api/statistics/guild-ranking', methods=['GET'])
+@statistics_cache('alliance')
 def get_guild_ranking():
+    range_filter, range_params = get_range_filter(get_date_range('all'))
     cursor = get_db().cursor()
-    cursor.execute("SELECT g.name as guild, AVG(s.score) as avg_score FROM guilds g LEFT JOIN players p ON g.id = p.guild_id LEFT JOIN sessions s ON p.id = s.player_id WHERE s.id IS NOT NULL GROUP BY g.id ORDER BY avg_score DESC")
+    cursor.execute(f"""
+        SELECT g.name as guild, SUM(r.score_sum) / SUM(r.score_count) as avg_score
+        FROM guilds g JOIN players p ON g.id = p.guild_id JOIN session_daily_rollup r ON p.id = r.player_id
+        WHERE TRUE {range_filter}
+        GROUP BY g.id ORDER BY avg_score DESC
+    """, range_params)
     rows = cursor.fetchall()
     return jsonify({'status': 'success', 'guilds': [r['guild'] for r in rows], 'scores': [round(r['avg_score'] or 0, 2) for r in rows]})
 
 @app.route('/api/statistics/best-player-week', methods=['GET'])
+@statistics_cache('alliance')
 def get_best_player_week():
     # ИСПРАВЛЕНИЕ: guild_id больше не требуется, ищем по всему альянсу
     cursor = get_db().cursor()
@@ -1648,24 +3721,110 @@ def get_help_requests_count():
 
 # Стало (исправлено)
 @app.route('/api/statistics/total-sessions', methods=['GET'])
+@statistics_cache('alliance')
 def get_total_sessions():
     guild_id = request.args.get('guild_id')
+    range_filter, range_params = get_range_filter(get_date_range('all'))
     cursor = get_db().cursor()
     
     guild_sessions = 0
     if guild_id:
-        cursor.execute("SELECT COUNT(s.id) as count FROM sessions s JOIN players p ON s.player_id = p.id WHERE p.guild_id = %s", (guild_id,))
+        cursor.execute(f"SELECT COALESCE(SUM(r.score_count), 0) as count FROM session_daily_rollup r JOIN players p ON r.player_id = p.id WHERE p.guild_id = %s {range_filter}", (guild_id, *range_params))
         result = cursor.fetchone()
         if result:
             # ИСПРАВЛЕНИЕ: Обращение по имени поля 'count'
             guild_sessions = result['count']
             
-    cursor.execute("SELECT COUNT(id) as count FROM sessions")
+    cursor.execute(f"SELECT COALESCE(SUM(r.score_count), 0) as count FROM session_daily_rollup r WHERE TRUE {range_filter}", range_params)
     # ИСПРАВЛЕНИЕ: Обращение по имени поля 'count'
     total_sessions = cursor.fetchone()['count']
     
     return jsonify({'status': 'success', 'guild_sessions': guild_sessions, 'total': total_sessions})
 
+@app.route('/api/statistics/guild-bundle/<int:guild_id>', methods=['GET'])
+@statistics_cache('alliance')
+def get_guild_bundle(guild_id):
+    """
+    Все виджеты вкладки гильдии/альянса за один запрос. Дневной агрегат сворачивается в SQL:
+    по гильдиям (итоги, окно 30 дней, рейтинг; игроки без гильдии входят в итоги альянса),
+    по ролям и по игрокам за 14 дней (лучший игрок); категории ошибок - одним GROUP BY;
+    топ игроков - query_leaderboard по альянсу.
+    """
+    try:
+        min_sessions = request.args.get('min_sessions', 5, type=int)
+        limit = request.args.get('limit', 10, type=int)
+        cursor = get_db().cursor()
+
+        cursor.execute("""
+            SELECT
+                p.guild_id, g.name as guild_name,
+                SUM(r.score_count) as cnt,
+                SUM(r.score_sum) as total,
+                COALESCE(SUM(r.score_count) FILTER (WHERE r.day >= CURRENT_DATE - 30), 0) as cnt_30d,
+                COALESCE(SUM(r.score_sum) FILTER (WHERE r.day >= CURRENT_DATE - 30), 0) as total_30d,
+                COUNT(DISTINCT r.player_id) FILTER (WHERE r.day >= CURRENT_DATE - 30) as players_30d
+            FROM session_daily_rollup r
+            LEFT JOIN players p ON p.id = r.player_id
+            LEFT JOIN guilds g ON g.id = p.guild_id
+            GROUP BY p.guild_id, g.name
+        """)
+        guilds = cursor.fetchall()
+
+        cursor.execute("SELECT r.role, SUM(r.score_count) as count FROM session_daily_rollup r GROUP BY r.role ORDER BY r.role")
+        role_counts = {row['role']: row['count'] for row in cursor.fetchall()}
+
+        # Лучший игрок за 14 дней по всему альянсу (минимум 3 сессии), его основная роль и лучший контент
+        cursor.execute("""
+            WITH recent AS (
+                SELECT r.player_id, r.role, r.content_id, SUM(r.score_count) as cnt, SUM(r.score_sum) as total
+                FROM session_daily_rollup r
+                WHERE r.day >= CURRENT_DATE - 14
+                GROUP BY r.player_id, r.role, r.content_id
+            ), best AS (
+                SELECT player_id, SUM(total) / SUM(cnt) as avg_score
+                FROM recent GROUP BY player_id HAVING SUM(cnt) >= 3
+                ORDER BY avg_score DESC, player_id LIMIT 1
+            )
+            SELECT b.player_id as id, p.nickname, p.avatar_url, b.avg_score,
+                   (SELECT x.role FROM recent x WHERE x.player_id = b.player_id
+                    GROUP BY x.role ORDER BY SUM(x.cnt) DESC, x.role LIMIT 1) as main_role,
+                   (SELECT c.name FROM recent x JOIN content c ON c.id = x.content_id WHERE x.player_id = b.player_id
+                    GROUP BY c.name ORDER BY SUM(x.total) / SUM(x.cnt) DESC, c.name LIMIT 1) as best_content
+            FROM best b JOIN players p ON p.id = b.player_id
+        """)
+        best_row = cursor.fetchone()
+        best_player = dict(best_row) if best_row else None
+
+        cursor.execute("SELECT category, COUNT(*) as count FROM session_error_categories GROUP BY category ORDER BY count DESC")
+        top_errors = [(row['category'], row['count']) for row in cursor.fetchall()]
+
+        own = next((row for row in guilds if row['guild_id'] == guild_id), None)
+        total_sessions = sum(row['cnt'] for row in guilds)
+        guild_ranking = sorted(((row['guild_name'], row['total'] / row['cnt']) for row in guilds
+                                if row['guild_name'] is not None and row['cnt']),
+                               key=lambda item: item[1], reverse=True)
+
+        top_players = query_leaderboard(cursor, None, min_sessions, limit)
+
+        return jsonify({
+            'status': 'success',
+            'guildStats': {
+                'activePlayers': own['players_30d'] if own else 0,
+                'sessionCount': own['cnt_30d'] if own else 0,
+                'avgScore': own['total_30d'] / own['cnt_30d'] if own and own['cnt_30d'] else 0
+            },
+            'totalSessions': {'guild_sessions': own['cnt'] if own else 0, 'total': total_sessions},
+            'bestPlayer': {'player': best_player},
+            'roleDistribution': {'roles': list(role_counts.keys()), 'counts': list(role_counts.values())},
+            'errorTypes': {'errors': [e[0] for e in top_errors], 'counts': [e[1] for e in top_errors]},
+            'topErrors': {'errors': [e[0] for e in top_errors], 'counts': [e[1] for e in top_errors]},
+            'guildRanking': {'guilds': [name for name, _ in guild_ranking], 'scores': [round(avg, 2) for _, avg in guild_ranking]},
+            'topPlayers': {'players': top_players}
+        })
+    except Exception as e:
+        logger.error(f"Error in get_guild_bundle: {e}\n{traceback.format_exc()}")
+        return jsonify({'status': 'error', 'message': "Internal server error"}), 500
+
 @app.errorhandler(404)
 def not_found_error(error):
     return jsonify({'status': 'error', 'message': 'Resource not found'}), 404
@@ -1711,6 +3870,7 @@ def request_mentor_help():
         return jsonify({'status': 'error', 'message': 'У вас уже есть активный запрос о помощи.'}), 409
         
     cursor.execute("INSERT INTO help_requests (player_id, guild_id) VALUES (%s, %s)", (player_id, guild_id))
+    publish_help_request_count(cursor, guild_id)
     db.commit()
     
     return jsonify({'status': 'success', 'message': 'Запрос о помощи отправлен менторам.'})
@@ -1741,9 +3901,11 @@ def mark_request_as_reviewed(request_id):
     cursor = db.cursor()
 
     cursor.execute("UPDATE help_requests SET status = 'reviewed' WHERE id = %s AND guild_id = %s", (request_id, guild_id))
+    updated = cursor.rowcount
+    publish_help_request_count(cursor, guild_id)
     db.commit()
     
-    if cursor.rowcount > 0:
+    if updated > 0:
         return jsonify({'status': 'success', 'message': 'Запрос отмечен как рассмотренный'})
     return jsonify({'status': 'error', 'message': 'Запрос не найден или у вас нет прав на его изменение'}), 404
 
@@ -1751,19 +3913,24 @@ def mark_request_as_reviewed(request_id):
 def get_mentors():
     db = get_db()
     cursor = db.cursor()
-    
-    cursor.execute("SELECT id, nickname FROM players WHERE status IN ('mentor', 'founder')")
-    mentors_raw = cursor.fetchall()
+
+    limit, after = get_page_args(NICKNAME_CURSOR)
+    after_filter = "AND nickname > %s" if after else ""
+    mentors_raw, next_cursor = fetch_page(cursor, f"""
+        SELECT id, nickname FROM players WHERE status IN ('mentor', 'founder') {after_filter}
+        ORDER BY nickname
+    """, tuple(after or ()), limit, _nickname_key)
     mentors = {m['id']: {'id': m['id'], 'nickname': m['nickname'], 'mentees': []} for m in mentors_raw}
     
-    cursor.execute("SELECT mentor_id, nickname FROM players WHERE mentor_id IS NOT NULL")
+    # Ученики только для наставников этой страницы
+    cursor.execute("SELECT mentor_id, nickname FROM players WHERE mentor_id = ANY(%s) ORDER BY nickname",
+                   (list(mentors),))
     mentees = cursor.fetchall()
     
     for mentee in mentees:
-        if mentee['mentor_id'] in mentors:
-            mentors[mentee['mentor_id']]['mentees'].append(mentee['nickname'])
+        mentors[mentee['mentor_id']]['mentees'].append(mentee['nickname'])
             
-    return jsonify({'status': 'success', 'mentors': list(mentors.values())})
+    return jsonify({'status': 'success', 'mentors': list(mentors.values()), 'next_cursor': next_cursor})
 
 # ЗАМЕНИТЬ СУЩЕСТВУЮЩУЮ ФУНКЦИЮ в app.py
 @app.route('/api/management/assign-mentor', methods=['POST'])
@@ -1783,6 +3950,7 @@ def assign_mentor_to_player():
     cursor.execute("UPDATE players SET mentor_id = %s WHERE id = %s", 
                    (mentor_id, student_id))
     db.commit()
+    invalidate_identity(student_id)
     
     if cursor.rowcount > 0:
         return jsonify({'status': 'success', 'message': 'Наставник успешно назначен.'})
@@ -1804,69 +3972,56 @@ def get_my_mentees():
 @app.route('/api/management/assignment-info', methods=['GET'])
 @privilege_required
 def get_assignment_info():
-    db = get_db()
-    cursor = db.cursor()
+    """
+    Игроки без наставника и наставники, страницами по nickname.
+    Без ?section - первые страницы обоих списков и next_cursors; ?section=unassigned|mentors&cursor=... -
+    следующая страница одного списка (ключ ответа тот же, курсор в next_cursor).
+    """
+    section = request.args.get('section')
+    if section not in (None, 'unassigned', 'mentors'):
+        return jsonify({'status': 'error', 'message': 'section must be unassigned or mentors'}), 400
+    limit, after = get_page_args(NICKNAME_CURSOR)
+    after_filter = "AND p.nickname > %s" if after else ""
+    after_params = tuple(after or ())
+    cursor = get_db().cursor()
+    response = {'status': 'success'}
     
-    # <<< ИЗМЕНЕНИЕ: Убран фильтр по guild_id
-    cursor.execute("""
-        SELECT id, nickname 
-        FROM players 
-        WHERE status = 'active' AND mentor_id IS NULL
-    """)
-    unassigned_players = [dict(p) for p in cursor.fetchall()]
+    if section in (None, 'unassigned'):
+        # <<< ИЗМЕНЕНИЕ: Убран фильтр по guild_id
+        response['unassignedPlayers'], next_unassigned = fetch_page(cursor, f"""
+            SELECT p.id, p.nickname 
+            FROM players p 
+            WHERE p.status = 'active' AND p.mentor_id IS NULL {after_filter}
+            ORDER BY p.nickname
+        """, after_params, limit, _nickname_key)
     
-    # <<< ИЗМЕНЕНИЕ: Убран фильтр по guild_id
-    cursor.execute("""
-        SELECT 
-            p.id, 
-            p.nickname, 
-            p.avatar_url,
-            p.specialization,
-            (SELECT COUNT(*) FROM players WHERE mentor_id = p.id) as student_count
-        FROM players p
-        WHERE p.status IN ('mentor', 'founder', 'наставник')
-    """)
-    mentors = [dict(m) for m in cursor.fetchall()]
+    if section in (None, 'mentors'):
+        # <<< ИЗМЕНЕНИЕ: Убран фильтр по guild_id
+        response['mentors'], next_mentors = fetch_page(cursor, f"""
+            SELECT 
+                p.id, 
+                p.nickname, 
+                p.avatar_url,
+                p.specialization,
+                (SELECT COUNT(*) FROM players WHERE mentor_id = p.id) as student_count
+            FROM players p
+            WHERE p.status IN ('mentor', 'founder', 'наставник') {after_filter}
+            ORDER BY p.nickname
+        """, after_params, limit, _nickname_key)
 
-    return jsonify({
-        'status': 'success',
-        'unassignedPlayers': unassigned_players,
-        'mentors': mentors
-    })
+    if section is None:
+        response['next_cursors'] = {'unassigned': next_unassigned, 'mentors': next_mentors}
+    else:
+        response['next_cursor'] = next_unassigned if section == 'unassigned' else next_mentors
+    return jsonify(response)
 
 @app.route('/api/statistics/global-top-players', methods=['GET'])
+@statistics_cache('alliance')
 def get_global_top_players():
     min_sessions = request.args.get('min_sessions', 0, type=int)
     limit = request.args.get('limit', 10, type=int)
-    cursor = get_db().cursor()
-    query = '''
-        SELECT p.id, p.nickname, p.avatar_url, AVG(s.score) as avg_score, COUNT(s.id) as session_count,
-               (SELECT role FROM sessions WHERE player_id = p.id GROUP BY role ORDER BY COUNT(*) DESC LIMIT 1) as main_role
-        FROM players p 
-        LEFT JOIN sessions s ON p.id = s.player_id
-        GROUP BY p.id, p.nickname, p.avatar_url
-        HAVING COUNT(s.id) >= %s
-    '''
-    cursor.execute(query, (min_sessions,))
-    players = [dict(row) for row in cursor.fetchall()]
-    
-    if players:
-        valid_scores = [p['avg_score'] for p in players if p['avg_score'] is not None]
-        valid_counts = [p['session_count'] for p in players]
-
-        max_score_val = max(valid_scores) if valid_scores else 0
-        max_count_val = max(valid_counts) if valid_counts else 0
-
-        max_score = max_score_val if max_score_val > 0 else 1
-        max_count = max_count_val if max_count_val > 0 else 1
-
-        for p in players:
-            p['rank'] = (0.7 * (p.get('avg_score') or 0) / max_score) + (0.3 * p['session_count'] / max_count)
-
-        players.sort(key=lambda p: p['rank'], reverse=True)
-
-    players_to_return = players if limit == 0 else players[:limit]
-    return jsonify({'status': 'success', 'players': players_to_return})
+    players = query_leaderboard(get_db().cursor(), None, min_sessions, limit)
+    return jsonify({'status': 'success', 'players': players})
 
 
 @app.route('/api/guilds/comparable-players', methods=['GET'])
@@ -1940,103 +4095,262 @@ def calculate_payroll():
         data = request.json
         total_budget = float(data.get('total_budget', 0))
         min_payout = float(data.get('min_payout', 2000000))
-        guild_id = g.founder_guild_id
+        results = build_payroll_results(*load_payroll_inputs(g.founder_guild_id), total_budget, min_payout)
+        return jsonify({'status': 'success', 'results': results})
+    except Exception as e:
+        logger.error(f"Error in payroll calculation: {e}\n{traceback.format_exc()}")
+        return jsonify({'status': 'error', 'message': 'Internal server error during calculation'}), 500
 
-        db = get_db()
-        cursor = db.cursor()
+# --- 1. Метрика: Качественный вклад (Avg Score * Session Count) ---
+PAYROLL_QUALITY_QUERY = """
+    SELECT 
+        p.id, 
+        p.nickname,
+        COUNT(s.id) as session_count,
+        COALESCE(AVG(s.score), 0) as avg_score,
+        (COUNT(s.id) * COALESCE(AVG(s.score), 0)) as metric_value
+    FROM players p
+    JOIN sessions s ON p.id = s.player_id
+    WHERE p.guild_id = %s AND s.session_date >= (NOW() - INTERVAL '14 days')
+    GROUP BY p.id, p.nickname
+    ORDER BY metric_value DESC
+    LIMIT 10
+"""
+
+# --- 2. Метрика: Количество сессий ---
+PAYROLL_SESSIONS_QUERY = """
+    SELECT 
+        p.id, 
+        p.nickname,
+        COUNT(s.id) as metric_value
+    FROM players p
+    JOIN sessions s ON p.id = s.player_id
+    WHERE p.guild_id = %s AND s.session_date >= (NOW() - INTERVAL '14 days')
+    GROUP BY p.id, p.nickname
+    ORDER BY metric_value DESC
+    LIMIT 10
+"""
+
+# --- 3. Метрика: Прогресс по целям ---
+PAYROLL_GOALS_QUERY = """
+    SELECT g.*, p.nickname
+    FROM goals g
+    JOIN players p ON g.player_id = p.id
+    WHERE p.guild_id = %s AND g.status = 'in_progress'
+"""
+
+def _payroll_goals_top_10(active_goals, goals_progress):
+    """ТОП-10 игроков по суммарному прогрессу активных целей (игроки без прогресса не попадают)."""
+    progress_by_player = {}
+    for goal in active_goals:
+        player_progress = progress_by_player.setdefault(goal['player_id'], {'id': goal['player_id'], 'nickname': goal['nickname'], 'metric_value': 0})
+        player_progress['metric_value'] += goals_progress[goal['id']]
+    goal_progress_data = [p for p in progress_by_player.values() if p['metric_value'] > 0]
+    
+    goal_progress_data.sort(key=lambda x: x['metric_value'], reverse=True)
+    return goal_progress_data[:10]
+
+def build_payroll_results(quality_top_10, sessions_top_10, active_goals, goals_progress, total_budget, min_payout,
+                          weights=None):
+    """Раскладывает бюджет по трем метрикам и сводит выплаты по игрокам. Без обращений к БД."""
+    weights = weights or PAYROLL_DEFAULT_WEIGHTS
+    goals_top_10 = _payroll_goals_top_10(active_goals, goals_progress)
+
+    # --- Расчет выплат для каждой метрики ---
+    quality_payouts = _calculate_payouts_for_metric(quality_top_10, total_budget * weights['quality'], min_payout)
+    goals_payouts = _calculate_payouts_for_metric(goals_top_10, total_budget * weights['goals'], min_payout)
+    sessions_payouts = _calculate_payouts_for_metric(sessions_top_10, total_budget * weights['sessions'], min_payout)
+
+    # --- Агрегация результатов ---
+    final_payouts = defaultdict(lambda: {'nickname': '', 'total_payout': 0, 'breakdown': {}})
+    
+    for p in quality_payouts:
+        final_payouts[p['player_id']]['nickname'] = p['nickname']
+        final_payouts[p['player_id']]['total_payout'] += p['payout']
+        final_payouts[p['player_id']]['breakdown']['quality'] = p['payout']
+
+    for p in goals_payouts:
+        final_payouts[p['player_id']]['nickname'] = p['nickname']
+        final_payouts[p['player_id']]['total_payout'] += p['payout']
+        final_payouts[p['player_id']]['breakdown']['goals'] = p['payout']
+
+    for p in sessions_payouts:
+        final_payouts[p['player_id']]['nickname'] = p['nickname']
+        final_payouts[p['player_id']]['total_payout'] += p['payout']
+        final_payouts[p['player_id']]['breakdown']['sessions'] = p['payout']
+
+    # Сортировка итогового списка
+    sorted_final_payouts = sorted(final_payouts.items(), key=lambda item: item[1]['total_payout'], reverse=True)
+    
+    return {
+        'quality': quality_payouts,
+        'goals': goals_payouts,
+        'sessions': sessions_payouts,
+        'summary': [{'player_id': pid, **data} for pid, data in sorted_final_payouts]
+    }
 
-        # --- 1. Метрика: Качественный вклад (Avg Score * Session Count) ---
-        cursor.execute("""
-            SELECT 
-                p.id, 
-                p.nickname,
-                COUNT(s.id) as session_count,
-                COALESCE(AVG(s.score), 0) as avg_score,
-                (COUNT(s.id) * COALESCE(AVG(s.score), 0)) as metric_value
-            FROM players p
-            JOIN sessions s ON p.id = s.player_id
-            WHERE p.guild_id = %s AND s.session_date >= (NOW() - INTERVAL '14 days')
-            GROUP BY p.id, p.nickname
-            ORDER BY metric_value DESC
-            LIMIT 10
-        """, (guild_id,))
-        quality_top_10 = cursor.fetchall()
-
-        # --- 2. Метрика: Количество сессий ---
-        cursor.execute("""
-            SELECT 
-                p.id, 
-                p.nickname,
-                COUNT(s.id) as metric_value
-            FROM players p
-            JOIN sessions s ON p.id = s.player_id
-            WHERE p.guild_id = %s AND s.session_date >= (NOW() - INTERVAL '14 days')
-            GROUP BY p.id, p.nickname
-            ORDER BY metric_value DESC
-            LIMIT 10
-        """, (guild_id,))
-        sessions_top_10 = cursor.fetchall()
-        
-        # --- 3. Метрика: Прогресс по целям ---
-        cursor.execute("SELECT id, nickname FROM players WHERE guild_id = %s", (guild_id,))
-        guild_players = cursor.fetchall()
-        
-        goal_progress_data = []
-        for player in guild_players:
-            cursor.execute("SELECT * FROM goals WHERE player_id = %s AND status = 'in_progress'", (player['id'],))
-            active_goals = cursor.fetchall()
-            if not active_goals:
-                continue
+# --- PAYROLL SIMULATION ---
+# Входные данные расчета (ТОП-10 по качеству и сессиям, активные цели и их прогресс) загружаются один раз
+# и кешируются по гильдии вместе с версией ее данных: основатель перебирает бюджеты без повторных запросов,
+# а любая запись в гильдии сбрасывает кеш. PAYROLL_INPUTS_TTL ограничивает возраст, потому что окно
+# "последние 14 дней" сдвигается и без записей. Сетка "бюджеты x минимумы x веса метрик" считается
+# одним векторизованным вызовом NumPy.
+PAYROLL_METRICS = ('quality', 'goals', 'sessions')
+PAYROLL_DEFAULT_WEIGHTS = {'quality': 0.5, 'goals': 0.3, 'sessions': 0.2}
+PAYROLL_INPUTS_TTL = float(os.environ.get('PAYROLL_INPUTS_TTL', 300))
+PAYROLL_SIM_MAX_CELLS = int(os.environ.get('PAYROLL_SIM_MAX_CELLS', 5000))  # комбинаций в одном запросе
+
+_payroll_inputs_cache = {}  # guild_id -> (version, loaded_at, inputs)
+_payroll_inputs_lock = threading.Lock()
+
+
+def load_payroll_inputs(guild_id):
+    """(quality_top_10, sessions_top_10, active_goals, goals_progress) гильдии - из кеша или из БД."""
+    version = get_data_version([f'guild:{guild_id}'])
+    with _payroll_inputs_lock:
+        cached = _payroll_inputs_cache.get(guild_id)
+    if cached and cached[0] == version and time.monotonic() - cached[1] < PAYROLL_INPUTS_TTL:
+        return cached[2]
 
-            total_progress = sum(_calculate_dynamic_progress(dict(goal)) for goal in active_goals)
-            if total_progress > 0:
-                goal_progress_data.append({'id': player['id'], 'nickname': player['nickname'], 'metric_value': total_progress})
-        
-        goal_progress_data.sort(key=lambda x: x['metric_value'], reverse=True)
-        goals_top_10 = goal_progress_data[:10]
+    cursor = get_db().cursor()
+    cursor.execute(PAYROLL_QUALITY_QUERY, (guild_id,))
+    quality_top_10 = [dict(row) for row in cursor.fetchall()]
+    cursor.execute(PAYROLL_SESSIONS_QUERY, (guild_id,))
+    sessions_top_10 = [dict(row) for row in cursor.fetchall()]
+    cursor.execute(PAYROLL_GOALS_QUERY, (guild_id,))
+    active_goals = [dict(goal) for goal in cursor.fetchall()]
+    inputs = (quality_top_10, sessions_top_10, active_goals, _calculate_goals_progress(active_goals))
 
-        # --- Расчет выплат для каждой метрики ---
-        quality_payouts = _calculate_payouts_for_metric(quality_top_10, total_budget * 0.5, min_payout)
-        goals_payouts = _calculate_payouts_for_metric(goals_top_10, total_budget * 0.3, min_payout)
-        sessions_payouts = _calculate_payouts_for_metric(sessions_top_10, total_budget * 0.2, min_payout)
+    with _payroll_inputs_lock:
+        _payroll_inputs_cache[guild_id] = (version, time.monotonic(), inputs)
+    return inputs
 
-        # --- Агрегация результатов ---
-        final_payouts = defaultdict(lambda: {'nickname': '', 'total_payout': 0, 'breakdown': {}})
-        
-        for p in quality_payouts:
-            final_payouts[p['player_id']]['nickname'] = p['nickname']
-            final_payouts[p['player_id']]['total_payout'] += p['payout']
-            final_payouts[p['player_id']]['breakdown']['quality'] = p['payout']
-
-        for p in goals_payouts:
-            final_payouts[p['player_id']]['nickname'] = p['nickname']
-            final_payouts[p['player_id']]['total_payout'] += p['payout']
-            final_payouts[p['player_id']]['breakdown']['goals'] = p['payout']
-
-        for p in sessions_payouts:
-            final_payouts[p['player_id']]['nickname'] = p['nickname']
-            final_payouts[p['player_id']]['total_payout'] += p['payout']
-            final_payouts[p['player_id']]['breakdown']['sessions'] = p['payout']
-
-        # Сортировка итогового списка
-        sorted_final_payouts = sorted(final_payouts.items(), key=lambda item: item[1]['total_payout'], reverse=True)
-        
-        return jsonify({
-            'status': 'success',
-            'results': {
-                'quality': quality_payouts,
-                'goals': goals_payouts,
-                'sessions': sessions_payouts,
-                'summary': [{'player_id': pid, **data} for pid, data in sorted_final_payouts]
-            }
-        })
+
+def _simulate_metric_payouts(values, budgets, min_payouts):
+    """
+    Векторный _calculate_payouts_for_metric: values - метрика ТОП-10 (n,), budgets и min_payouts -
+    массивы с последней осью 1, совместимые по broadcast. Возвращает округленные выплаты формы (..., n).
+    """
+    values = np.asarray(values, dtype=float)
+    shape = np.broadcast_shapes(budgets.shape, min_payouts.shape)[:-1] + values.shape
+    total = values.sum()
+    if total == 0:
+        return np.zeros(shape)
+
+    initial = budgets * (values / total)
+    below = initial < min_payouts
+    # Дефицит до минимума покрывают "лидеры" пропорционально своей метрике, но не ниже минимума
+    deficit = np.where(below, min_payouts - initial, 0).sum(axis=-1, keepdims=True)
+    leader_values = np.where(below, 0, values)
+    leader_total = leader_values.sum(axis=-1, keepdims=True)
+    reduction = np.divide(leader_values * deficit, leader_total, out=np.zeros(shape), where=leader_total > 0)
+    return np.round(np.where(below, min_payouts, np.maximum(min_payouts, initial - reduction)))
+
+
+def simulate_payroll(inputs, budgets, min_payouts, weights, breakdown=False):
+    """
+    Выплаты для всех комбинаций budgets x min_payouts x weights (веса - {'quality', 'goals', 'sessions'}: доли бюджета).
+    payouts[i][j][k][p] - итог игрока players[p], как summary[].total_payout в build_payroll_results.
+    """
+    quality_top_10, sessions_top_10, active_goals, goals_progress = inputs
+    top_10 = {'quality': quality_top_10, 'goals': _payroll_goals_top_10(active_goals, goals_progress),
+              'sessions': sessions_top_10}
+
+    players = {}
+    for metric in PAYROLL_METRICS:
+        for p in top_10[metric]:
+            players.setdefault(p['id'], p['nickname'])
+    index = {player_id: i for i, player_id in enumerate(players)}
+
+    budget_grid = np.asarray(budgets, dtype=float)[:, None, None, None]
+    min_grid = np.asarray(min_payouts, dtype=float)[None, :, None, None]
+    weight_grid = np.array([[w[metric] for metric in PAYROLL_METRICS] for w in weights], dtype=float)
+
+    totals = np.zeros((len(budgets), len(min_payouts), len(weights), len(players)))
+    by_metric = {}
+    for m, metric in enumerate(PAYROLL_METRICS):
+        rows = top_10[metric]
+        payouts = _simulate_metric_payouts([float(p['metric_value']) for p in rows],
+                                           budget_grid * weight_grid[None, None, :, m, None], min_grid)
+        totals[..., [index[p['id']] for p in rows]] += payouts
+        by_metric[metric] = {'player_ids': [p['id'] for p in rows], 'payouts': payouts.astype(np.int64).tolist()}
+
+    result = {
+        'players': [{'player_id': pid, 'nickname': nickname} for pid, nickname in players.items()],
+        'budgets': list(budgets),
+        'min_payouts': list(min_payouts),
+        'weights': weights,
+        'payouts': totals.astype(np.int64).tolist(),
+    }
+    if breakdown:
+        result['breakdown'] = by_metric
+    return result
+
+
+def _number_list(data, name, default=None):
+    """Непустой список конечных чисел из JSON (одно число тоже принимается) или ValueError."""
+    values = data.get(name, default)
+    if not isinstance(values, list):
+        values = [values]
+    numbers = [float(v) for v in values if isinstance(v, (int, float)) and not isinstance(v, bool)]
+    if not numbers or len(numbers) != len(values) or not all(np.isfinite(numbers)):
+        raise ValueError(f'{name} must be a non-empty list of numbers')
+    return numbers
+
+
+def _payroll_weights(data):
+    """Список весов метрик из JSON (по умолчанию 0.5/0.3/0.2); отсутствующая метрика - вес 0."""
+    weights = data.get('weights', [PAYROLL_DEFAULT_WEIGHTS])
+    if isinstance(weights, dict):
+        weights = [weights]
+    if not isinstance(weights, list) or not weights or not all(
+            isinstance(w, dict) and set(w) <= set(PAYROLL_METRICS) for w in weights):
+        raise ValueError('weights must be a list of {"quality", "goals", "sessions"} objects')
+    parsed = []
+    for w in weights:
+        values = [_number_list(w, metric, 0) for metric in PAYROLL_METRICS]
+        if any(len(value) != 1 or value[0] < 0 for value in values):
+            raise ValueError('weights must be non-negative numbers')
+        parsed.append({metric: value[0] for metric, value in zip(PAYROLL_METRICS, values)})
+    return parsed
+
+
+@app.route('/api/founder/payroll-simulation', methods=['POST'])
+@founder_required
+def simulate_payroll_grid():
+    """
+    Что-если по выплатам: {"budgets": [...], "min_payouts": [...], "weights": [{"quality": 0.5, "goals": 0.3,
+    "sessions": 0.2}, ...], "breakdown": false}. Данные гильдии берутся из кеша load_payroll_inputs,
+    так что ползунки интерфейса можно двигать по готовой матрице без запроса на каждое изменение.
+    """
+    if np is None:
+        return jsonify({'status': 'error', 'message': 'Payroll simulation requires NumPy (pip install -r requirements-sim.txt)'}), 501
+
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        data = {}
+    try:
+        budgets = _number_list(data, 'budgets')
+        min_payouts = _number_list(data, 'min_payouts', 2000000)
+        weights = _payroll_weights(data)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+    cells = len(budgets) * len(min_payouts) * len(weights)
+    if cells > PAYROLL_SIM_MAX_CELLS:
+        return jsonify({'status': 'error', 'message': f'Too many combinations: {cells} (max {PAYROLL_SIM_MAX_CELLS})'}), 400
+
+    try:
+        results = simulate_payroll(load_payroll_inputs(g.founder_guild_id), budgets, min_payouts, weights,
+                                   breakdown=bool(data.get('breakdown')))
+        return jsonify({'status': 'success', **results})
     except Exception as e:
-        logger.error(f"Error in payroll calculation: {e}\n{traceback.format_exc()}")
-        return jsonify({'status': 'error', 'message': 'Internal server error during calculation'}), 500
+        logger.error(f"Error in payroll simulation: {e}\n{traceback.format_exc()}")
+        return jsonify({'status': 'error', 'message': 'Internal server error during simulation'}), 500
+
 
 if __name__ == '__main__':
     os.makedirs('data', exist_ok=True)
     os.makedirs(AVATAR_UPLOAD_FOLDER, exist_ok=True)
-    with app.app_context():
-        init_db()
+    run_migrations()  # сервер разработки: схема догоняется при старте
     app.run(port=3000, debug=True)
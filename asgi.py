@@ -0,0 +1,209 @@
+"""
+Асинхронный ASGI-режим (необязательный): те же API, но независимые запросы эндпоинта
+выполняются параллельно на отдельных соединениях asyncpg.
+
+Параллельно считаются /api/system/status (счетчики), /api/statistics/full-comparison
+(тренд, роли и ошибки обоих игроков) и /api/founder/payroll-calculation (три метрики).
+Остальные маршруты обслуживает прежнее Flask-приложение через WsgiToAsgi (в пуле потоков),
+поэтому поведение и сессии не меняются.
+
+    pip install -r requirements-asgi.txt
+    uvicorn asgi:application --workers 4
+
+SQL и сборка ответов общие с app.py; параметры %s переводятся в $1..$n (to_asyncpg).
+Кэш ответов статистики (statistics_cache) в асинхронных маршрутах не используется.
+"""
+import asyncio
+import contextlib
+import logging
+import os
+import re
+import traceback
+
+import asyncpg
+from asgiref.wsgi import WsgiToAsgi
+from itsdangerous import BadSignature
+from starlette.applications import Starlette
+from starlette.responses import Response
+from starlette.routing import Mount, Route
+
+import app as albion
+
+logger = logging.getLogger(__name__)
+
+ASYNC_DB_POOL_MIN_SIZE = int(os.environ.get('ASYNC_DB_POOL_MIN_SIZE', albion.DB_POOL_MIN_SIZE))
+ASYNC_DB_POOL_MAX_SIZE = int(os.environ.get('ASYNC_DB_POOL_MAX_SIZE', albion.DB_POOL_MAX_SIZE))
+
+_PLACEHOLDER = re.compile(r'%s|%%')
+
+
+def to_asyncpg(query):
+    """Переводит позиционные параметры psycopg2 (%s) в нумерованные asyncpg ($1, $2, ...)."""
+    counter = iter(range(1, query.count('%s') + 1))
+    return _PLACEHOLDER.sub(lambda m: f'${next(counter)}' if m.group() == '%s' else '%', query)
+
+
+async def fetch(pool, query, *args):
+    """Один запрос на собственном соединении пула; строки - dict, как у RealDictCursor."""
+    async with pool.acquire() as conn:
+        return [dict(row) for row in await conn.fetch(to_asyncpg(query), *args)]
+
+
+async def fetchrow(pool, query, *args):
+    rows = await fetch(pool, query, *args)
+    return rows[0] if rows else None
+
+
+def json_response(payload, status=200):
+    return Response(albion.app.json.dumps(payload), status_code=status, media_type='application/json',
+                    headers={'Access-Control-Allow-Origin': '*'})
+
+
+def error_response(message, status):
+    return json_response({'status': 'error', 'message': message}, status)
+
+
+def session_player_id(request):
+    """player_id из подписанной cookie Flask-сессии или None."""
+    flask_app = albion.app
+    cookie = request.cookies.get(flask_app.config['SESSION_COOKIE_NAME'])
+    if not cookie:
+        return None
+    serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+    try:
+        data = serializer.loads(cookie, max_age=int(flask_app.permanent_session_lifetime.total_seconds()))
+    except BadSignature:
+        return None
+    return data.get('player_id')
+
+
+async def get_identity(request):
+    """{'id', 'status', 'guild_id'} вошедшего игрока или None; отмечает heartbeat, как before_request."""
+    player_id = session_player_id(request)
+    if player_id is None:
+        return None
+    albion.record_heartbeat(player_id)
+    return await fetchrow(request.app.state.pool,
+                          "SELECT id, status, guild_id FROM players WHERE id = %s", player_id)
+
+
+# --- ROUTES ---
+
+async def system_status(request):
+    pool = request.app.state.pool
+    keys = list(albion.SYSTEM_STATUS_QUERIES)
+    *rows, player = await asyncio.gather(
+        *(fetchrow(pool, albion.SYSTEM_STATUS_QUERIES[key]) for key in keys),
+        get_identity(request))
+    counters = {key: row['value'] for key, row in zip(keys, rows)}
+    return json_response(albion.system_status_payload(counters, player['status'] if player else 'offline'))
+
+
+async def full_compare_two_players(request):
+    def int_arg(name):
+        try:
+            return int(request.query_params.get(name, ''))
+        except ValueError:
+            return None
+
+    player1_id, player2_id = int_arg('p1'), int_arg('p2')
+    if not player1_id or not player2_id:
+        return error_response('Two player IDs are required', 400)
+
+    pool = request.app.state.pool
+    date_range = albion.get_date_range('all', args=request.query_params)
+    granularity, moving_avg = albion.get_trend_args(args=request.query_params)
+    players = (player1_id, player2_id)
+    trend_rows, *results = await asyncio.gather(
+        fetch(pool, *albion.player_trend_query(players, date_range, granularity, moving_avg)),
+        *(fetch(pool, *albion.player_role_scores_query(pid, date_range)) for pid in players),
+        *(fetch(pool, albion.PLAYER_ERROR_COUNTS_QUERY, pid) for pid in players))
+    roles, errors = results[0:2], results[2:4]
+    trends = albion.players_trend_data(trend_rows, players, granularity, moving_avg)
+
+    payload = {'status': 'success'}
+    for i, pid in enumerate(players):
+        payload[str(pid)] = {
+            'trend': trends[pid],
+            'roles': albion.player_role_scores_data(roles[i]),
+            'errors': {row['category']: row['count'] for row in errors[i]},
+        }
+    return json_response(payload)
+
+
+async def _payroll_goals(pool, guild_id):
+    """Активные цели гильдии и их прогресс: второй запрос зависит от первого, поэтому цепочкой."""
+    active_goals = await fetch(pool, albion.PAYROLL_GOALS_QUERY, guild_id)
+    progress = {goal['id']: 0 for goal in active_goals}
+    metric_goals = [goal for goal in active_goals if goal.get('metric') in ('avg_score', 'session_count')]
+    if metric_goals:
+        rows = await fetch(pool, albion.GOALS_PROGRESS_QUERY, *albion.goals_progress_params(metric_goals))
+        albion.apply_goals_progress(progress, metric_goals, rows)
+    return active_goals, progress
+
+
+async def calculate_payroll(request):
+    player = await get_identity(request)
+    if not player:
+        return error_response('Authentication required', 401)
+    if player['status'] != 'founder':
+        return error_response('Access denied: Founder rights required', 403)
+
+    try:
+        data = await request.json()
+        total_budget = float(data.get('total_budget', 0))
+        min_payout = float(data.get('min_payout', 2000000))
+        guild_id = player['guild_id']
+
+        pool = request.app.state.pool
+        quality_top_10, sessions_top_10, (active_goals, goals_progress) = await asyncio.gather(
+            fetch(pool, albion.PAYROLL_QUALITY_QUERY, guild_id),
+            fetch(pool, albion.PAYROLL_SESSIONS_QUERY, guild_id),
+            _payroll_goals(pool, guild_id))
+
+        results = albion.build_payroll_results(quality_top_10, sessions_top_10, active_goals, goals_progress,
+                                               total_budget, min_payout)
+        return json_response({'status': 'success', 'results': results})
+    except Exception as e:
+        logger.error(f"Error in payroll calculation: {e}\n{traceback.format_exc()}")
+        return error_response('Internal server error during calculation', 500)
+
+
+# --- APPLICATION ---
+
+def _ensure_schema():
+    albion.migrate_on_start()
+    with albion.app.app_context():
+        albion.ensure_schema()
+
+
+@contextlib.asynccontextmanager
+async def lifespan(application):
+    if albion.DB_BACKEND != 'postgres':
+        raise RuntimeError('ASGI mode requires DB_BACKEND=postgres')
+    await asyncio.to_thread(_ensure_schema)
+    port = os.environ.get('DB_PORT')
+    application.state.pool = await asyncpg.create_pool(
+        host=os.environ.get('DB_HOST'),
+        database=os.environ.get('DB_NAME'),
+        user=os.environ.get('DB_USER'),
+        password=os.environ.get('DB_PASSWORD'),
+        port=int(port) if port else None,
+        min_size=ASYNC_DB_POOL_MIN_SIZE,
+        max_size=ASYNC_DB_POOL_MAX_SIZE,
+    )
+    try:
+        yield
+    finally:
+        await application.state.pool.close()
+
+
+application = Starlette(
+    routes=[
+        Route('/api/system/status', system_status, methods=['GET']),
+        Route('/api/statistics/full-comparison', full_compare_two_players, methods=['GET']),
+        Route('/api/founder/payroll-calculation', calculate_payroll, methods=['POST']),
+        Mount('/', app=WsgiToAsgi(albion.app)),
+    ],
+    lifespan=lifespan,
+)
@@ -0,0 +1,88 @@
+"""
+Сравнение задержки запросов: новое соединение на каждый запрос против пула соединений.
+
+Режим "per-request" эмулирует старое поведение (DB_POOL_MAX_USES=1 и пустой пул:
+каждое соединение закрывается после одного запроса). Нужна доступная PostgreSQL (переменные DB_*).
+
+    python benchmarks/bench_db_pool.py --requests 500 --player-id 1
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as albion  # noqa: E402
+
+ENDPOINTS = [
+    '/api/statistics/player/{player_id}?period=30',
+    '/api/statistics/player-role-scores/{player_id}?period=30',
+    '/api/system/status',
+]
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run(mode, total_requests, player_id):
+    max_uses = 1 if mode == 'per-request' else albion.DB_POOL_MAX_USES
+    pool = albion.ConnectionPool(albion._connect, min_size=0 if mode == 'per-request' else albion.DB_POOL_MIN_SIZE,
+                                 max_size=albion.DB_POOL_MAX_SIZE, max_uses=max_uses)
+
+    connect_time = [0.0]
+    original_connect = pool._connect
+
+    def timed_connect():
+        started = time.perf_counter()
+        try:
+            return original_connect()
+        finally:
+            connect_time[0] += time.perf_counter() - started
+
+    pool._connect = timed_connect
+    albion._pool, albion._pool_pid = pool, os.getpid()
+
+    client = albion.app.test_client()
+    with client.session_transaction() as sess:
+        sess['player_id'] = player_id
+
+    latencies = []
+    for i in range(total_requests):
+        url = ENDPOINTS[i % len(ENDPOINTS)].format(player_id=player_id)
+        started = time.perf_counter()
+        response = client.get(url)
+        latencies.append((time.perf_counter() - started) * 1000)
+        if response.status_code != 200:
+            raise SystemExit(f"{url} -> {response.status_code}")
+
+    total_ms = sum(latencies)
+    return {
+        'mode': mode,
+        'p50_ms': round(statistics.median(latencies), 2),
+        'p95_ms': round(percentile(latencies, 95), 2),
+        'p99_ms': round(percentile(latencies, 99), 2),
+        'connect_share': round(connect_time[0] * 1000 / total_ms, 3) if total_ms else 0,
+        'pool': pool.stats(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=300)
+    parser.add_argument('--player-id', type=int, default=1)
+    args = parser.parse_args()
+
+    for mode in ('per-request', 'pooled'):
+        result = run(mode, args.requests, args.player_id)
+        print(f"{result['mode']:>12}: p50={result['p50_ms']}ms p95={result['p95_ms']}ms "
+              f"p99={result['p99_ms']}ms connect_share={result['connect_share']:.1%} "
+              f"created={result['pool']['created']} checkouts={result['pool']['checkouts']}")
+
+
+if __name__ == '__main__':
+    main()
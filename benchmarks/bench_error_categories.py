@@ -0,0 +1,74 @@
+"""
+Микробенчмарк категоризации ошибок: исходный перебор ключевых слов против
+скомпилированного матчера (categorize_error_text / categorize_error_texts).
+
+    python benchmarks/bench_error_categories.py --count 100000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as albion  # noqa: E402
+
+FRAGMENTS = [
+    'стоишь далеко от группы', 'позиция на клайме', 'плохой кайт', 'долго реагируешь', 'поздно прожимаешь',
+    'не успеваешь за таймингом', 'ротация умений', 'кд на кнопки', 'следи за кулдауном', 'молчишь в войсе',
+    'нет колла по цели', 'мало инфы', 'координация с хилами', 'слабый прожим', 'в целом хорошо', 'держи строй',
+    'фармишь медленно', 'отличная игра', 'дистанция до танка', 'не видишь карту',
+]
+
+
+def legacy_categorize(text):
+    """Исходная реализация: все категории x все ключевые слова через `in`."""
+    if not text:
+        return []
+    text_lower = text.lower()
+    found_categories = set()
+    for category, keywords in albion.ERROR_CATEGORIES.items():
+        for keyword in keywords:
+            if keyword in text_lower:
+                found_categories.add(category)
+    if not found_categories:
+        return ['Другое']
+    return list(found_categories)
+
+
+def generate_texts(count, seed=42):
+    rng = random.Random(seed)
+    texts = []
+    for _ in range(count):
+        error_types = ', '.join(rng.sample(FRAGMENTS, rng.randint(0, 3)))
+        work_on = ', '.join(rng.sample(FRAGMENTS, rng.randint(0, 2)))
+        texts.append(f"{error_types}, {work_on}".capitalize())
+    return texts
+
+
+def timed(label, func, texts):
+    started = time.perf_counter()
+    result = func(texts)
+    elapsed = time.perf_counter() - started
+    print(f"{label:>28}: {elapsed * 1000:8.1f} ms ({len(texts) / elapsed:,.0f} texts/s)")
+    return result, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--count', type=int, default=100000)
+    args = parser.parse_args()
+
+    texts = generate_texts(args.count)
+    legacy, legacy_time = timed('legacy keyword loop', lambda items: [legacy_categorize(t) for t in items], texts)
+    single, single_time = timed('compiled, per text', lambda items: [albion.categorize_error_text(t) for t in items], texts)
+    batch, batch_time = timed('compiled, batch API', albion.categorize_error_texts, texts)
+
+    mismatches = sum(1 for a, b, c in zip(legacy, single, batch) if set(a) != set(b) or set(b) != set(c))
+    print(f"mismatches: {mismatches}")
+    print(f"speedup: per text x{legacy_time / single_time:.2f}, batch x{legacy_time / batch_time:.2f}")
+
+
+if __name__ == '__main__':
+    main()
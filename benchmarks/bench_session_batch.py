@@ -0,0 +1,89 @@
+"""
+Пропускная способность записи сессий: POST /api/sessions по одной против POST /api/sessions/batch.
+
+Пишет --rows сессий каждым способом (комментарий 'bench-batch'), затем удаляет их и пересобирает
+дневной агрегат. Нужна доступная PostgreSQL (переменные DB_*) и игрок-ментор/основатель (--mentor-id).
+
+    python benchmarks/bench_session_batch.py --rows 10000 --batch-size 1000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as albion  # noqa: E402
+
+ROLES = ['D-Tank', 'E-Tank', 'Healer', 'Support', 'DPS', 'Battlemount']
+ERRORS = ['позиция на клайме', 'поздно прожимаешь', 'ротация умений', 'молчишь в войсе', 'кд на кнопки', '']
+
+
+def generate_sessions(count, player_ids, content_ids, seed=42):
+    rng = random.Random(seed)
+    return [{
+        'playerId': rng.choice(player_ids),
+        'contentId': rng.choice(content_ids),
+        'score': round(rng.uniform(1, 10), 1),
+        'role': rng.choice(ROLES),
+        'errorTypes': rng.choice(ERRORS),
+        'workOn': rng.choice(ERRORS),
+        'comments': 'bench-batch',
+    } for _ in range(count)]
+
+
+def timed(label, func, rows):
+    started = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - started
+    print(f"{label:>22}: {elapsed:8.2f} s ({rows / elapsed:,.0f} rows/s)")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--mentor-id', type=int, default=1)
+    args = parser.parse_args()
+
+    with albion.app.app_context():
+        albion.ensure_schema()
+        cursor = albion.get_db().cursor()
+        cursor.execute("SELECT id FROM players")
+        player_ids = [row['id'] for row in cursor.fetchall()]
+        cursor.execute("SELECT id FROM content")
+        content_ids = [row['id'] for row in cursor.fetchall()]
+
+    sessions = generate_sessions(args.rows, player_ids, content_ids)
+    client = albion.app.test_client()
+    with client.session_transaction() as sess:
+        sess['player_id'] = args.mentor_id
+
+    def per_row():
+        for item in sessions:
+            response = client.post('/api/sessions', json=item)
+            if response.status_code != 200:
+                raise SystemExit(f"/api/sessions -> {response.status_code}")
+
+    def batched():
+        for start in range(0, len(sessions), args.batch_size):
+            response = client.post('/api/sessions/batch', json=sessions[start:start + args.batch_size])
+            if response.status_code != 200:
+                raise SystemExit(f"/api/sessions/batch -> {response.status_code}: {response.get_json()}")
+
+    try:
+        per_row_time = timed('per-row POST', per_row, args.rows)
+        batch_time = timed(f'batch of {args.batch_size}', batched, args.rows)
+        print(f"speedup: x{per_row_time / batch_time:.1f}")
+    finally:
+        with albion.app.app_context():
+            db = albion.get_db()
+            db.cursor().execute("DELETE FROM sessions WHERE comments = 'bench-batch'")
+            db.commit()
+            albion.rebuild_session_rollup(db)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+Нагрузочный тест HTTP-развертывания: задержка p50/p99 и запросы в секунду на эндпоинтах
+с несколькими независимыми запросами. Запускается отдельно против каждого сервера:
+
+    gunicorn -w 4 -b :8000 app:app
+    uvicorn asgi:application --workers 4 --port 8001
+
+    python benchmarks/load_asgi_vs_wsgi.py --url http://localhost:8000 --player-id 1 --p2 2
+    python benchmarks/load_asgi_vs_wsgi.py --url http://localhost:8001 --player-id 1 --p2 2
+
+Для честного сравнения запустите оба сервера с STATS_CACHE_SIZE=0 (асинхронные маршруты кэш не используют).
+Cookie сессии подписывается SECRET_KEY приложения, поэтому переменные окружения должны совпадать с серверами.
+Payroll проверяется, только если --player-id - основатель (--payroll).
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as albion  # noqa: E402
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def session_cookie(player_id):
+    serializer = albion.app.session_interface.get_signing_serializer(albion.app)
+    return f"{albion.app.config['SESSION_COOKIE_NAME']}={serializer.dumps({'player_id': player_id})}"
+
+
+def make_requests(args):
+    requests = [
+        ('GET', '/api/system/status', None),
+        ('GET', f'/api/statistics/full-comparison?p1={args.player_id}&p2={args.p2}', None),
+    ]
+    if args.payroll:
+        requests.append(('POST', '/api/founder/payroll-calculation',
+                         json.dumps({'total_budget': 100000000, 'min_payout': 2000000}).encode()))
+    return requests
+
+
+def request_once(base_url, cookie, method, path, body):
+    req = urllib.request.Request(base_url + path, data=body, method=method,
+                                 headers={'Cookie': cookie, 'Content-Type': 'application/json'})
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=30) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    return (time.perf_counter() - started) * 1000, status
+
+
+def run(base_url, cookie, method, path, body, total, concurrency):
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda _: request_once(base_url, cookie, method, path, body), range(total)))
+    elapsed = time.perf_counter() - started
+
+    latencies = [latency for latency, _ in results]
+    return {
+        'endpoint': f'{method} {path.split("?")[0]}',
+        'requests': total,
+        'errors': sum(1 for _, status in results if status != 200),
+        'p50_ms': round(statistics.median(latencies), 2),
+        'p99_ms': round(percentile(latencies, 99), 2),
+        'rps': round(total / elapsed, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://localhost:8000')
+    parser.add_argument('--requests', type=int, default=1000, help='запросов на эндпоинт')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--player-id', type=int, default=1)
+    parser.add_argument('--p2', type=int, default=2, help='второй игрок для full-comparison')
+    parser.add_argument('--payroll', action='store_true', help='нагрузить payroll-calculation (нужен основатель)')
+    args = parser.parse_args()
+
+    cookie = session_cookie(args.player_id)
+    base_url = args.url.rstrip('/')
+    for method, path, body in make_requests(args):
+        request_once(base_url, cookie, method, path, body)  # прогрев соединений и пулов
+        result = run(base_url, cookie, method, path, body, args.requests, args.concurrency)
+        print(f"{result['endpoint']:>42}: p50={result['p50_ms']}ms p99={result['p99_ms']}ms "
+              f"rps={result['rps']} errors={result['errors']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,291 @@
+"""
+Нагрузочный прогон набора запросов дашборда (вызовы fetch из static/js/dashboard.js) внутри процесса
+приложения: задержка p50/p95/p99, пропускная способность и число SQL-запросов на эндпоинт.
+
+Акторы (игроки, наставники, основатели) выбираются из базы, расписание запросов детерминировано
+(--seed), поэтому прогоны на одной базе сравнимы. Результат - JSON с отсортированными ключами
+(--output), который удобно сравнивать diff-ом; --baseline печатает изменение задержек к прошлому прогону.
+Нужна база с данными (см. benchmarks/seed_data.py): PostgreSQL или SQLite при DB_BACKEND=sqlite;
+бэкенд записывается в meta.config, так что прогоны обоих бэкендов сравниваются тем же --baseline.
+
+    python benchmarks/load_dashboard_mix.py --requests 5000 --concurrency 8 --output bench-results/run.json
+    python benchmarks/load_dashboard_mix.py --no-stats-cache --baseline bench-results/run.json --output bench-results/run2.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as albion  # noqa: E402
+import sqlite_backend  # noqa: E402
+
+# (вес, роль актора, метод, путь): {pid} - актор, {gid} - его гильдия, {other} - другой игрок гильдии
+DASHBOARD_MIX = [
+    (10, 'player', 'GET', '/api/players/current'),
+    (10, 'player', 'GET', '/api/system/status'),
+    (8, 'player', 'GET', '/api/statistics/player-bundle/{pid}?period=7'),
+    (3, 'player', 'GET', '/api/statistics/player-bundle/{pid}?period=30'),
+    (6, 'player', 'GET', '/api/goals/view'),
+    (5, 'player', 'GET', '/api/players/{pid}/session-history?limit=10'),
+    (6, 'player', 'GET', '/api/system/online-members'),
+    (3, 'player', 'GET', '/api/content'),
+    (3, 'player', 'GET', '/api/guilds/{gid}'),
+    (3, 'player', 'GET', '/api/statistics/guild-bundle/{gid}?min_sessions=5&limit=10'),
+    (2, 'player', 'GET', '/api/guilds/{gid}/top-players?limit=0&scope=alliance'),
+    (2, 'player', 'GET', '/api/guilds/{gid}/role-ratings'),
+    (2, 'player', 'GET', '/api/guilds/comparable-players'),
+    (2, 'player', 'GET', '/api/statistics/full-comparison?p1={pid}&p2={other}'),
+    (3, 'mentor', 'GET', '/api/mentoring/requests/count'),
+    (2, 'mentor', 'GET', '/api/mentors/my-students'),
+    (2, 'mentor', 'GET', '/api/players?limit=200'),
+    (1, 'mentor', 'GET', '/api/mentoring/requests'),
+    (1, 'mentor', 'GET', '/api/management/assignment-info'),
+    (1, 'founder', 'GET', '/api/guilds/manageable-players'),
+    (1, 'founder', 'GET', '/api/guilds/pending-players'),
+]
+# Запись сессии наставником (--writes); такие сессии помечаются и удаляются после прогона
+WRITE_MIX = [(2, 'mentor', 'POST', '/api/sessions')]
+WRITE_COMMENT = 'bench-load'
+
+_local = threading.local()
+
+
+class CountingCursor(albion.InstrumentedCursor):
+    """Считает выполненные запросы в счетчике текущего потока."""
+
+    def execute(self, query, vars=None):
+        _local.queries = getattr(_local, 'queries', 0) + 1
+        return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        _local.queries = getattr(_local, 'queries', 0) + 1
+        return super().executemany(query, vars_list)
+
+
+class CountingSQLiteCursor(albion.InstrumentedSQLiteCursor):
+    """То же для встроенного SQLite."""
+
+    def execute(self, query, params=None):
+        _local.queries = getattr(_local, 'queries', 0) + 1
+        return super().execute(query, params)
+
+    def executemany(self, query, params_seq):
+        _local.queries = getattr(_local, 'queries', 0) + 1
+        return super().executemany(query, params_seq)
+
+
+def counting_connect():
+    if albion.DB_BACKEND == 'sqlite':
+        return sqlite_backend.connect(albion.SQLITE_PATH, busy_timeout=albion.SQLITE_BUSY_TIMEOUT,
+                                      on_notify=albion._deliver_local_event, cursor_class=CountingSQLiteCursor)
+    return psycopg2.connect(
+        host=os.environ.get('DB_HOST'),
+        database=os.environ.get('DB_NAME'),
+        user=os.environ.get('DB_USER'),
+        password=os.environ.get('DB_PASSWORD'),
+        port=os.environ.get('DB_PORT'),
+        cursor_factory=CountingCursor
+    )
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def load_actors(cursor, sample_size, rng):
+    """Случайные акторы каждой роли с гильдией и игроком той же гильдии для сравнения."""
+    roles = {
+        'player': "status = 'active'",
+        'mentor': "status IN ('mentor', 'founder', 'наставник')",
+        'founder': "status = 'founder'",
+    }
+    actors = {}
+    for role, condition in roles.items():
+        cursor.execute(f"""
+            SELECT p.id, p.guild_id,
+                   (SELECT o.id FROM players o WHERE o.guild_id = p.guild_id AND o.id != p.id LIMIT 1) as other_id
+            FROM players p WHERE {condition}
+            ORDER BY p.id
+        """)
+        rows = [dict(row) for row in cursor.fetchall()]
+        actors[role] = rng.sample(rows, min(sample_size, len(rows)))
+        if not actors[role]:
+            raise SystemExit(f"No '{role}' players in the database; seed it with benchmarks/seed_data.py")
+    cursor.execute("SELECT id FROM content ORDER BY id")
+    content_ids = [row['id'] for row in cursor.fetchall()]
+    return actors, content_ids
+
+
+def build_schedule(mix, actors, content_ids, total, rng):
+    weights = [entry[0] for entry in mix]
+    schedule = []
+    for entry in rng.choices(mix, weights=weights, k=total):
+        _, role, method, template = entry
+        actor = rng.choice(actors[role])
+        path = template.format(pid=actor['id'], gid=actor['guild_id'], other=actor['other_id'] or actor['id'])
+        body = None
+        if method == 'POST':
+            target = rng.choice(actors['player'])
+            body = {'playerId': target['id'], 'contentId': rng.choice(content_ids), 'score': round(rng.uniform(1, 10), 1),
+                    'role': 'DPS', 'errorTypes': 'поздно прожимаешь', 'workOn': 'тайминг', 'comments': WRITE_COMMENT}
+        schedule.append((f"{method} {template}", actor['id'], method, path, body))
+    return schedule
+
+
+def make_worker(tokens):
+    def run_one(item):
+        endpoint, actor_id, method, path, body = item
+        client = getattr(_local, 'client', None)
+        if client is None:
+            client = _local.client = albion.app.test_client(use_cookies=False)
+        headers = {'Cookie': f"{albion.app.config['SESSION_COOKIE_NAME']}={tokens[actor_id]}"}
+        _local.queries = 0
+        started = time.perf_counter()
+        response = client.open(path, method=method, json=body, headers=headers)
+        response.get_data()
+        elapsed = (time.perf_counter() - started) * 1000
+        return endpoint, elapsed, _local.queries, response.status_code
+    return run_one
+
+
+def summarize(latencies, queries, errors):
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'p50_ms': round(statistics.median(latencies), 2),
+        'p95_ms': round(percentile(latencies, 95), 2),
+        'p99_ms': round(percentile(latencies, 99), 2),
+        'mean_ms': round(statistics.fmean(latencies), 2),
+        'queries_per_request': round(statistics.fmean(queries), 2) if queries else 0,
+        'max_queries': max(queries) if queries else 0,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(results, baseline):
+    base = (baseline or {}).get('endpoints', {})
+    print(f"{'endpoint':<70} {'n':>6} {'p50':>8} {'p95':>8} {'p99':>8} {'q/req':>6}")
+    for endpoint, stats in sorted(results['endpoints'].items()):
+        line = (f"{endpoint:<70} {stats['requests']:>6} {stats['p50_ms']:>8} {stats['p95_ms']:>8} "
+                f"{stats['p99_ms']:>8} {stats['queries_per_request']:>6}")
+        if endpoint in base and base[endpoint]['p95_ms']:
+            line += f"  p95 {100 * (stats['p95_ms'] / base[endpoint]['p95_ms'] - 1):+.0f}%"
+        print(line + (f"  errors={stats['errors']}" if stats['errors'] else ''))
+    total = results['total']
+    print(f"total: {total['requests']} requests, {total['throughput_rps']} req/s, "
+          f"p50={total['p50_ms']}ms p95={total['p95_ms']}ms p99={total['p99_ms']}ms")
+    if baseline:
+        print(f"baseline throughput: {baseline['total']['throughput_rps']} req/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--warmup', type=int, default=200, help='запросов до начала замеров')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--actors', type=int, default=50, help='акторов каждой роли')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--writes', action='store_true', help='добавить запись сессий наставниками')
+    parser.add_argument('--no-stats-cache', action='store_true', help='отключить кэш ответов статистики')
+    parser.add_argument('--output', help='путь JSON-файла с результатами')
+    parser.add_argument('--baseline', help='JSON прошлого прогона для сравнения')
+    args = parser.parse_args()
+
+    if args.no_stats_cache:
+        albion.STATS_CACHE_SIZE = 0
+    albion._connect = counting_connect  # до создания пула: все соединения считают запросы
+
+    rng = random.Random(args.seed)
+    with albion.app.app_context():
+        albion.ensure_schema()
+        cursor = albion.get_db().cursor()
+        actors, content_ids = load_actors(cursor, args.actors, rng)
+        cursor.execute("SELECT (SELECT COUNT(*) FROM players) as players, (SELECT COUNT(*) FROM sessions) as sessions, "
+                       "(SELECT COUNT(*) FROM goals) as goals, (SELECT COUNT(*) FROM guilds) as guilds")
+        dataset = dict(cursor.fetchone())
+
+    serializer = albion.app.session_interface.get_signing_serializer(albion.app)
+    tokens = {actor['id']: serializer.dumps({'player_id': actor['id']})
+              for group in actors.values() for actor in group}
+    mix = DASHBOARD_MIX + (WRITE_MIX if args.writes else [])
+    warmup = build_schedule(mix, actors, content_ids, args.warmup, rng)
+    schedule = build_schedule(mix, actors, content_ids, args.requests, rng)
+    run_one = make_worker(tokens)
+
+    try:
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            list(executor.map(run_one, warmup))
+            started = time.perf_counter()
+            samples = list(executor.map(run_one, schedule))
+            elapsed = time.perf_counter() - started
+    finally:
+        if args.writes:
+            with albion.app.app_context():
+                db = albion.get_db()
+                db.cursor().execute("DELETE FROM sessions WHERE comments = %s", (WRITE_COMMENT,))
+                albion.bump_data_version(db)
+                db.commit()
+                albion.rebuild_session_rollup(db)
+
+    by_endpoint = {}
+    for endpoint, latency, queries, status in samples:
+        bucket = by_endpoint.setdefault(endpoint, ([], [], [0]))
+        bucket[0].append(latency)
+        bucket[1].append(queries)
+        bucket[2][0] += status >= 400
+    all_latencies = [latency for _, latency, _, _ in samples]
+    results = {
+        'meta': {
+            'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+            'git_revision': git_revision(),
+            'python': platform.python_version(),
+            'args': vars(args),
+            'dataset': dataset,
+            'config': {'DB_BACKEND': albion.DB_BACKEND, 'DB_POOL_MAX_SIZE': albion.DB_POOL_MAX_SIZE,
+                       'STATS_CACHE_SIZE': albion.STATS_CACHE_SIZE},
+        },
+        'endpoints': {endpoint: summarize(latencies, queries, errors[0])
+                      for endpoint, (latencies, queries, errors) in by_endpoint.items()},
+        'total': {
+            **summarize(all_latencies, [queries for _, _, queries, _ in samples],
+                        sum(status >= 400 for *_, status in samples)),
+            'elapsed_s': round(elapsed, 2),
+            'throughput_rps': round(len(samples) / elapsed, 1),
+        },
+    }
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_report(results, baseline)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2, sort_keys=True)
+        print(f"results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
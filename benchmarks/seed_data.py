@@ -0,0 +1,247 @@
+"""
+Генератор синтетических данных для локальной базы (PostgreSQL по переменным DB_* или SQLite при
+DB_BACKEND=sqlite): гильдии, игроки с основателями/менторами/наставниками, сессии с русскими
+комментариями ошибок, цели и запросы помощи.
+
+Все сгенерированные гильдии называются "<prefix> guild N", игроки - "<prefix>_<гильдия>_<N>",
+поэтому --reset удаляет ровно их (каскадом вместе с сессиями, целями и запросами).
+Сессии пишутся через COPY (в SQLite - executemany) пачками по --batch-size, так что миллионы строк
+укладываются в минуты.
+После вставки пересобираются категории ошибок и дневной агрегат.
+
+    python benchmarks/seed_data.py --guilds 4 --players 2000 --sessions 1000000 --goals 5000 --help-requests 300
+    python benchmarks/seed_data.py --reset
+"""
+import argparse
+import datetime
+import hashlib
+import io
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as albion  # noqa: E402
+from app import execute_values  # noqa: E402
+
+ROLES = ['D-Tank', 'E-Tank', 'Healer', 'Support', 'DPS', 'Battlemount']
+SPECIALIZATIONS = ['Танк', 'Хил', 'Саппорт', 'ДД', 'Шотколл', None]
+
+# Фрагменты комментариев наставников; большинство попадает в категории ERROR_CATEGORIES
+ERROR_FRAGMENTS = [
+    'стоишь далеко от группы', 'позиция на клайме', 'плохой кайт', 'дистанция до танка', 'стоит не там на замке',
+    'долго реагируешь', 'поздно прожимаешь', 'не успеваешь за таймингом', 'медленно ротируешься', 'вовремя не отходишь',
+    'ротация умений', 'кд на кнопки', 'следи за кулдауном', 'путаешь скиллы', 'не используешь способности',
+    'молчишь в войсе', 'нет колла по цели', 'мало инфы', 'координация с хилами', 'микрофон не включен',
+    'слабый прожим', 'не видишь карту', 'держи строй', 'фармишь медленно', 'забываешь про еду и зелья',
+]
+WORK_ON_FRAGMENTS = [
+    'позиционка в замесе', 'тайминг дефа', 'ротация на манекене', 'колл по фокусу', 'кайт от дд',
+    'реакция на стан', 'информация о противнике', 'держаться у танка', 'следить за кд', '',
+]
+COMMENTS = [
+    'Хорошая игра', 'В целом неплохо', 'Нужно больше практики', 'Отличный прогресс', 'Средне, есть над чем работать',
+    'Сильно лучше прошлой недели', '', '', '',
+]
+GOAL_TITLES = [
+    'Поднять средний балл', 'Больше сессий на клаймах', 'Отработать ротацию', 'Стабильный кайт',
+    'Колл по целям в войсе', 'Выход на Авалон',
+]
+
+
+def phrase(rng, fragments, max_parts):
+    return ', '.join(rng.sample(fragments, rng.randint(0, max_parts))).capitalize()
+
+
+def reset(db, prefix):
+    cursor = db.cursor()
+    cursor.execute("DELETE FROM guilds WHERE name LIKE %s", (f"{prefix} guild %",))
+    deleted = cursor.rowcount
+    albion.bump_data_version(db)
+    db.commit()
+    albion.rebuild_session_rollup(db)
+    print(f"deleted {deleted} generated guilds (with players, sessions, goals and help requests)")
+
+
+def seed_guilds(cursor, prefix, count):
+    rows = []
+    for i in range(1, count + 1):
+        codes = [hashlib.sha256(f"{prefix}-{i}-{kind}".encode()).hexdigest() for kind in ('code', 'founder', 'mentor', 'tutor')]
+        rows.append((f"{prefix} guild {i}", *codes))
+    return [row['id'] for row in execute_values(cursor, """
+        INSERT INTO guilds (name, code, founder_code, mentor_code, tutor_code) VALUES %s RETURNING id
+    """, rows, page_size=len(rows), fetch=True)]
+
+
+def seed_players(cursor, rng, prefix, guild_ids, count, days):
+    """Первый игрок гильдии - основатель, ~4% менторы, ~4% наставники; 60% активных закреплены за наставником."""
+    now = datetime.datetime.now()
+    players = []  # (guild_id, status)
+    for i in range(count):
+        guild_id = guild_ids[i % len(guild_ids)]
+        if i < len(guild_ids):
+            status = 'founder'
+        else:
+            status = rng.choices(['active', 'mentor', 'наставник', 'pending'], weights=[88, 4, 4, 4])[0]
+        players.append((guild_id, status))
+
+    rows = [(f"{prefix}_{guild_id}_{i}", guild_id, status, rng.randint(0, 50_000_000),
+             rng.choice(SPECIALIZATIONS) if status != 'active' else None,
+             now - datetime.timedelta(days=rng.uniform(0, days)))
+            for i, (guild_id, status) in enumerate(players)]
+    ids = []
+    for start in range(0, len(rows), 5000):
+        ids += [row['id'] for row in execute_values(cursor, """
+            INSERT INTO players (nickname, guild_id, status, balance, specialization, created_at) VALUES %s RETURNING id
+        """, rows[start:start + 5000], page_size=5000, fetch=True)]
+
+    by_guild = {}
+    for player_id, (guild_id, status) in zip(ids, players):
+        by_guild.setdefault(guild_id, {'mentors': [], 'active': []})
+        if status in ('founder', 'mentor', 'наставник'):
+            by_guild[guild_id]['mentors'].append(player_id)
+        elif status == 'active':
+            by_guild[guild_id]['active'].append(player_id)
+
+    assignments = [(rng.choice(group['mentors']), player_id)
+                   for group in by_guild.values() for player_id in group['active'] if rng.random() < 0.6]
+    if assignments:
+        execute_values(cursor, """
+            UPDATE players AS p SET mentor_id = v.mentor_id FROM (VALUES %s) AS v(mentor_id, id) WHERE p.id = v.id
+        """, assignments, page_size=5000)
+    return by_guild
+
+
+def copy_value(value):
+    """Значение в текстовом формате COPY: NULL - \\N, служебные символы экранируются."""
+    if value is None:
+        return '\\N'
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+def write_sessions(db, rows):
+    """Пачка сессий: COPY в PostgreSQL, одна транзакция executemany в SQLite."""
+    cursor = db.cursor()
+    if albion.DB_BACKEND == 'sqlite':
+        cursor.executemany("""
+            INSERT INTO sessions (player_id, content_id, score, role, error_types, work_on, comments, mentor_id, session_date)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+        """, rows)
+        return
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join(copy_value(value) for value in row) + '\n')
+    buffer.seek(0)
+    cursor.copy_expert("""
+        COPY sessions (player_id, content_id, score, role, error_types, work_on, comments, mentor_id, session_date)
+        FROM STDIN
+    """, buffer)
+
+
+def seed_sessions(db, rng, by_guild, content_ids, count, days, batch_size):
+    """Сессии пачками; у каждого игрока свой базовый уровень, к которому добавляется шум."""
+    players = [(player_id, group['mentors']) for group in by_guild.values() for player_id in group['active'] + group['mentors']]
+    skill = {player_id: rng.gauss(6.5, 1.2) for player_id, _ in players}
+    now = datetime.datetime.now()
+    written = 0
+    while written < count:
+        rows = []
+        chunk = min(batch_size, count - written)
+        for _ in range(chunk):
+            player_id, mentors = rng.choice(players)
+            score = round(min(10.0, max(1.0, rng.gauss(skill[player_id], 1.0))), 1)
+            mentor_id = rng.choice(mentors)
+            session_date = now - datetime.timedelta(seconds=rng.uniform(0, days * 86400))
+            rows.append((player_id, rng.choice(content_ids), score, rng.choice(ROLES),
+                         phrase(rng, ERROR_FRAGMENTS, 3), phrase(rng, WORK_ON_FRAGMENTS, 2), rng.choice(COMMENTS),
+                         mentor_id, session_date.isoformat(sep=' ')))
+        write_sessions(db, rows)
+        db.commit()
+        written += chunk
+        print(f"  sessions: {written:,}/{count:,}", end='\r', flush=True)
+    print()
+
+
+def seed_goals(cursor, rng, by_guild, content_ids, count, days):
+    now = datetime.datetime.now()
+    candidates = [(player_id, group['mentors']) for group in by_guild.values() for player_id in group['active']]
+    if not candidates:
+        return
+    rows = []
+    for _ in range(count):
+        player_id, mentors = rng.choice(candidates)
+        metric = rng.choice(['avg_score', 'session_count', None])
+        created_at = now - datetime.timedelta(days=rng.uniform(0, days))
+        due_date = created_at + datetime.timedelta(days=rng.randint(7, 60)) if rng.random() < 0.7 else None
+        rows.append((
+            player_id, rng.choice(mentors), rng.choice(GOAL_TITLES), phrase(rng, WORK_ON_FRAGMENTS, 2),
+            rng.choices(['in_progress', 'completed'], weights=[7, 3])[0], due_date, created_at, metric,
+            (round(rng.uniform(6.5, 9.0), 1) if metric == 'avg_score' else rng.randint(5, 40)) if metric else None,
+            rng.choice(content_ids + [None]) if metric else None, rng.choice(ROLES + [None]) if metric else None,
+        ))
+    for start in range(0, len(rows), 5000):
+        execute_values(cursor, """
+            INSERT INTO goals (player_id, created_by_id, title, description, status, due_date, created_at,
+                               metric, metric_target, metric_content_id, metric_role) VALUES %s
+        """, rows[start:start + 5000], page_size=5000)
+
+
+def seed_help_requests(cursor, rng, by_guild, count):
+    candidates = [(guild_id, player_id) for guild_id, group in by_guild.items() for player_id in group['active']]
+    rows = [(player_id, guild_id, rng.choices(['pending', 'reviewed'], weights=[1, 4])[0])
+            for guild_id, player_id in rng.sample(candidates, min(count, len(candidates)))]
+    if rows:
+        execute_values(cursor, "INSERT INTO help_requests (player_id, guild_id, status) VALUES %s", rows, page_size=5000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--guilds', type=int, default=4)
+    parser.add_argument('--players', type=int, default=1000)
+    parser.add_argument('--sessions', type=int, default=100000)
+    parser.add_argument('--goals', type=int, default=2000)
+    parser.add_argument('--help-requests', type=int, default=100)
+    parser.add_argument('--days', type=int, default=180, help='глубина истории')
+    parser.add_argument('--batch-size', type=int, default=50000, help='строк сессий в одной пачке')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--prefix', default='bench')
+    parser.add_argument('--reset', action='store_true', help='удалить ранее сгенерированные данные и выйти')
+    args = parser.parse_args()
+
+    with albion.app.app_context():
+        albion.run_migrations()
+        db = albion.get_db()
+        if args.reset:
+            reset(db, args.prefix)
+            return
+
+        rng = random.Random(args.seed)
+        started = time.perf_counter()
+        cursor = db.cursor()
+        cursor.execute("SELECT id FROM content ORDER BY id")
+        content_ids = [row['id'] for row in cursor.fetchall()]
+
+        guild_ids = seed_guilds(cursor, args.prefix, args.guilds)
+        by_guild = seed_players(cursor, rng, args.prefix, guild_ids, max(args.players, args.guilds), args.days)
+        db.commit()
+        print(f"guilds: {len(guild_ids)}, players: {max(args.players, args.guilds)}")
+
+        seed_sessions(db, rng, by_guild, content_ids, args.sessions, args.days, args.batch_size)
+        seed_goals(cursor, rng, by_guild, content_ids, args.goals, args.days)
+        seed_help_requests(cursor, rng, by_guild, args.help_requests)
+        db.commit()
+        print(f"goals: {args.goals}, help requests: {args.help_requests}")
+
+        print("rebuilding error categories and daily rollup...")
+        albion.rebuild_error_categories(db)
+        albion.rebuild_session_rollup(db)
+        albion.bump_data_version(db, guild_ids=guild_ids)
+        db.commit()
+        print(f"done in {time.perf_counter() - started:.1f} s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,19 @@
+"""
+Настройки gunicorn (файл читается автоматически при запуске из корня проекта): `gunicorn app:app`.
+
+Воркеры gthread: запрос занимает поток, а не весь процесс, поэтому открытые потоки /api/events
+(SSE_ENABLED=1) не блокируют остальные запросы воркера. Одновременных вкладок с SSE на воркер -
+не больше GUNICORN_THREADS минус запас для обычных запросов.
+
+При DB_AUTO_MIGRATE=1 миграции применяются один раз в мастер-процессе до запуска воркеров.
+"""
+import os
+
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 32))
+
+
+def on_starting(server):
+    import app
+    app.migrate_on_start()
@@ -0,0 +1,384 @@
+"""
+Встроенное хранилище SQLite (WAL) для развертывания на одном узле: DB_BACKEND=sqlite.
+
+SQLiteConnection повторяет ту часть интерфейса соединения psycopg2, которой пользуется app.py
+(курсоры со строками-словарями, commit/rollback, autocommit, closed, get_transaction_status),
+поэтому пул, миграции и маршруты работают без изменений. SQL приложения написан для PostgreSQL;
+translate() переписывает конструкции, которых нет в SQLite:
+
+    %s / %(name)s                -> ? / :name
+    = ANY(%s), unnest(%s, ...)   -> json_each(...) (списки передаются JSON-массивом)
+    ARRAY(SELECT x ...) AS name  -> json_group_array(x), колонка name читается как список
+    NOW() - INTERVAL 'N days'    -> datetime('now', 'localtime', '-N days')
+    date_trunc('week', day)      -> date(day, '-6 days', 'weekday 1') (day/week/month)
+    (d + INTERVAL '1 week')::date -> date(d, '+7 days')
+    x::date, x::float, x::type   -> date(x), CAST(x AS REAL), x
+    GREATEST/LEAST               -> MAX/MIN (скалярные)
+
+Метки времени в параметрах (datetime и ISO-строки, в т.ч. с Z/смещением) хранятся как naive местное время
+'YYYY-MM-DD HH:MM:SS[.ffffff]' и читаются как naive datetime.
+Ошибки sqlite3 поднимаются как соответствующие исключения psycopg2 (UniqueViolation и т.д.).
+NOTIFY заменяется очередью на соединении: события доставляются обработчику on_notify после commit,
+то есть только внутри этого процесса.
+"""
+import contextlib
+import datetime
+import decimal
+import fcntl
+import functools
+import json
+import re
+import sqlite3
+
+import psycopg2
+import psycopg2.errors
+import psycopg2.extensions
+
+MAX_VARIABLES = 32766  # SQLITE_MAX_VARIABLE_NUMBER по умолчанию (3.32+)
+
+_PLACEHOLDER = re.compile(r"%\((\w+)\)s|%s|%%")
+_PARAM = r"(\?|(?<!:):\w+)"
+_TIMESTAMP = re.compile(r"^\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}:\d{2}(\.\d{1,6})?(Z|[+-]\d{2}:\d{2})?$")
+_TIMESTAMP_PARAM = re.compile(r"^\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}(:\d{2}(\.\d+)?)?(Z|[+-]\d{2}(:?\d{2})?)?$")
+_TRUNCATE = {'day': "", 'week': ", '-6 days', 'weekday 1'", 'month': ", 'start of month'"}
+_STEP = {'day': '+1 days', 'week': '+7 days', 'month': '+1 months'}
+
+
+def _unnest(match):
+    """unnest(a, b, ...) AS v(x, y, ...) -> подзапрос из json_each, строки склеиваются по индексу."""
+    args = [re.sub(r"::\w+\[\]", "", arg.strip()) for arg in match.group(1).split(',')]
+    alias = match.group(2)
+    columns = [c.strip() for c in match.group(3).split(',')] if match.group(3) else [alias]
+    select = ', '.join(f"a{i}.value AS {column}" for i, column in enumerate(columns))
+    joins = ''.join(f" JOIN json_each({arg}) a{i} ON a{i}.key = a0.key" for i, arg in enumerate(args[1:], 1))
+    return f"(SELECT {select} FROM json_each({args[0]}) a0{joins}) AS {alias}"
+
+
+_RULES = [
+    (re.compile(r"unnest\(([^()]*)\)\s+AS\s+(\w+)(?:\(([^()]*)\))?"), _unnest),
+    (re.compile(r"=\s*ANY\(" + _PARAM + r"(?:::\w+\[\])?\)"), r"IN (SELECT value FROM json_each(\1))"),
+    (re.compile(r"to_regclass\('(\w+)'\) IS NOT NULL"),
+     r"EXISTS (SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = '\1')"),
+    (re.compile(r"\(NOW\(\) AT TIME ZONE 'UTC'\) - make_interval\(secs => " + _PARAM + r"\)"),
+     r"datetime('now', '-' || \1 || ' seconds')"),
+    (re.compile(r"NOW\(\) - INTERVAL '(\d+) (\w+)'"), r"datetime('now', 'localtime', '-\1 \2')"),
+    (re.compile(r"CURRENT_DATE - (\d+)"), r"date('now', 'localtime', '-\1 days')"),
+    (re.compile(r"DEFAULT CURRENT_TIMESTAMP"), "DEFAULT (datetime('now', 'localtime'))"),
+    (re.compile(r"NOW\(\)"), "datetime('now', 'localtime')"),
+    (re.compile(r"date_trunc\('(day|week|month)', ([\w.]+)\)"), lambda m: f"date({m.group(2)}{_TRUNCATE[m.group(1)]})"),
+    (re.compile(r"\(([\w.]+) \+ INTERVAL '1 (day|week|month)'\)::date"), lambda m: f"date({m.group(1)}, '{_STEP[m.group(2)]}')"),
+    # ISO-строки курсоров пагинации приводятся к формату хранения 'YYYY-MM-DD HH:MM:SS'
+    (re.compile(_PARAM + r"::timestamp\b"), r"replace(\1, 'T', ' ')"),
+    (re.compile(r"\b([\w.]+)::date\b"), r"date(\1)"),
+    (re.compile(r"\b([\w.]+)::float\b"), r"CAST(\1 AS REAL)"),
+    (re.compile(r"::\w+(\[\])?"), ""),
+    (re.compile(r"\bGREATEST\("), "MAX("),
+    (re.compile(r"\bLEAST\("), "MIN("),
+    (re.compile(r"\bLIMIT " + _PARAM), r"LIMIT COALESCE(\1, -1)"),  # LIMIT NULL == LIMIT ALL
+    (re.compile(r"\bSERIAL PRIMARY KEY\b"), "INTEGER PRIMARY KEY AUTOINCREMENT"),
+    # Postgres называет такую колонку count; SQLite - текстом выражения
+    (re.compile(r"\bSELECT COUNT\(\*\) FROM\b"), "SELECT COUNT(*) AS count FROM"),
+]
+_ARRAY = re.compile(r"ARRAY\(SELECT ([\w.]+) (FROM [^()]*)\)\s+AS\s+(\w+)", re.IGNORECASE)
+_SKIP = re.compile(r"^\s*LOCK TABLE\b", re.IGNORECASE)
+_ADD_COLUMNS = re.compile(r"^\s*ALTER TABLE (\w+)\s+(ADD COLUMN IF NOT EXISTS\b.*)$", re.DOTALL)
+
+
+@functools.lru_cache(maxsize=1024)
+def translate(query, with_params=True):
+    """
+    SQL приложения -> (SQL для SQLite, имена колонок-массивов в JSON).
+    (None, ...) - оператор не нужен (LOCK TABLE). Параметры переводятся, если переданы.
+    """
+    if _SKIP.match(query):
+        return None, frozenset()
+    if with_params:
+        query = _PLACEHOLDER.sub(lambda m: f":{m.group(1)}" if m.group(1) else '?' if m.group() == '%s' else '%', query)
+    arrays = frozenset(match.group(3) for match in _ARRAY.finditer(query))
+    query = _ARRAY.sub(r"(SELECT json_group_array(\1) \2) AS \3", query)
+    for pattern, replacement in _RULES:
+        query = pattern.sub(replacement, query)
+    return query, arrays
+
+
+def _naive_local(value):
+    """Метка времени с часовым поясом -> naive местное время, как значения DEFAULT и NOW()."""
+    return value.astimezone().replace(tzinfo=None) if value.tzinfo else value
+
+
+def _parse_timestamp(text):
+    return _naive_local(datetime.datetime.fromisoformat(text.replace('Z', '+00:00')))
+
+
+def _adapt(value):
+    """
+    Параметр -> значение SQLite. Метки времени (datetime и ISO-строки клиента вида ...T...Z) хранятся
+    единообразно как naive местное время 'YYYY-MM-DD HH:MM:SS[.ffffff]', чтобы строки сравнивались
+    и сортировались между собой и с datetime('now', 'localtime').
+    """
+    if isinstance(value, datetime.datetime):
+        return _naive_local(value).isoformat(sep=' ')
+    if isinstance(value, str) and _TIMESTAMP_PARAM.match(value):
+        try:
+            return _parse_timestamp(value).isoformat(sep=' ')
+        except ValueError:
+            return value
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    if isinstance(value, (list, tuple)):
+        return json.dumps([_adapt(item) for item in value])
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    return value
+
+
+def _adapt_params(params):
+    if params is None:
+        return ()
+    if isinstance(params, dict):
+        return {key: _adapt(value) for key, value in params.items()}
+    return [_adapt(value) for value in params]
+
+
+def _convert_timestamp(value):
+    try:
+        return _parse_timestamp(value.decode())
+    except ValueError:
+        return value.decode()
+
+
+def _convert_date(value):
+    try:
+        return datetime.date.fromisoformat(value.decode()[:10])
+    except ValueError:
+        return value.decode()
+
+
+# Колонки, объявленные TIMESTAMP/DATE, читаются как datetime/date (как в psycopg2)
+sqlite3.register_converter('TIMESTAMP', _convert_timestamp)
+sqlite3.register_converter('DATE', _convert_date)
+
+
+def _convert(value):
+    """Выражения (MAX(session_date) и т.п.) теряют тип колонки: метки времени распознаются по формату."""
+    if isinstance(value, str) and _TIMESTAMP.match(value):
+        return _parse_timestamp(value)
+    return value
+
+
+@contextlib.contextmanager
+def _psycopg2_errors():
+    """Ошибки sqlite3 -> исключения psycopg2, которые ожидает приложение."""
+    try:
+        yield
+    except sqlite3.IntegrityError as e:
+        message = str(e)
+        if message.startswith('UNIQUE'):
+            raise psycopg2.errors.UniqueViolation(message) from e
+        if message.startswith('FOREIGN KEY'):
+            raise psycopg2.errors.ForeignKeyViolation(message) from e
+        if message.startswith('NOT NULL'):
+            raise psycopg2.errors.NotNullViolation(message) from e
+        raise psycopg2.IntegrityError(message) from e
+    except sqlite3.OperationalError as e:
+        message = str(e)
+        if any(word in message for word in ('locked', 'busy', 'disk', 'unable to open')):
+            raise psycopg2.OperationalError(message) from e
+        raise psycopg2.ProgrammingError(message) from e
+    except sqlite3.Error as e:
+        raise psycopg2.DatabaseError(str(e)) from e
+
+
+class SQLiteCursor:
+    """Курсор с интерфейсом psycopg2: строки - dict (как RealDictCursor) или кортежи (dict_rows=False)."""
+
+    def __init__(self, connection, dict_rows=True):
+        self.connection = connection
+        self.itersize = 2000
+        self.rowcount = -1
+        self._cursor = connection.raw.cursor()
+        self._dict_rows = dict_rows
+        self._arrays = frozenset()
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def execute(self, query, params=None):
+        match = _ADD_COLUMNS.match(query)
+        if match:
+            self._add_columns(match.group(1), match.group(2))
+            return
+        sql, self._arrays = translate(query, params is not None)
+        if sql is None:
+            self.rowcount = -1
+            return
+        with _psycopg2_errors():
+            self._cursor.execute(sql, _adapt_params(params))
+        self.rowcount = self._cursor.rowcount
+
+    def executemany(self, query, params_seq):
+        with _psycopg2_errors():
+            self._cursor.executemany(translate(query)[0], [_adapt_params(params) for params in params_seq])
+        self.rowcount = self._cursor.rowcount
+
+    def _add_columns(self, table, clauses):
+        """ALTER TABLE ... ADD COLUMN IF NOT EXISTS a, ADD COLUMN IF NOT EXISTS b: по одной недостающей колонке."""
+        self._cursor.execute(f"PRAGMA table_info({table})")
+        existing = {row[1] for row in self._cursor.fetchall()}
+        for clause in re.split(r",?\s*ADD COLUMN IF NOT EXISTS\s+", clauses)[1:]:
+            column = clause.strip().rstrip(',')
+            if column.split()[0] not in existing:
+                with _psycopg2_errors():
+                    self._cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column}")
+        self.rowcount = -1
+
+    def _row(self, row):
+        if row is None:
+            return None
+        values = [json.loads(value) if column[0] in self._arrays else _convert(value)
+                  for column, value in zip(self._cursor.description, row)]
+        if self._dict_rows:
+            return {column[0]: value for column, value in zip(self._cursor.description, values)}
+        return tuple(values)
+
+    def fetchone(self):
+        with _psycopg2_errors():
+            return self._row(self._cursor.fetchone())
+
+    def fetchmany(self, size=None):
+        with _psycopg2_errors():
+            return [self._row(row) for row in self._cursor.fetchmany(size or self.itersize)]
+
+    def fetchall(self):
+        with _psycopg2_errors():
+            return [self._row(row) for row in self._cursor.fetchall()]
+
+    def __iter__(self):
+        while True:
+            rows = self.fetchmany(self.itersize)
+            if not rows:
+                return
+            yield from rows
+
+    def close(self):
+        self._cursor.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class SQLiteConnection:
+    """Соединение sqlite3 в режиме WAL с интерфейсом соединения psycopg2."""
+
+    def __init__(self, path, busy_timeout=5.0, on_notify=None, cursor_class=SQLiteCursor):
+        self.path = path
+        self.raw = sqlite3.connect(path, timeout=busy_timeout, detect_types=sqlite3.PARSE_DECLTYPES,
+                                   check_same_thread=False)
+        self.raw.execute("PRAGMA journal_mode = WAL")
+        self.raw.execute("PRAGMA synchronous = NORMAL")
+        self.raw.execute("PRAGMA foreign_keys = ON")
+        self.raw.execute(f"PRAGMA busy_timeout = {int(busy_timeout * 1000)}")
+        self._on_notify = on_notify
+        self._cursor_class = cursor_class
+        self._notifies = []
+        self._lock_file = None
+
+    @property
+    def closed(self):
+        return int(self.raw is None)
+
+    @property
+    def autocommit(self):
+        return self.raw.isolation_level is None
+
+    @autocommit.setter
+    def autocommit(self, value):
+        self.raw.isolation_level = None if value else ''
+
+    def get_transaction_status(self):
+        if self.raw.in_transaction:
+            return psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+        return psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def cursor(self, name=None, cursor_factory=None):
+        """name (серверный курсор) не нужен: sqlite3 и так читает строки по мере выборки."""
+        return self._cursor_class(self, dict_rows=cursor_factory is not psycopg2.extensions.cursor)
+
+    def notify(self, channel, payload):
+        """Аналог pg_notify: событие уходит обработчику после commit и пропадает при rollback."""
+        self._notifies.append((channel, payload))
+        if self.autocommit:
+            self._deliver()
+
+    def _deliver(self):
+        notifies, self._notifies = self._notifies, []
+        if self._on_notify:
+            for channel, payload in notifies:
+                self._on_notify(channel, payload)
+
+    def commit(self):
+        with _psycopg2_errors():
+            self.raw.commit()
+        self._deliver()
+
+    def rollback(self):
+        self._notifies = []
+        with _psycopg2_errors():
+            self.raw.rollback()
+
+    def advisory_lock(self, key):
+        """Аналог pg_advisory_lock между процессами: flock файла рядом с базой."""
+        self._lock_file = open(f"{self.path}-{key}.lock", 'a')
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+
+    def advisory_unlock(self, key):
+        if self._lock_file is not None:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+            self._lock_file.close()
+            self._lock_file = None
+
+    def close(self):
+        if self.raw is not None:
+            self.raw.close()
+            self.raw = None
+
+
+def connect(path, busy_timeout=5.0, on_notify=None, cursor_class=SQLiteCursor):
+    return SQLiteConnection(path, busy_timeout=busy_timeout, on_notify=on_notify, cursor_class=cursor_class)
+
+
+_VALUES_ALIAS = re.compile(r"\(VALUES %s\)\s+AS\s+(\w+)\s*\(([^()]*)\)")
+
+
+def execute_values(cursor, query, argslist, template=None, page_size=100, fetch=False):
+    """
+    Аналог psycopg2.extras.execute_values: VALUES %s раскрывается в multi-row VALUES с параметрами.
+    Страница ограничена еще и числом параметров SQLite. (VALUES %s) AS v(a, b) переписывается
+    в подзапрос с именованными колонками, которого SQLite не поддерживает в виде списка алиасов.
+    """
+    argslist = list(argslist)
+    if not argslist:
+        return [] if fetch else None
+    query = _VALUES_ALIAS.sub(
+        lambda m: "(SELECT {} FROM (VALUES %s)) AS {}".format(
+            ', '.join(f"column{i} AS {c.strip()}" for i, c in enumerate(m.group(2).split(','), 1)), m.group(1)),
+        query)
+    if template is None:
+        template = '(' + ', '.join(['%s'] * len(argslist[0])) + ')'
+    page_size = max(1, min(page_size, MAX_VARIABLES // max(template.count('%s'), 1)))
+
+    result = []
+    for start in range(0, len(argslist), page_size):
+        page = argslist[start:start + page_size]
+        values = ', '.join([template] * len(page))
+        placeholders = iter(['values'])
+        # Раскрывается только первый %s (место VALUES); %% и прочие токены остаются как есть
+        sql = _PLACEHOLDER.sub(lambda m: values if m.group() == '%s' and next(placeholders, None) else m.group(), query)
+        cursor.execute(sql, [value for row in page for value in row])
+        if fetch:
+            result.extend(cursor.fetchall())
+    return result if fetch else None
@@ -24,6 +24,8 @@ let goalMetrics = {};
 let currentDatePeriod = '7';
 let cropper = null;
 let currentGoalsData = null; // Хранилище для данных о целях
+let onlineMembers = new Map(); // player_id -> карточка онлайн-игрока, обновляется событиями SSE
+let eventSource = null;
 
 // Утилита для управления скелетной загрузкой
 const skeletonHandler = {
@@ -243,22 +245,56 @@ function initDashboard() {
     loadSystemStatus();
     loadOnlineMembers();
     loadMentorRequestCount();
-    setInterval(loadOnlineMembers, 15000);
-    setInterval(loadMentorRequestCount, 30000);
+    subscribeToEvents();
     checkAndShowMyStudentsTab();
 }
+function subscribeToEvents() {
+    // SSE включается на сервере (SSE_ENABLED=1); без него или без поддержки EventSource - периодический опрос
+    if (document.body.dataset.sseEnabled !== 'true' || !window.EventSource) {
+        setInterval(loadOnlineMembers, 15000);
+        setInterval(loadMentorRequestCount, 30000);
+        return;
+    }
+    if (eventSource) eventSource.close();
+    eventSource = new EventSource('/api/events');
+    let reconnecting = false;
+    eventSource.addEventListener('open', () => {
+        // После переподключения события за время разрыва потеряны - берем актуальное состояние
+        if (reconnecting) {
+            loadOnlineMembers();
+            loadMentorRequestCount();
+        }
+    });
+    eventSource.addEventListener('error', () => { reconnecting = true; });
+    eventSource.addEventListener('presence', (e) => {
+        const diff = JSON.parse(e.data);
+        diff.left.forEach(playerId => onlineMembers.delete(playerId));
+        diff.joined.forEach(member => onlineMembers.set(member.player_id, member));
+        renderOnlineMembers();
+    });
+    eventSource.addEventListener('help_requests', (e) => {
+        if (['mentor', 'founder'].includes(currentPlayerData?.status)) {
+            setMentorRequestBadge(JSON.parse(e.data).count);
+        }
+    });
+}
+function setMentorRequestBadge(count) {
+    const badge = document.querySelector('.mentor-view-btn .notification-badge');
+    if (!badge) return;
+    if (count > 0) {
+        badge.textContent = count;
+        badge.style.display = 'flex';
+    } else {
+        badge.style.display = 'none';
+    }
+}
 function loadMentorRequestCount() {
     const badge = document.querySelector('.mentor-view-btn .notification-badge');
     if (!badge || !['mentor', 'founder'].includes(currentPlayerData?.status)) return;
     fetch('/api/mentoring/requests/count')
         .then(response => response.ok ? response.json() : Promise.reject(response))
         .then(data => {
-            if (data.status === 'success' && data.count > 0) {
-                badge.textContent = data.count;
-                badge.style.display = 'flex';
-            } else {
-                badge.style.display = 'none';
-            }
+            setMentorRequestBadge(data.status === 'success' ? data.count : 0);
         })
         .catch(error => {
             console.error('Ошибка загрузки количества запросов:', error);
@@ -345,40 +381,11 @@ function loadOnlineMembers() {
     fetch('/api/system/online-members')
         .then(response => response.json())
         .then(data => {
-            const onlineMembersList = document.querySelector('.online-members-list');
-            onlineMembersList.innerHTML = '';
-            const totalOnlineCountSpan = document.querySelector('.total-online-count');
-            const onlineIndicator = document.querySelector('.online-members-section .online-indicator');
-            if (data.status === 'success' && data.online_members.length > 0) {
-                totalOnlineCountSpan.textContent = `Всего онлайн: ${data.online_members.length}`;
-                onlineIndicator.classList.add('active');
-                data.online_members.forEach(member => {
-                    const memberCard = document.createElement('div');
-                    memberCard.classList.add('online-member-card');
-                    memberCard.setAttribute('data-player-id', member.player_id);
-                    const durationFormatted = formatDuration(member.duration_seconds);
-                    const avatarContent = member.avatar_url 
-                        ? `<img src="${member.avatar_url}?t=${new Date().getTime()}" alt="${member.player_name}">`
-                        : `<div class="sidebar-avatar-fallback" style="width: 48px; height: 48px; font-size: 24px;">${member.player_name.charAt(0).toUpperCase()}</div>`;
-                    memberCard.innerHTML = `
-                        ${avatarContent}
-                        <div class="online-member-info">
-                            <h3>${member.player_name}</h3>
-                            <p>Гильдия: ${member.guild_name}</p>
-                            <p>Статус: ${formatPlayerStatus(member.status)}</p>
-                        </div>
-                        <div class="online-member-duration">
-                           <i class="material-icons">schedule</i>
-                           <span>${durationFormatted}</span>
-                        </div>
-                    `;
-                    onlineMembersList.appendChild(memberCard);
-                });
-            } else {
-                totalOnlineCountSpan.textContent = 'Всего онлайн: 0';
-                onlineIndicator.classList.remove('active');
-                onlineMembersList.innerHTML = '<p style="text-align: center; color: var(--text-muted); grid-column: 1 / -1;">В данный момент никто не в игре.</p>';
+            onlineMembers = new Map();
+            if (data.status === 'success') {
+                data.online_members.forEach(member => onlineMembers.set(member.player_id, member));
             }
+            renderOnlineMembers();
         })
         .catch(error => {
             console.error('Ошибка загрузки онлайн-участников:', error);
@@ -386,6 +393,43 @@ function loadOnlineMembers() {
             onlineMembersList.innerHTML = '<p style="text-align: center; color: var(--danger); grid-column: 1 / -1;">Ошибка при загрузке данных.</p>';
         });
 }
+function renderOnlineMembers() {
+    const onlineMembersList = document.querySelector('.online-members-list');
+    onlineMembersList.innerHTML = '';
+    const totalOnlineCountSpan = document.querySelector('.total-online-count');
+    const onlineIndicator = document.querySelector('.online-members-section .online-indicator');
+    const members = [...onlineMembers.values()].sort((a, b) => b.duration_seconds - a.duration_seconds);
+    if (members.length > 0) {
+        totalOnlineCountSpan.textContent = `Всего онлайн: ${members.length}`;
+        onlineIndicator.classList.add('active');
+        members.forEach(member => {
+            const memberCard = document.createElement('div');
+            memberCard.classList.add('online-member-card');
+            memberCard.setAttribute('data-player-id', member.player_id);
+            const durationFormatted = formatDuration(member.duration_seconds);
+            const avatarContent = member.avatar_url 
+                ? `<img src="${member.avatar_url}?t=${new Date().getTime()}" alt="${member.player_name}">`
+                : `<div class="sidebar-avatar-fallback" style="width: 48px; height: 48px; font-size: 24px;">${member.player_name.charAt(0).toUpperCase()}</div>`;
+            memberCard.innerHTML = `
+                ${avatarContent}
+                <div class="online-member-info">
+                    <h3>${member.player_name}</h3>
+                    <p>Гильдия: ${member.guild_name}</p>
+                    <p>Статус: ${formatPlayerStatus(member.status)}</p>
+                </div>
+                <div class="online-member-duration">
+                   <i class="material-icons">schedule</i>
+                   <span>${durationFormatted}</span>
+                </div>
+            `;
+            onlineMembersList.appendChild(memberCard);
+        });
+    } else {
+        totalOnlineCountSpan.textContent = 'Всего онлайн: 0';
+        onlineIndicator.classList.remove('active');
+        onlineMembersList.innerHTML = '<p style="text-align: center; color: var(--text-muted); grid-column: 1 / -1;">В данный момент никто не в игре.</p>';
+    }
+}
 function formatDuration(seconds) {
     const hours = Math.floor(seconds / 3600);
     const minutes = Math.floor((seconds % 3600) / 60);
@@ -410,25 +454,12 @@ async function loadPlayerDataAndCharts() {
     skeletonHandler.show(['avg-score', 'session-count', 'comparison', 'last-update-player', 'goals']);
     loadMyRecentSessions();
     try {
-        const endpoints = [
-            `/api/statistics/player/${currentPlayerId}?period=${currentDatePeriod}`,
-            `/api/statistics/comparison/${currentPlayerId}?period=${currentDatePeriod}`,
-            `/api/statistics/player-trend/${currentPlayerId}?period=${currentDatePeriod}`,
-            `/api/statistics/player-role-scores/${currentPlayerId}?period=${currentDatePeriod}`,
-            `/api/statistics/player-content-scores/${currentPlayerId}?period=${currentDatePeriod}`,
-            `/api/statistics/player-error-types/${currentPlayerId}?period=${currentDatePeriod}`,
-            `/api/statistics/error-distribution/${currentPlayerId}?period=${currentDatePeriod}`,
-            `/api/statistics/error-score-correlation/${currentPlayerId}?period=${currentDatePeriod}`
-        ];
-        const responses = await Promise.all(endpoints.map(url => fetch(url)));
-        for (const res of responses) {
-            if (!res.ok) {
-                throw new Error(`Ошибка сети: ${res.status} ${res.statusText} для ${res.url}`);
-            }
+        // Все восемь виджетов приходят одним ответом, сессии игрока читаются на сервере один раз
+        const res = await fetch(`/api/statistics/player-bundle/${currentPlayerId}?period=${currentDatePeriod}`);
+        if (!res.ok) {
+            throw new Error(`Ошибка сети: ${res.status} ${res.statusText} для ${res.url}`);
         }
-        const [stats, comparison, trend, roleScores, contentScores, errorTypes, errorDistribution, errorScore] = await Promise.all(
-            responses.map(res => res.json())
-        );
+        const { stats, comparison, trend, roleScores, contentScores, errorTypes, errorDistribution, errorScore } = await res.json();
         skeletonHandler.hide('avg-score', (stats.avgScore || 0).toFixed(2));
         skeletonHandler.hide('session-count', stats.sessionCount || 0);
         skeletonHandler.hide('last-update-player', stats.lastUpdate ? new Date(stats.lastUpdate).toLocaleDateString() : '-');
@@ -487,7 +518,7 @@ function showEmptyState(canvasId, message, icon) {
 }
 function createTrendChart(trendData) {
     const canvasId = 'score-trend-chart';
-    if (!trendData || !trendData.weeks || trendData.weeks.length === 0) {
+    if (!trendData || !trendData.labels || trendData.labels.length === 0) {
         showEmptyState(canvasId, 'Недостаточно данных для построения тренда.', 'trending_up');
         return;
     }
@@ -495,13 +526,14 @@ function createTrendChart(trendData) {
     charts[canvasId] = new Chart(ctx, {
         type: 'line',
         data: {
-            labels: trendData.weeks,
+            labels: trendData.labels,
             datasets: [{
                 label: 'Средний балл',
                 data: trendData.scores,
                 borderColor: chartColors.primary,
                 backgroundColor: chartColors.transparentPrimary,
                 tension: 0.4,
+                spanGaps: true,
                 fill: true
             }]
         },
@@ -1173,31 +1205,34 @@ function showRecentSessionsModal(playerId, playerName) {
     const modal = document.getElementById('sessions-modal');
     const title = document.getElementById('sessions-modal-title');
     const body = document.getElementById('sessions-modal-body');
-    title.textContent = `Последние сессии: ${playerName}`;
+    title.textContent = `История сессий: ${playerName}`;
     body.innerHTML = '<p>Загрузка...</p>';
     modal.style.display = 'flex';
-    fetch(`/api/players/${playerId}/sessions`)
-        .then(response => response.ok ? response.json() : Promise.reject(response))
+    const url = `/api/players/${playerId}/session-history?limit=20`;
+    const renderRows = sessions => sessions.map(s => `
+        <tr>
+            <td data-label="Дата">${new Date(s.session_date).toLocaleString()}</td>
+            <td data-label="Контент">${s.content_name}</td>
+            <td data-label="Роль">${s.role}</td>
+            <td data-label="Балл">${s.score}</td>
+            <td data-label="Ошибки">${s.error_types || '-'}</td>
+        </tr>
+    `).join('');
+    fetchPage(url)
         .then(data => {
-            if (data.status === 'success' && data.sessions.length > 0) {
+            if (data.sessions.length > 0) {
                 body.innerHTML = `
                     <table class="players-table">
                         <thead>
                             <tr><th>Дата</th><th>Контент</th><th>Роль</th><th>Балл</th><th>Ошибки</th></tr>
                         </thead>
-                        <tbody>
-                            ${data.sessions.map(s => `
-                                <tr>
-                                    <td data-label="Дата">${new Date(s.session_date).toLocaleString()}</td>
-                                    <td data-label="Контент">${s.content_name}</td>
-                                    <td data-label="Роль">${s.role}</td>
-                                    <td data-label="Балл">${s.score}</td>
-                                    <td data-label="Ошибки">${s.error_types || '-'}</td>
-                                </tr>
-                            `).join('')}
-                        </tbody>
+                        <tbody>${renderRows(data.sessions)}</tbody>
                     </table>
                 `;
+                const sentinel = createPageSentinel();
+                body.appendChild(sentinel);
+                lazyLoadPages(sentinel, url, 'sessions', data.next_cursor,
+                    sessions => body.querySelector('tbody').insertAdjacentHTML('beforeend', renderRows(sessions)));
             } else {
                  body.innerHTML = '<p class="placeholder" style="position: static; height: auto;">Нет данных о сессиях.</p>';
             }
@@ -1326,13 +1361,15 @@ function initAvatarCropper() {
 function loadMyRecentSessions() {
     const container = document.getElementById('recent-sessions-list');
     if (!container) return;
-    fetch('/api/players/current/recent-sessions')
-        .then(response => response.ok ? response.json() : Promise.reject('Failed to load'))
+    const url = `/api/players/${currentPlayerId}/session-history?limit=10`;
+    fetchPage(url)
         .then(data => {
-            if (data.status === 'success') {
-                renderRecentSessions(container, data.sessions);
-            } else {
-                container.innerHTML = '<p class="error-message">Не удалось загрузить сессии.</p>';
+            renderRecentSessions(container, data.sessions);
+            if (data.sessions.length > 0) {
+                const sentinel = createPageSentinel();
+                container.appendChild(sentinel);
+                lazyLoadPages(sentinel, url, 'sessions', data.next_cursor,
+                    sessions => appendRecentSessionRows(container, sessions));
             }
         })
         .catch(() => {
@@ -1354,25 +1391,27 @@ function renderRecentSessions(container, sessions) {
                     <th>Оценка</th>
                 </tr>
             </thead>
-            <tbody>
-                ${sessions.map(s => `
-                    <tr>
-                        <td data-label="Дата">${new Date(s.session_date).toLocaleDateString()}</td>
-                        <td data-label="Контент">${s.content_name}</td>
-                        <td data-label="Роль">${s.role}</td>
-                        <td data-label="Оценка">${s.score.toFixed(1)}</td>
-                    </tr>
-                `).join('')}
-            </tbody>
+            <tbody></tbody>
         </table>
     `;
+    appendRecentSessionRows(container, sessions);
+}
+function appendRecentSessionRows(container, sessions) {
+    container.querySelector('tbody').insertAdjacentHTML('beforeend', sessions.map(s => `
+        <tr>
+            <td data-label="Дата">${new Date(s.session_date).toLocaleDateString()}</td>
+            <td data-label="Контент">${s.content_name}</td>
+            <td data-label="Роль">${s.role}</td>
+            <td data-label="Оценка">${s.score.toFixed(1)}</td>
+        </tr>
+    `).join(''));
 }
 async function loadGuildData() {
     if (!currentGuildId) return;
     try {
         const [guildInfoRes, allPlayersRes, roleRatingsRes] = await Promise.all([
             fetch(`/api/guilds/${currentGuildId}`),
-            fetch(`/api/guilds/${currentGuildId}/top-players?limit=0`),
+            fetch(`/api/guilds/${currentGuildId}/top-players?limit=0&scope=alliance`),
             fetch(`/api/guilds/${currentGuildId}/role-ratings`)
         ]);
         const guildInfo = await guildInfoRes.json();
@@ -1498,13 +1537,15 @@ function loadManageablePlayers() {
     const container = document.getElementById('manage-players-list');
     if (!container) return;
     container.innerHTML = '<p>Загрузка состава...</p>';
-    fetch('/api/guilds/manageable-players')
-        .then(response => response.ok ? response.json() : Promise.reject(response))
+    const url = '/api/guilds/manageable-players';
+    fetchPage(url)
         .then(data => {
-            if (data.status === 'success') {
-                renderManageablePlayers(data.players);
-            } else {
-                throw new Error(data.message || 'Не удалось загрузить состав гильдии');
+            renderManageablePlayers(data.players);
+            if (data.players.length > 0) {
+                const sentinel = createPageSentinel();
+                container.appendChild(sentinel);
+                lazyLoadPages(sentinel, url, 'players', data.next_cursor,
+                    players => renderManageablePlayers(players, true));
             }
         })
         .catch(() => {
@@ -1512,9 +1553,13 @@ function loadManageablePlayers() {
         });
 }
 
-function renderManageablePlayers(players) {
+function renderManageablePlayers(players, append = false) {
     const container = document.getElementById('manage-players-list');
     if (!container) return;
+    if (append) {
+        appendManageablePlayerRows(container.querySelector('tbody'), players);
+        return;
+    }
 
     const tableBody = container.querySelector('tbody');
     if (!tableBody) { // Если таблицы нет, возможно, был пустой ответ, создадим её
@@ -1559,11 +1604,16 @@ function renderManageablePlayers(players) {
     }
 
 
-    const isFounder = currentPlayerData.status === 'founder';
-    
     const finalTableBody = container.querySelector('tbody');
-    
-    finalTableBody.innerHTML = players.map(player => `
+    finalTableBody.innerHTML = '';
+    appendManageablePlayerRows(finalTableBody, players);
+}
+
+function appendManageablePlayerRows(tableBody, players) {
+    const isFounder = currentPlayerData.status === 'founder';
+    // Строки собираются отдельно, чтобы обработчики вешались только на новую страницу
+    const pageBody = document.createElement('tbody');
+    pageBody.innerHTML = players.map(player => `
         <tr>
             <td data-label="Игрок">${player.nickname}</td>
             <td data-label="Статус">${formatPlayerStatus(player.status)}</td>
@@ -1580,7 +1630,7 @@ function renderManageablePlayers(players) {
     `).join('');
 
     if (isFounder) {
-        finalTableBody.querySelectorAll('.promote-btn').forEach(btn => {
+        pageBody.querySelectorAll('.promote-btn').forEach(btn => {
             btn.addEventListener('click', (e) => {
                 const { id, name } = e.target.dataset;
                 if (confirm(`Вы уверены, что хотите повысить игрока "${name}" до Наставника?`)) {
@@ -1588,13 +1638,14 @@ function renderManageablePlayers(players) {
                 }
             });
         });
-        finalTableBody.querySelectorAll('.delete-btn').forEach(btn => {
+        pageBody.querySelectorAll('.delete-btn').forEach(btn => {
             btn.addEventListener('click', (e) => {
                 const { id, name } = e.target.dataset;
                 deletePlayer(id, name);
             });
         });
     }
+    tableBody.append(...pageBody.children);
 }
 
 function promotePlayer(playerId) {
@@ -1637,59 +1688,32 @@ function loadAndShowAssignmentModal() {
     const mentorList = document.getElementById('assign-mentor-list');
     studentSelect.innerHTML = '<option>Загрузка игроков...</option>';
     mentorList.innerHTML = '<p>Загрузка наставников...</p>';
-    fetch('/api/management/assignment-info')
-        .then(res => res.ok ? res.json() : Promise.reject(res))
-        .then(data => {
-            if (data.status === 'success') {
-                studentSelect.innerHTML = '<option value="" disabled selected>Выберите ученика из списка</option>';
-                if (data.unassignedPlayers.length > 0) {
-                    data.unassignedPlayers.forEach(p => {
-                        const option = document.createElement('option');
-                        option.value = p.id;
-                        option.textContent = p.nickname;
-                        studentSelect.appendChild(option);
-                    });
-                } else {
-                    studentSelect.innerHTML = '<option value="" disabled>Нет игроков без наставника</option>';
-                }
-                mentorList.innerHTML = '';
-                if (data.mentors.length > 0) {
-                    data.mentors.forEach(m => {
-                        const card = document.createElement('div');
-                        card.className = 'online-member-card mentor-assign-card';
-                        card.dataset.mentorId = m.id;
-                        const avatar = m.avatar_url 
-                            ? `<img src="${m.avatar_url}?t=${new Date().getTime()}" alt="${m.nickname}">`
-                            : `<div class="sidebar-avatar-fallback" style="width: 64px; height: 64px; font-size: 32px; flex-shrink: 0;">${m.nickname.charAt(0).toUpperCase()}</div>`;
-                        card.innerHTML = `
-                            ${avatar}
-                            <div class="online-member-info" style="text-align: left;">
-                                <h3>${m.nickname}</h3>
-                                <div class="mentor-card-details" style="justify-content: flex-start; margin-top: 8px;">
-                                    <span class="mentor-card-spec">
-                                        <i class="material-icons">star</i>
-                                        ${m.specialization || 'Не указана'}
-                                    </span>
-                                    <span class="mentor-card-students">
-                                        <i class="material-icons">school</i>
-                                        ${m.student_count} учеников
-                                    </span>
-                                </div>
-                            </div>
-                        `;
-                        mentorList.appendChild(card);
-                    });
-                    mentorList.querySelectorAll('.mentor-assign-card').forEach(card => {
-                        card.addEventListener('click', () => {
-                            mentorList.querySelector('.selected')?.classList.remove('selected');
-                            card.classList.add('selected');
-                        });
-                    });
-                } else {
-                    mentorList.innerHTML = '<p class="placeholder" style="grid-column: 1 / -1;">В гильдии нет доступных наставников.</p>';
-                }
+    fetchPage('/api/management/assignment-info')
+        .then(async data => {
+            // Игроки для <select> дочитываются целиком, наставники подгружаются при прокрутке
+            const unassignedPlayers = data.unassignedPlayers.concat(await fetchAllPages(
+                '/api/management/assignment-info?section=unassigned', 'unassignedPlayers', data.next_cursors.unassigned));
+            studentSelect.innerHTML = '<option value="" disabled selected>Выберите ученика из списка</option>';
+            if (unassignedPlayers.length > 0) {
+                unassignedPlayers.forEach(p => {
+                    const option = document.createElement('option');
+                    option.value = p.id;
+                    option.textContent = p.nickname;
+                    studentSelect.appendChild(option);
+                });
             } else {
-                throw new Error(data.message);
+                studentSelect.innerHTML = '<option value="" disabled>Нет игроков без наставника</option>';
+            }
+            mentorList.innerHTML = '';
+            if (data.mentors.length > 0) {
+                appendMentorAssignCards(mentorList, data.mentors);
+                const sentinel = createPageSentinel();
+                sentinel.style.gridColumn = '1 / -1';
+                mentorList.appendChild(sentinel);
+                lazyLoadPages(sentinel, '/api/management/assignment-info?section=mentors', 'mentors',
+                    data.next_cursors.mentors, mentors => appendMentorAssignCards(mentorList, mentors));
+            } else {
+                mentorList.innerHTML = '<p class="placeholder" style="grid-column: 1 / -1;">В гильдии нет доступных наставников.</p>';
             }
         })
         .catch(err => {
@@ -1698,6 +1722,38 @@ function loadAndShowAssignmentModal() {
         });
     document.getElementById('confirm-assignment-btn').onclick = assignMentor;
 }
+function appendMentorAssignCards(mentorList, mentors) {
+    const sentinel = mentorList.querySelector('.page-sentinel');
+    mentors.forEach(m => {
+        const card = document.createElement('div');
+        card.className = 'online-member-card mentor-assign-card';
+        card.dataset.mentorId = m.id;
+        const avatar = m.avatar_url 
+            ? `<img src="${m.avatar_url}?t=${new Date().getTime()}" alt="${m.nickname}">`
+            : `<div class="sidebar-avatar-fallback" style="width: 64px; height: 64px; font-size: 32px; flex-shrink: 0;">${m.nickname.charAt(0).toUpperCase()}</div>`;
+        card.innerHTML = `
+            ${avatar}
+            <div class="online-member-info" style="text-align: left;">
+                <h3>${m.nickname}</h3>
+                <div class="mentor-card-details" style="justify-content: flex-start; margin-top: 8px;">
+                    <span class="mentor-card-spec">
+                        <i class="material-icons">star</i>
+                        ${m.specialization || 'Не указана'}
+                    </span>
+                    <span class="mentor-card-students">
+                        <i class="material-icons">school</i>
+                        ${m.student_count} учеников
+                    </span>
+                </div>
+            </div>
+        `;
+        card.addEventListener('click', () => {
+            mentorList.querySelector('.selected')?.classList.remove('selected');
+            card.classList.add('selected');
+        });
+        mentorList.insertBefore(card, sentinel);
+    });
+}
 function assignMentor() {
     const studentId = document.getElementById('assign-student-select').value;
     const selectedMentorCard = document.querySelector('#assign-mentor-list .mentor-assign-card.selected');
@@ -1764,25 +1820,12 @@ async function loadGeneralData() {
     }
     skeletonHandler.show(['guild-avg-score', 'active-players', 'total-sessions']);
     try {
-        const endpoints = [
-            `/api/statistics/guild/${currentGuildId}`,
-            `/api/statistics/total-sessions?guild_id=${currentGuildId}`,
-            `/api/statistics/best-player-week`,
-            '/api/statistics/guild-role-distribution',
-            '/api/statistics/guild-error-types',
-            '/api/statistics/top-errors',
-            '/api/statistics/guild-ranking',
-            '/api/statistics/global-top-players?min_sessions=5&limit=10'
-        ];
-        const responses = await Promise.all(endpoints.map(url => fetch(url)));
-        for (const res of responses) {
-            if (!res.ok) {
-                throw new Error(`Ошибка сети: ${res.status} ${res.statusText} для ${res.url}`);
-            }
+        // Виджеты вкладки приходят одним ответом и считаются на сервере из общих агрегатов
+        const res = await fetch(`/api/statistics/guild-bundle/${currentGuildId}?min_sessions=5&limit=10`);
+        if (!res.ok) {
+            throw new Error(`Ошибка сети: ${res.status} ${res.statusText} для ${res.url}`);
         }
-        const [guildStats, totalSessions, bestPlayer, roleDist, errorTypes, topErrors, guildRanking, topPlayers] = await Promise.all(
-            responses.map(res => res.json())
-        );
+        const { guildStats, totalSessions, bestPlayer, roleDistribution: roleDist, errorTypes, topErrors, guildRanking, topPlayers } = await res.json();
         skeletonHandler.hide('guild-avg-score', (guildStats.avgScore || 0).toFixed(2));
         skeletonHandler.hide('active-players', guildStats.activePlayers || 0);
         skeletonHandler.hide('total-sessions', `${totalSessions.guild_sessions || 0} / ${totalSessions.total || 0}`);
@@ -1985,24 +2028,21 @@ async function loadMentorForm() {
     const playerSelect = document.getElementById('player-select');
     if (playerSelect) {
         playerSelect.innerHTML = '<option value="" disabled selected>Загрузка игроков...</option>';
-        fetch('/api/players') 
-            .then(response => response.ok ? response.json() : Promise.reject(response))
-            .then(data => {
-                if (data.status === 'success') {
-                    playerSelect.innerHTML = '<option value="" disabled selected>Выберите игрока</option>';
-                    if (data.players.length === 0) {
-                        playerSelect.innerHTML = '<option value="" disabled>Нет игроков для оценки</option>';
-                        return;
-                    }
-                    data.players.forEach(player => {
-                        if (player.id !== currentPlayerId) {
-                            const option = document.createElement('option');
-                            option.value = player.id;
-                            option.textContent = player.nickname;
-                            playerSelect.appendChild(option);
-                        }
-                    });
+        fetchAllPages('/api/players?limit=200', 'players')
+            .then(players => {
+                playerSelect.innerHTML = '<option value="" disabled selected>Выберите игрока</option>';
+                if (players.length === 0) {
+                    playerSelect.innerHTML = '<option value="" disabled>Нет игроков для оценки</option>';
+                    return;
                 }
+                players.forEach(player => {
+                    if (player.id !== currentPlayerId) {
+                        const option = document.createElement('option');
+                        option.value = player.id;
+                        option.textContent = player.nickname;
+                        playerSelect.appendChild(option);
+                    }
+                });
             })
             .catch(() => playerSelect.innerHTML = '<option value="" disabled>Ошибка загрузки игроков</option>');
     }
@@ -2111,17 +2151,16 @@ function createCompareTrendChart(data, p1_id, p2_id) {
     const p1_data = data[p1_id].trend, p2_data = data[p2_id].trend;
     const p1_name = document.querySelector(`#compare-player1-select option[value='${p1_id}']`).textContent;
     const p2_name = document.querySelector(`#compare-player2-select option[value='${p2_id}']`).textContent;
-    const allWeeks = [...new Set([...p1_data.weeks, ...p2_data.weeks])].sort();
-    const p1_scores = allWeeks.map(week => p1_data.scores[p1_data.weeks.indexOf(week)] || null);
-    const p2_scores = allWeeks.map(week => p2_data.scores[p2_data.weeks.indexOf(week)] || null);
+    // Сервер возвращает ряды обоих игроков на общей оси корзин (пропуски - null)
+    const labels = p1_data.labels.length ? p1_data.labels : p2_data.labels;
     const ctx = prepareChartContainer(canvasId);
     charts[canvasId] = new Chart(ctx, {
         type: 'line',
         data: {
-            labels: allWeeks,
+            labels: labels,
             datasets: [
-                { label: p1_name, data: p1_scores, borderColor: chartColors.primary, backgroundColor: chartColors.transparentPrimary, tension: 0.3 },
-                { label: p2_name, data: p2_scores, borderColor: chartColors.secondary, backgroundColor: chartColors.transparentSecondary, tension: 0.3 }
+                { label: p1_name, data: p1_data.scores, borderColor: chartColors.primary, backgroundColor: chartColors.transparentPrimary, tension: 0.3, spanGaps: true },
+                { label: p2_name, data: p2_data.scores, borderColor: chartColors.secondary, backgroundColor: chartColors.transparentSecondary, tension: 0.3, spanGaps: true }
             ]
         },
         options: { responsive: true, scales: {y: {min: 0, max: 10}}}
@@ -2208,6 +2247,69 @@ function showSuccess(containerId, message) {
     messageContainer.insertBefore(successElement, messageContainer.firstChild);
     setTimeout(() => { successElement.remove(); }, 3000);
 }
+// --- Постраничная загрузка (keyset-курсоры API: ?cursor=...&limit=..., в ответе next_cursor) ---
+function withCursor(url, cursor) {
+    if (!cursor) return url;
+    return `${url}${url.includes('?') ? '&' : '?'}cursor=${encodeURIComponent(cursor)}`;
+}
+function fetchPage(url, cursor) {
+    return fetch(withCursor(url, cursor))
+        .then(response => response.ok ? response.json() : Promise.reject(response))
+        .then(data => data.status === 'success' ? data : Promise.reject(new Error(data.message)));
+}
+// Все страницы списка подряд (для <select>, где прокрутка не подгружает данные).
+// Без cursor начинает с первой страницы; cursor === null - продолжать нечего.
+async function fetchAllPages(url, key, cursor) {
+    const items = [];
+    let hasMore = cursor !== null;
+    while (hasMore) {
+        const data = await fetchPage(url, cursor);
+        items.push(...data[key]);
+        cursor = data.next_cursor;
+        hasMore = Boolean(cursor);
+    }
+    return items;
+}
+// Подгружает следующие страницы, когда sentinel (элемент в конце списка) попадает в область видимости.
+function lazyLoadPages(sentinel, url, key, cursor, onPage) {
+    if (!cursor) {
+        sentinel.remove();
+        return;
+    }
+    let loading = false;
+    const observer = new IntersectionObserver(entries => {
+        if (loading || !entries.some(entry => entry.isIntersecting)) return;
+        loading = true;
+        fetchPage(url, cursor)
+            .then(data => {
+                cursor = data.next_cursor;
+                onPage(data[key]);
+            })
+            .catch(err => {
+                console.error(err);
+                cursor = null;
+            })
+            .finally(() => {
+                loading = false;
+                observer.unobserve(sentinel);
+                if (cursor && sentinel.isConnected) {
+                    observer.observe(sentinel); // повторная проверка: страница могла не заполнить экран
+                } else {
+                    observer.disconnect();
+                    sentinel.remove();
+                }
+            });
+    });
+    observer.observe(sentinel);
+}
+function createPageSentinel(text = 'Загрузка...') {
+    const sentinel = document.createElement('p');
+    sentinel.className = 'page-sentinel placeholder';
+    sentinel.style.position = 'static';
+    sentinel.style.height = 'auto';
+    sentinel.textContent = text;
+    return sentinel;
+}
 function assignStudentToMentor(studentId) {
     fetch(`/api/mentors/students/${studentId}`, { method: 'POST' })
         .then(res => res.json())